@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Benchmarks locais do Cadu.
+# Uso: python benchmark.py {templates,conversa,fontes,memoria,todos} [--iteracoes N] [--saida ARQ.json] [--comparar ANTERIOR.json]
+# As suítes templates e conversa gravam os resultados em JSON para comparar execuções.
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import base64
+import json
+import tracemalloc
+import logging
+import platform
+import re
+import types
+from datetime import datetime
+
+# Nunca mexe no banco de produção: o banco de teste fica num RENDER_DISK_PATH temporário (criado logo após
+# o import), mesmo que a variável já exista no ambiente (no Render ela aponta para o disco de verdade).
+os.environ['RENDER_DISK_PATH'] = tempfile.mkdtemp(prefix='cadu_bench_')
+# Mede a renderização de fato, sem o cache de PDFs em disco.
+os.environ.setdefault('PDF_CACHE_MAX_MB', '0')
+# A conversa termina em awaiting_payment_proof: sem pré-cálculo, que rodaria em segundo plano durante a medição.
+os.environ.setdefault('PRECOMPUTE_DELIVERABLES', '0')
+import main
+main.init_database()
+
+logging.getLogger().setLevel(logging.WARNING)
+
+SAMPLE_RESUME = {
+    'nome_completo': 'Maria da Silva Souza', 'cidade_estado': 'Porto Alegre - RS', 'telefone': '(51) 99999-8888',
+    'email': 'maria.souza@email.com', 'cargo': 'Analista Administrativa',
+    'resumo': 'Profissional com experiência em rotinas administrativas, atendimento ao cliente e controle financeiro.',
+    'formacao': 'Graduação em Administração', 'habilidades': ['Comunicação', 'Pacote Office', 'Organização'],
+    'cursos': ['Excel Avançado', 'Gestão de Tempo'],
+    'experiencias': [{'cargo': 'Assistente Administrativa', 'empresa': 'Empresa X', 'periodo': 'Março de 2020 - Atual',
+                      'descricao': 'Responsável pelo controle de contas a pagar e receber, emissão de notas fiscais e atendimento a fornecedores.'}]
+}
+
+def summarize(samples_ms):
+    return f"média {statistics.mean(samples_ms):7.1f} ms | mediana {statistics.median(samples_ms):7.1f} ms | máx {max(samples_ms):7.1f} ms"
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        func()
+        samples.append(1000 * (time.perf_counter() - started_at))
+    return samples
+
+def bench_fonts(iterations):
+    # Frio: cada documento carrega e indexa os quatro TTF (comportamento antigo, um registro novo por PDF).
+    # Quente: o registro do processo já tem as fontes e só as instala no documento.
+    def cold_setup():
+        main.font_registry = main.FontRegistry()
+        main.PDF().add_font_setup()
+
+    def warm_setup():
+        main.PDF().add_font_setup()
+
+    output_path = os.path.join(tempfile.gettempdir(), 'cadu_bench_fonts.pdf')
+    original_registry = main.font_registry
+    try:
+        print(f"Setup de fontes ({iterations} iterações)")
+        print(f"  frio:   {summarize(measure(cold_setup, iterations))}")
+        main.font_registry = original_registry
+        warm_setup()
+        print(f"  quente: {summarize(measure(warm_setup, iterations))}")
+        for template in ('moderno', 'classico'):
+            def cold_render():
+                main.font_registry = main.FontRegistry()
+                main.generate_resume_pdf(SAMPLE_RESUME, template, output_path)
+
+            def warm_render():
+                main.generate_resume_pdf(SAMPLE_RESUME, template, output_path)
+
+            print(f"Renderização completa do template {template}")
+            print(f"  frio:   {summarize(measure(cold_render, iterations))}")
+            main.font_registry = original_registry
+            print(f"  quente: {summarize(measure(warm_render, iterations))}")
+    finally:
+        main.font_registry = original_registry
+        if os.path.exists(output_path): os.remove(output_path)
+
+def legacy_document_payload(pdf_bytes):
+    # Caminho antigo: PDF gravado em /tmp, relido, base64 em str, data URI e json.dumps do requests.
+    path = os.path.join(tempfile.gettempdir(), 'cadu_bench_legacy.pdf')
+    with open(path, 'wb') as f:
+        f.write(pdf_bytes)
+    with open(path, 'rb') as f:
+        doc_bytes = f.read()
+    doc_base64 = base64.b64encode(doc_bytes).decode('utf-8')
+    payload = {"phone": "5511999999999", "document": f"data:application/pdf;base64,{doc_base64}", "fileName": "Curriculo.pdf", "caption": ""}
+    body = json.dumps(payload).encode('utf-8')
+    os.remove(path)
+    return len(body)
+
+def inmemory_document_payload(pdf_bytes):
+    return len(main.build_document_body("5511999999999", pdf_bytes, "Curriculo.pdf").getbuffer())
+
+def peak_memory_kb(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(iterations):
+    # Pico de memória alocada (tracemalloc) por documento: renderização e montagem do payload do envio.
+    data = dict(SAMPLE_RESUME, experiencias=SAMPLE_RESUME['experiencias'] * 30, cursos=[f"Curso {i}" for i in range(60)])
+    pdf_bytes = main.generate_resume_pdf(data, 'moderno')
+    print(f"Documento de teste: {len(pdf_bytes) / 1024:.1f} KiB")
+    renders = [peak_memory_kb(main.generate_resume_pdf, data, 'moderno') for _ in range(iterations)]
+    print(f"{'renderização':>24}: pico médio {statistics.mean(renders):8.1f} KiB")
+    for name, func in (('payload antes (/tmp)', legacy_document_payload), ('payload depois (memória)', inmemory_document_payload)):
+        peaks = [peak_memory_kb(func, pdf_bytes) for _ in range(iterations)]
+        print(f"{name:>24}: pico médio {statistics.mean(peaks):8.1f} KiB | {statistics.mean(peaks) * 1024 / len(pdf_bytes):4.1f}x o PDF")
+
+# --- Currículos sintéticos ---
+def make_resume(size):
+    # curto: o mínimo do fluxo; tipico: o currículo médio; longo: muitas experiências e cursos, força quebras de página.
+    counts = {'curto': (0, 0, 1), 'tipico': (3, 4, 2), 'longo': (25, 60, 8)}
+    n_experiences, n_courses, paragraphs = counts[size]
+    description = ' '.join(["Coordenei rotinas da equipe, reduzi custos operacionais em 15% e implantei indicadores de desempenho."] * paragraphs)
+    return dict(SAMPLE_RESUME,
+                resumo=SAMPLE_RESUME['resumo'] * paragraphs,
+                habilidades=[f"Habilidade {i}" for i in range(3 + n_courses // 5)],
+                cursos=[f"Curso de Especialização {i}" for i in range(n_courses)],
+                experiencias=[{'cargo': f"Cargo {i}", 'empresa': f"Empresa {i}", 'periodo': f"Janeiro de {2000 + i % 24} - Dezembro de {2001 + i % 24}", 'descricao': description}
+                              for i in range(n_experiences)])
+
+def count_pages(pdf_bytes):
+    return len(re.findall(rb'/Type /Page\b', bytes(pdf_bytes)))
+
+def bench_templates(iterations):
+    results = {}
+    main.PDF().add_font_setup()
+    for template, render in (('moderno', main.generate_template_moderno), ('classico', main.generate_template_classico)):
+        for size in ('curto', 'tipico', 'longo'):
+            data = make_resume(size)
+            pdf_bytes = render(data)
+            samples = measure(lambda: render(data), iterations)
+            peak_kb = peak_memory_kb(render, data)
+            results[f"{template}/{size}"] = {
+                'ms_mean': round(statistics.mean(samples), 2), 'ms_median': round(statistics.median(samples), 2), 'ms_max': round(max(samples), 2),
+                'peak_memory_kb': round(peak_kb, 1), 'output_bytes': len(pdf_bytes), 'pages': count_pages(pdf_bytes)
+            }
+            print(f"{template:>9}/{size:<7} {summarize(samples)} | pico {peak_kb:8.1f} KiB | {len(pdf_bytes) / 1024:6.1f} KiB | {count_pages(pdf_bytes)} pág.")
+    return results
+
+# --- Conversa roteirizada com OpenAI e Z-API simuladas ---
+CONVERSATION_SCRIPT = [
+    ('awaiting_welcome', 'oi'), ('awaiting_plan_choice', 'premium'), ('choosing_template', '1'),
+    ('flow_nome_completo', 'maria da silva souza'), ('flow_cidade_estado', 'porto alegre rs'), ('flow_telefone', '51999998888'),
+    ('flow_email', 'maria@email.com'), ('flow_resumo', 'Sou organizada e gosto de trabalhar em equipe.'), ('flow_formacao', 'graduação em administração'),
+    ('flow_habilidades', 'comunicação, excel, organização'), ('flow_cursos', 'excel avançado'), ('flow_cursos', 'pronto'),
+    ('awaiting_experience_job_title', 'assistente administrativa'), ('awaiting_experience_company', 'empresa x'),
+    ('awaiting_experience_period', 'março de 2020 até hoje'), ('awaiting_experience_description', 'cuidava do financeiro e atendia fornecedores'),
+    ('awaiting_another_experience', 'não'), ('awaiting_improve_choice', 'não'), ('awaiting_review_choice', '2'),
+    ('awaiting_correction_input', 'curitiba pr'), ('awaiting_review_choice', 'finalizar')
+]
+
+def fake_openai_create(**kwargs):
+    last = kwargs['messages'][-1]['content']
+    if kwargs.get('response_format', {}).get('type') == 'json_object':
+        content = json.dumps({key: f"EN {value}" for key, value in json.loads(last).items()}) if last.startswith('{') else '{"verified": true}'
+    else:
+        content = last.split('Resposta do usuário: "')[-1].split('"')[0] if 'Resposta do usuário' in last else last[:200]
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+def fake_zapi_post(url, json=None, data=None, timeout=None):
+    if data is not None: data.read()
+    return types.SimpleNamespace(ok=True, status_code=200)
+
+def bench_conversation(iterations):
+    timers = {'persistence': 0.0}
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timers['persistence'] += time.perf_counter() - started_at
+        return wrapper
+
+    originals = (main.openai.api_key, main.openai.chat.completions.create, main.zapi_session.post, main.get_user, main.update_user)
+    main.openai.api_key = 'sk-benchmark'
+    main.openai.chat.completions.create = fake_openai_create
+    main.zapi_session.post = fake_zapi_post
+    main.get_user, main.update_user = timed(originals[3]), timed(originals[4])
+    per_step, totals = {}, []
+    try:
+        for iteration in range(iterations):
+            phone = f"55119{iteration:08d}"
+            for step, (state, text) in enumerate(CONVERSATION_SCRIPT):
+                timers['persistence'] = 0.0
+                started_at = time.perf_counter()
+                main.process_message(phone, {'text': text})
+                elapsed = time.perf_counter() - started_at
+                stats = per_step.setdefault(f"{step:02d}:{state}", {'total': [], 'persistence': []})
+                stats['total'].append(1000 * elapsed)
+                stats['persistence'].append(1000 * timers['persistence'])
+                totals.append(1000 * elapsed)
+    finally:
+        main.openai.api_key, main.openai.chat.completions.create, main.zapi_session.post, main.get_user, main.update_user = originals
+
+    results = {'ms_per_message_mean': round(statistics.mean(totals), 3), 'ms_per_message_p95': round(sorted(totals)[int(0.95 * (len(totals) - 1))], 3), 'steps': {}}
+    for step, stats in per_step.items():
+        total, persistence = statistics.mean(stats['total']), statistics.mean(stats['persistence'])
+        results['steps'][step] = {'ms_total': round(total, 3), 'ms_persistence': round(persistence, 3), 'ms_dispatch': round(total - persistence, 3)}
+        print(f"{step:<38} total {total:7.3f} ms | persistência {persistence:7.3f} ms | despacho/handler {total - persistence:7.3f} ms")
+    print(f"Média por mensagem: {results['ms_per_message_mean']:.3f} ms | p95 {results['ms_per_message_p95']:.3f} ms")
+    return results
+
+def compare_results(previous, current, prefix=''):
+    # Mostra a variação percentual de cada métrica numérica em relação a uma execução anterior.
+    for key, value in current.items():
+        old_value = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            compare_results(old_value or {}, value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(old_value, (int, float)) and old_value:
+            print(f"{prefix}{key}: {old_value} -> {value} ({100 * (value - old_value) / old_value:+.1f}%)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do Cadu")
+    parser.add_argument('suite', choices=['templates', 'conversa', 'fontes', 'memoria', 'todos'])
+    parser.add_argument('--iteracoes', type=int, default=20)
+    parser.add_argument('--saida', default='benchmark_resultados.json')
+    parser.add_argument('--comparar')
+    args = parser.parse_args()
+    results = {'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'iterations': args.iteracoes}}
+    if args.suite in ('templates', 'todos'):
+        print("== Templates ==")
+        results['templates'] = bench_templates(args.iteracoes)
+    if args.suite in ('conversa', 'todos'):
+        print("== Conversa ==")
+        results['conversation'] = bench_conversation(args.iteracoes)
+    if args.suite in ('fontes', 'todos'):
+        print("== Fontes ==")
+        bench_fonts(args.iteracoes)
+    if args.suite in ('memoria', 'todos'):
+        print("== Memória ==")
+        bench_memory(args.iteracoes)
+    if len(results) > 1:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Resultados gravados em {args.saida}")
+        if args.comparar:
+            with open(args.comparar, encoding='utf-8') as f:
+                compare_results(json.load(f), {key: value for key, value in results.items() if key != 'meta'})
@@ -0,0 +1,21 @@
+# Configuração do gunicorn: gunicorn -c gunicorn.conf.py "main:create_app()"
+# O master carrega o app uma vez (preload_app), o que cria/atualiza o schema antes do fork; cada worker
+# sobe a própria fila de tarefas e entra na eleição do agendador, que roda em um único worker por vez.
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))  # o webhook só enfileira; poucos threads bastam
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = True
+# Cada worker tem o próprio pool de renderização: divide os núcleos entre eles em vez de multiplicar.
+os.environ.setdefault('RENDER_PROCESSES', str(max(1, multiprocessing.cpu_count() // workers)))
+
+def post_worker_init(worker):
+    import main
+    main.start_background_services()
+
+def worker_exit(server, worker):
+    import main
+    main.stop_background_services()
@@ -2,19 +2,32 @@
 import os
 import sqlite3
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
+from shared import DATA_DIR, DATABASE_FILE, RateLimiter, mark_sessions_reminded
 
 # --- CONFIGURAÇÕES ---
 ZAPI_INSTANCE_ID = os.environ.get('ZAPI_INSTANCE_ID')
 ZAPI_TOKEN = os.environ.get('ZAPI_TOKEN')
 ZAPI_CLIENT_TOKEN = os.environ.get('ZAPI_CLIENT_TOKEN')
-DATA_DIR = os.environ.get('RENDER_DISK_PATH', '.')
-DATABASE_FILE = os.path.join(DATA_DIR, 'bot_database.db')
+CHECKPOINT_FILE = os.path.join(DATA_DIR, 'lembretes_checkpoint.json')
 BOT_NAME = "Cadu"
 
+# --- CONFIGS DE ENVIO ---
+REMINDER_RATE_PER_SECOND = float(os.environ.get('REMINDER_RATE_PER_SECOND', 5))  # ajustar à cota da Z-API
+REMINDER_WORKERS = int(os.environ.get('REMINDER_WORKERS', 4))
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 100))
+REMINDER_CONNECT_TIMEOUT = float(os.environ.get('REMINDER_CONNECT_TIMEOUT', 5))
+REMINDER_READ_TIMEOUT = float(os.environ.get('REMINDER_READ_TIMEOUT', 15))
+REMINDER_MAX_RUNTIME_SECONDS = float(os.environ.get('REMINDER_MAX_RUNTIME_SECONDS', 0))  # 0 = sem limite
+
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=REMINDER_WORKERS))
+session.headers.update({"Content-Type": "application/json", "Client-Token": ZAPI_CLIENT_TOKEN})
+
 def send_reminder(phone, user_name):
-    print(f"Preparando lembrete para {user_name} ({phone})...")
     url = f"https://api.z-api.io/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/send-text"
     message = (
         f"Olá, {user_name}! Sou o {BOT_NAME}, seu assistente de carreira. 👋\n\n"
@@ -22,12 +35,10 @@ def send_reminder(phone, user_name):
         "É só me responder aqui quando estiver pronto. 😉"
     )
     payload = {"phone": phone, "message": message}
-    headers = {"Content-Type": "application/json", "Client-Token": ZAPI_CLIENT_TOKEN}
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = session.post(url, json=payload, timeout=(REMINDER_CONNECT_TIMEOUT, REMINDER_READ_TIMEOUT))
         if response.status_code == 200:
-            print(f"Lembrete enviado com sucesso para {phone}")
             return True
         else:
             print(f"Falha ao enviar lembrete para {phone}: {response.text}")
@@ -36,56 +47,93 @@ def send_reminder(phone, user_name):
         print(f"Erro de conexão ao enviar lembrete para {phone}: {e}")
         return False
 
-def mark_reminder_as_sent(phone):
+def mark_reminders_as_sent(conn, users):
+    # Uma transação por lote, com a mesma marcação da varredura do bot (shared.mark_sessions_reminded).
+    mark_sessions_reminded(conn, [(user['phone'], user['state'], user['last_interaction']) for user in users], 'lembretes')
+
+def load_checkpoint():
+    # Uma execução interrompida (crash, timeout do cron) deixa o checkpoint; a próxima continua dele.
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET reminder_sent = 1, updated_at = ? WHERE phone = ?", (datetime.now(), phone))
-        conn.commit()
-        conn.close()
-        print(f"Usuário {phone} marcado como 'lembrete enviado'.")
-    except Exception as e:
-        print(f"Erro ao atualizar status do lembrete para {phone}: {e}")
+        with open(CHECKPOINT_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_checkpoint(checkpoint):
+    with open(f"{CHECKPOINT_FILE}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{CHECKPOINT_FILE}.tmp", CHECKPOINT_FILE)
+
+def first_name(resume_data):
+    try:
+        name = json.loads(resume_data or '{}').get('nome_completo') or 'tudo bem?'
+    except ValueError:
+        name = 'tudo bem?'
+    return name.split(' ')[0]
 
 def check_for_inactive_users():
     print(f"[{datetime.now().strftime('%d/%m/%Y %H:%M:%S')}] Iniciando verificação de usuários inativos...")
     if not os.path.exists(DATABASE_FILE):
         print("Banco de dados não encontrado. Saindo.")
         return
-        
+
+    checkpoint = load_checkpoint()
+    if checkpoint and datetime.fromisoformat(checkpoint['started_at']) < datetime.now() - timedelta(hours=24):
+        print("Checkpoint de mais de 24h encontrado; começando uma nova varredura.")
+        checkpoint = None
+    if checkpoint:
+        print(f"Retomando execução de {checkpoint['started_at']} a partir do telefone {checkpoint['last_phone']}.")
+    else:
+        checkpoint = {'started_at': datetime.now().isoformat(), 'time_threshold': str(datetime.now() - timedelta(hours=24)),
+                      'last_phone': '', 'scanned': 0, 'sent': 0, 'failed': 0}
+
+    bucket = RateLimiter(REMINDER_RATE_PER_SECOND)  # no máximo REMINDER_RATE_PER_SECOND envios/s, somando os workers
+    def send(user):
+        bucket.acquire()
+        try:
+            return send_reminder(user['phone'], first_name(user['resume_data']))
+        except Exception as e:
+            print(f"Erro ao processar usuário {user['phone']}: {e}")
+            return False
+
+    started_at, scanned, sent, failed, finished = time.monotonic(), 0, 0, 0, False
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        time_threshold = datetime.now() - timedelta(hours=24)
-        
-        cursor.execute(
-            "SELECT phone, resume_data FROM users WHERE state NOT IN ('completed', 'awaiting_welcome') AND updated_at < ? AND reminder_sent = 0",
-            (time_threshold,)
-        )
-        
-        inactive_users = cursor.fetchall()
+        with ThreadPoolExecutor(max_workers=REMINDER_WORKERS) as pool:
+            while True:
+                # Lê um lote por vez, em ordem de telefone, a partir do último lote concluído.
+                # Quem já recebeu lembrete fica em 'reminded' até voltar a interagir.
+                users = conn.execute(
+                    "SELECT phone, resume_data, state, last_interaction FROM users WHERE state NOT IN ('completed', 'awaiting_welcome', 'reminded', 'delivering', 'delivery_failed') "
+                    "AND last_interaction < ? AND phone > ? ORDER BY phone LIMIT ?",
+                    (checkpoint['time_threshold'], checkpoint['last_phone'], REMINDER_BATCH_SIZE)
+                ).fetchall()
+                if not users:
+                    finished = True
+                    break
+                results = list(pool.map(send, users))
+                sent_users = [user for user, ok in zip(users, results) if ok]
+                if sent_users: mark_reminders_as_sent(conn, sent_users)
+                scanned, sent, failed = scanned + len(users), sent + len(sent_users), failed + len(users) - len(sent_users)
+                checkpoint.update(last_phone=users[-1]['phone'], scanned=checkpoint['scanned'] + len(users),
+                                  sent=checkpoint['sent'] + len(sent_users), failed=checkpoint['failed'] + len(users) - len(sent_users))
+                save_checkpoint(checkpoint)
+                if REMINDER_MAX_RUNTIME_SECONDS and time.monotonic() - started_at > REMINDER_MAX_RUNTIME_SECONDS:
+                    print("Tempo máximo de execução atingido; a próxima execução continua deste ponto.")
+                    break
         conn.close()
     except sqlite3.OperationalError as e:
-        print(f"ERRO: Não foi possível ler o banco de dados: {e}.")
+        print(f"ERRO: Falha ao acessar o banco de dados: {e}.")
         return
 
-    if not inactive_users:
-        print("Nenhum usuário inativo para notificar.")
-        return
-
-    print(f"Encontrados {len(inactive_users)} usuários inativos para notificar.")
-    for user in inactive_users:
-        try:
-            resume_data = json.loads(user['resume_data'])
-            user_name = resume_data.get('nome_completo', 'tudo bem?').split(' ')[0]
-            if send_reminder(user['phone'], user_name):
-                mark_reminder_as_sent(user['phone'])
-        except Exception as e:
-            print(f"Erro ao processar usuário {user['phone']}: {e}")
-    
-    print("Verificação finalizada.")
+    if finished and os.path.exists(CHECKPOINT_FILE): os.remove(CHECKPOINT_FILE)
+    elapsed = time.monotonic() - started_at
+    print(f"Nesta execução: {scanned} usuários verificados, {sent} lembretes enviados, {failed} falhas em {elapsed:.1f}s "
+          f"({sent / elapsed if elapsed else 0:.1f} envios/s).")
+    if checkpoint['scanned'] != scanned:
+        print(f"Total desde {checkpoint['started_at']}: {checkpoint['scanned']} verificados, {checkpoint['sent']} enviados, {checkpoint['failed']} falhas.")
+    print("Verificação finalizada." if finished else "Verificação interrompida; será retomada na próxima execução.")
 
 if __name__ == "__main__":
     if not all([ZAPI_INSTANCE_ID, ZAPI_TOKEN]):
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Teste de carga do Cadu contra versões locais da Z-API e da OpenAI.
+# Uso: python loadtest.py [--usuarios N] [--concorrencia C] [--latencia-zapi MS] [--latencia-openai MS]
+#                         [--erro-zapi P] [--erro-openai P] [--pausa MS] [--saida ARQ.json]
+# Cada usuário simulado faz a conversa inteira pelo /webhook (HTTP de verdade), do "oi" ao comprovante,
+# espera a entrega dos PDFs e pede as perguntas de entrevista. O servidor local responde aos envios da
+# Z-API (send-text, send-document), às chamadas de chat da OpenAI (com e sem streaming) e serve as
+# imagens dos comprovantes, com latência e taxa de erro configuráveis.
+import os
+import io
+import time
+import json
+import random
+import argparse
+import tempfile
+import threading
+import logging
+import platform
+import re
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Nunca mexe no banco de produção nem nas chaves reais: sobrescreve sempre, mesmo que já estejam no
+# ambiente (no servidor do Render, RENDER_DISK_PATH aponta para o disco com o banco de verdade).
+os.environ['RENDER_DISK_PATH'] = tempfile.mkdtemp(prefix='cadu_loadtest_')
+os.environ['OPENAI_API_KEY'] = 'sk-loadtest'
+os.environ['ZAPI_INSTANCE_ID'] = 'loadtest'
+os.environ['ZAPI_TOKEN'] = 'loadtest'
+# Novas tentativas de entrega em segundos, e não em minutos, para caberem no teste.
+os.environ.setdefault('JOB_POLL_SECONDS', '0.2')
+os.environ.setdefault('JOB_RETRY_BASE_SECONDS', '1')
+import requests
+from PIL import Image, ImageDraw
+import main
+
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+IMAGE = object()  # marca o passo em que o usuário manda a foto do comprovante
+CONVERSATION_SCRIPT = [
+    ('awaiting_welcome', 'oi'), ('awaiting_plan_choice', 'premium'), ('choosing_template', '1'),
+    ('flow_nome_completo', 'maria da silva souza'), ('flow_cidade_estado', 'porto alegre rs'), ('flow_telefone', '51999998888'),
+    ('flow_email', 'maria@email.com'), ('flow_resumo', 'Sou organizada e gosto de trabalhar em equipe.'), ('flow_formacao', 'graduação em administração'),
+    ('flow_habilidades', 'comunicação, excel, organização'), ('flow_cursos', 'excel avançado'), ('flow_cursos', 'pronto'),
+    ('awaiting_experience_job_title', 'assistente administrativa'), ('awaiting_experience_company', 'empresa x'),
+    ('awaiting_experience_period', 'março de 2020 até hoje'), ('awaiting_experience_description', 'cuidava do financeiro e atendia fornecedores'),
+    ('awaiting_another_experience', 'não'), ('awaiting_improve_choice', 'sim'), ('awaiting_review_choice', 'finalizar'),
+    ('awaiting_payment_proof', IMAGE), ('awaiting_interview_prep_choice', 'sim')
+]
+DELIVERY_TIMEOUT_SECONDS = 120
+MESSAGE_TIMEOUT_SECONDS = 60
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+def summarize(samples_ms):
+    return {'count': len(samples_ms), 'p50_ms': round(percentile(samples_ms, 50), 1), 'p95_ms': round(percentile(samples_ms, 95), 1),
+            'p99_ms': round(percentile(samples_ms, 99), 1), 'max_ms': round(max(samples_ms), 1)}
+
+# ==============================================================================
+# --- Z-API e OpenAI locais
+# ==============================================================================
+def receipt_image(seed):
+    # Comprovante diferente por usuário: imagens iguais seriam barradas como comprovante reutilizado.
+    rng = random.Random(seed)
+    image = Image.new('RGB', (1080, 2160), 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        top = rng.randint(0, 2100)
+        draw.rectangle([rng.randint(0, 400), top, rng.randint(500, 1060), top + rng.randint(10, 60)], fill=(rng.randint(0, 150),) * 3)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def fake_completion_text(body):
+    # Respostas plausíveis para cada tipo de pedido que o bot faz, reconhecido pelo prompt.
+    messages = body['messages']
+    system, last = messages[0]['content'], messages[-1]['content']
+    if isinstance(last, list): return json.dumps({'verified': True})
+    if 'tradutor' in system: return json.dumps({key: f"EN {value}" for key, value in json.loads(last).items()}, ensure_ascii=False)
+    if 'otimiza currículos' in system:
+        experiences = json.loads(last.split('Experiências originais: ', 1)[1].split('\n\n', 1)[0])
+        return json.dumps([dict(item, descricao=f"Conduziu {item.get('descricao', '')}") for item in experiences], ensure_ascii=False)
+    if 'recrutador' in system:
+        return '\n'.join(f"{i}. Conte sobre uma situação em que você precisou resolver o problema {i} da sua última vaga." for i in range(1, 6))
+    if 'extrai dados de currículo' in system: return '{}'
+    match = re.search(r'Resposta do usuário: "(.*)"', last, re.DOTALL)
+    return match.group(1) if match else last[:200]
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, zapi_latency_ms, openai_latency_ms, zapi_error_rate, openai_error_rate):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.zapi_latency_ms, self.openai_latency_ms = zapi_latency_ms, openai_latency_ms
+        self.zapi_error_rate, self.openai_error_rate = zapi_error_rate, openai_error_rate
+        self.images = {}
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.documents_by_phone = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, key):
+        with self.lock: self.counts[key] = self.counts.get(key, 0) + 1
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sleep(self, mean_ms):
+        if mean_ms > 0: time.sleep(mean_ms * random.uniform(0.5, 1.5) / 1000)
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        image = self.server.images.get(self.path)
+        if image is None: return self._reply(404, b'{}')
+        self._reply(200, image, 'image/jpeg')
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if '/chat/completions' in self.path: return self._openai(body)
+        if '/instances/' in self.path: return self._zapi(body)
+        self._reply(404, b'{}')
+
+    def _zapi(self, body):
+        server = self.server
+        endpoint = self.path.split('/token/', 1)[-1].split('/', 1)[-1]
+        self._sleep(server.zapi_latency_ms)
+        if random.random() < server.zapi_error_rate:
+            server.count(f'zapi_{endpoint}_erro')
+            return self._reply(500, b'{"error": "injetado"}')
+        server.count(f'zapi_{endpoint}')
+        if endpoint.startswith('send-document'):
+            with server.lock: server.documents_by_phone[body.get('phone')] = server.documents_by_phone.get(body.get('phone'), 0) + 1
+        self._reply(200, json.dumps({'zaapId': 'loadtest', 'messageId': str(random.getrandbits(48))}).encode())
+
+    def _openai(self, body):
+        server = self.server
+        self._sleep(server.openai_latency_ms)
+        if random.random() < server.openai_error_rate:
+            server.count('openai_erro')
+            return self._reply(500, json.dumps({'error': {'message': 'erro injetado', 'type': 'server_error'}}).encode())
+        server.count('openai_stream' if body.get('stream') else 'openai')
+        content = fake_completion_text(body)
+        base = {'id': 'chatcmpl-loadtest', 'created': int(time.time()), 'model': body.get('model')}
+        usage = {'prompt_tokens': len(json.dumps(body['messages'])) // 4, 'completion_tokens': len(content) // 4}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not body.get('stream'):
+            choice = {'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+            return self._reply(200, json.dumps(dict(base, object='chat.completion', choices=[choice], usage=usage)).encode())
+        # Streaming (SSE em chunked): pedaços de ~40 caracteres, um a cada 5 ms.
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        def event(data):
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        chunk = dict(base, object='chat.completion.chunk')
+        for start in range(0, len(content), 40):
+            event(json.dumps(dict(chunk, choices=[{'index': 0, 'delta': {'content': content[start:start + 40]}, 'finish_reason': None}])))
+            time.sleep(0.005)
+        event(json.dumps(dict(chunk, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])))
+        event(json.dumps(dict(chunk, choices=[], usage=usage)))
+        event('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+# ==============================================================================
+# --- Usuários simulados
+# ==============================================================================
+class LoadTest:
+    def __init__(self, standin, bot_url, pause_ms):
+        self.standin, self.bot_url, self.pause_ms = standin, bot_url, pause_ms
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=64))
+        self.lock = threading.Lock()
+        self.latencies = {}  # estado -> [ms], do POST no /webhook até o fim do processamento da mensagem
+        self.errors = {}
+        self.messages = 0
+        self._done = {}
+
+    def record(self, state, elapsed_ms):
+        with self.lock: self.latencies.setdefault(state, []).append(elapsed_ms)
+
+    def error(self, kind):
+        with self.lock: self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def instrument(self):
+        # Sabe quando o bot terminou cada mensagem (respostas já enviadas à Z-API local).
+        process_message = main.process_message
+        def instrumented(phone, message_data):
+            try:
+                process_message(phone, message_data)
+            except Exception:
+                self.error('excecao_no_handler')
+                raise
+            finally:
+                event = self._done.get(phone)
+                if event: event.set()
+        main.process_message = instrumented
+
+    def post(self, phone, payload):
+        started_at = time.perf_counter()
+        event = self._done[phone] = threading.Event()
+        response = self.session.post(f"{self.bot_url}/webhook", json=dict(payload, phone=phone), timeout=30)
+        self.record('http_webhook', 1000 * (time.perf_counter() - started_at))
+        with self.lock: self.messages += 1
+        if response.status_code != 200:
+            self.error(f'webhook_http_{response.status_code}')
+            return None
+        if not event.wait(MESSAGE_TIMEOUT_SECONDS):
+            self.error('timeout_mensagem')
+            return None
+        return 1000 * (time.perf_counter() - started_at)
+
+    def wait_for_state(self, phone, states, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            main.user_cache.invalidate(phone)
+            user = main.get_user(phone)
+            if user and user['state'] in states: return user['state']
+            time.sleep(0.02)
+        return None
+
+    def run_user(self, index):
+        phone = f"5599{index:09d}"
+        image_path = f"/media/comprovante_{phone}.jpg"
+        self.standin.images[image_path] = receipt_image(index)
+        started_at = time.perf_counter()
+        for expected_state, text in CONVERSATION_SCRIPT:
+            user = main.get_user(phone)
+            state = user['state'] if user else 'awaiting_welcome'
+            if state != expected_state:
+                self.error(f'estado_inesperado:{expected_state}->{state}')
+                return False
+            payload = {'type': 'image', 'imageUrl': f"{self.standin.url}{image_path}"} if text is IMAGE else {'text': {'message': text}}
+            sent_at = time.perf_counter()
+            elapsed_ms = self.post(phone, payload)
+            if elapsed_ms is None: return False
+            self.record(expected_state, elapsed_ms)
+            if text is IMAGE:
+                final_state = self.wait_for_state(phone, ('awaiting_interview_prep_choice', 'delivery_failed'), DELIVERY_TIMEOUT_SECONDS)
+                if final_state != 'awaiting_interview_prep_choice':
+                    self.error(f'entrega:{final_state or "timeout"}')
+                    return False
+                self.record('entrega_completa', 1000 * (time.perf_counter() - sent_at))
+            if self.pause_ms: time.sleep(self.pause_ms / 1000)
+        self.record('conversa_completa', 1000 * (time.perf_counter() - started_at))
+        return True
+
+def run_load_test(args):
+    standin = StandInServer(args.latencia_zapi, args.latencia_openai, args.erro_zapi, args.erro_openai)
+    threading.Thread(target=standin.serve_forever, name='standin', daemon=True).start()
+    main.ZAPI_BASE_URL = standin.url
+    main.openai.base_url = f"{standin.url}/v1/"
+
+    from werkzeug.serving import make_server
+    bot_server = make_server('127.0.0.1', 0, main.create_app(), threaded=True)
+    threading.Thread(target=bot_server.serve_forever, name='bot', daemon=True).start()
+    test = LoadTest(standin, f"http://127.0.0.1:{bot_server.server_port}", args.pausa)
+    test.instrument()
+
+    print(f"{args.usuarios} usuários, {args.concorrencia} simultâneos | Z-API {args.latencia_zapi} ms (erro {args.erro_zapi:.0%}) | OpenAI {args.latencia_openai} ms (erro {args.erro_openai:.0%})")
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia, thread_name_prefix='usuario') as pool:
+        outcomes = list(pool.map(test.run_user, range(args.usuarios)))
+    elapsed = time.perf_counter() - started_at
+    bot_server.shutdown()
+    standin.shutdown()
+
+    completed = sum(outcomes)
+    results = {
+        'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'users': args.usuarios,
+                 'concurrency': args.concorrencia, 'zapi_latency_ms': args.latencia_zapi, 'openai_latency_ms': args.latencia_openai,
+                 'zapi_error_rate': args.erro_zapi, 'openai_error_rate': args.erro_openai},
+        'elapsed_s': round(elapsed, 2), 'messages': test.messages,
+        'throughput': {'messages_per_s': round(test.messages / elapsed, 2), 'conversations_per_min': round(60 * completed / elapsed, 2)},
+        'completed_users': completed, 'user_error_rate': round(1 - completed / args.usuarios, 4) if args.usuarios else 0.0,
+        'errors': test.errors, 'stand_in_requests': standin.counts,
+        'documents_missing': sum(1 for i in range(args.usuarios) if standin.documents_by_phone.get(f"5599{i:09d}", 0) < 2),
+        'latency': {state: summarize(samples) for state, samples in test.latencies.items()},
+    }
+    order = [state for state, _ in CONVERSATION_SCRIPT]
+    for state in sorted(results['latency'], key=lambda state: (order.index(state) if state in order else len(order), state)):
+        stats = results['latency'][state]
+        print(f"{state:<34} n={stats['count']:<5} p50 {stats['p50_ms']:8.1f} ms | p95 {stats['p95_ms']:8.1f} ms | p99 {stats['p99_ms']:8.1f} ms")
+    print(f"Tempo total {elapsed:.1f}s | {results['throughput']['messages_per_s']} msg/s | {results['throughput']['conversations_per_min']} conversas/min")
+    print(f"Usuários concluídos: {completed}/{args.usuarios} (taxa de erro {results['user_error_rate']:.1%}) | erros: {test.errors or 'nenhum'}")
+    print(f"Requisições ao servidor local: {standin.counts}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do Cadu com Z-API e OpenAI locais")
+    parser.add_argument('--usuarios', type=int, default=50)
+    parser.add_argument('--concorrencia', type=int, default=10)
+    parser.add_argument('--latencia-zapi', type=float, default=80, help="latência média da Z-API local, em ms")
+    parser.add_argument('--latencia-openai', type=float, default=400, help="latência média (até o primeiro token) da OpenAI local, em ms")
+    parser.add_argument('--erro-zapi', type=float, default=0.0, help="fração de envios à Z-API que devolvem HTTP 500")
+    parser.add_argument('--erro-openai', type=float, default=0.0, help="fração de chamadas à OpenAI que devolvem HTTP 500")
+    parser.add_argument('--pausa', type=float, default=0, help="pausa do usuário entre mensagens, em ms")
+    parser.add_argument('--saida', default='loadtest_resultados.json')
+    args = parser.parse_args()
+    results = run_load_test(args)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.saida}")
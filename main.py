@@ -5,17 +5,41 @@
 # --- 1. IMPORTAÇÕES E CONFIGURAÇÕES INICIAIS
 # ==============================================================================
 import os
+import re
+import bisect
+import contextlib
+import unicodedata
+import hashlib
+import random
+import socket
+import tempfile
+import copy
+import types
+import io
+import base64
 import sqlite3
 import json
-import base64
+import binascii
 import logging
 import threading
+import time
+import queue
+import multiprocessing
+import atexit
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 import requests
 import openai
 from flask import Flask, request, jsonify
 from fpdf import FPDF
+from fpdf.fonts import SubsetMap
+from fontTools import ttLib
 from apscheduler.schedulers.background import BackgroundScheduler
+from PIL import Image, ImageOps
+from shared import SCRIPT_DIR, DATA_DIR, DATABASE_FILE, RateLimiter
+import shared
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -35,10 +59,18 @@ REINICIAR_COMMANDS = ['oi', 'ola', 'olá', 'recomeçar', 'começar', 'menu', 'in
 ZAPI_INSTANCE_ID = os.environ.get('ZAPI_INSTANCE_ID')
 ZAPI_TOKEN = os.environ.get('ZAPI_TOKEN')
 ZAPI_CLIENT_TOKEN = os.environ.get('ZAPI_CLIENT_TOKEN')
+ZAPI_BASE_URL = os.environ.get('ZAPI_BASE_URL', 'https://api.z-api.io')  # outro endereço só em testes (ver loadtest.py)
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # idem; vazio usa a API oficial
+OPENAI_DEFAULT_MODEL = os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-4o')
+OPENAI_FAST_MODEL = os.environ.get('OPENAI_FAST_MODEL', 'gpt-4o-mini')
+OPENAI_CACHE_MAX_MB = float(os.environ.get('OPENAI_CACHE_MAX_MB', 50))
+OPENAI_CACHE_TTL_DAYS = float(os.environ.get('OPENAI_CACHE_TTL_DAYS', 30))
+LOCAL_EXTRACTION_MIN_CONFIDENCE = float(os.environ.get('LOCAL_EXTRACTION_MIN_CONFIDENCE', 0.9))
 
 try:
     openai.api_key = OPENAI_API_KEY
+    if OPENAI_BASE_URL: openai.base_url = OPENAI_BASE_URL
     if not OPENAI_API_KEY or not OPENAI_API_KEY.startswith("sk-"): raise ValueError("Chave da OpenAI inválida.")
     logging.info("API da OpenAI configurada com sucesso.")
 except Exception as e:
@@ -49,123 +81,1259 @@ PIX_RECIPIENT_NAME = "Leonardo Maciel Abbadi"
 PIX_PAYLOAD_STRING = "00020126580014br.gov.bcb.pix0136fd3412eb-9577-41ea-ba4d-12293570c0155204000053039865802BR5922Leonardo Maciel Abbadi6008Brasilia62240520daqr1894289448628220630439D1"
 PRECO_BASICO, PRECO_PREMIUM, PRECO_REVISAO_HUMANA, PRECO_ASSINATURA = 7.99, 13.99, 16.99, 19.90
 CREDITOS_BASICO, CREDITOS_PREMIUM, CREDITOS_ASSINATURA = 3, 5, 99
+ENGLISH_PLANS = ('premium', 'revisao_humana', 'assinatura')  # planos que recebem também a versão em inglês
+
+# --- CONFIGS DE COMPROVANTES PIX ---
+PIX_IMAGE_MAX_BYTES = int(os.environ.get('PIX_IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+PIX_IMAGE_MAX_LONG_SIDE = int(os.environ.get('PIX_IMAGE_MAX_LONG_SIDE', 2048))
+PIX_IMAGE_MAX_SHORT_SIDE = int(os.environ.get('PIX_IMAGE_MAX_SHORT_SIDE', 768))  # o modelo de visão reduz para isso em 'high'
+PIX_IMAGE_JPEG_QUALITY = int(os.environ.get('PIX_IMAGE_JPEG_QUALITY', 85))
+PIX_PHASH_BANDS = 4
+PIX_PHASH_MAX_DISTANCE = PIX_PHASH_BANDS - 1  # bits diferentes no dHash para considerar o mesmo comprovante
 
 # --- CAMINHOS DE ARQUIVOS ---
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.environ.get('RENDER_DISK_PATH', SCRIPT_DIR)
-DATABASE_FILE = os.path.join(DATA_DIR, 'cadu_database.db')
+# SCRIPT_DIR, DATA_DIR e DATABASE_FILE vêm de shared.py (também usados por lembretes.py).
+OPENAI_CACHE_FILE = os.path.join(DATA_DIR, 'openai_cache.db')
 FONT_DIR = os.path.join(SCRIPT_DIR, 'fonts')
-TEMP_DIR = "/tmp"
-if not os.path.exists(TEMP_DIR): os.makedirs(TEMP_DIR)
+PDF_CACHE_DIR = os.path.join(DATA_DIR, 'pdf_cache')
+PDF_CACHE_MAX_MB = float(os.environ.get('PDF_CACHE_MAX_MB', 200))
+JOB_FILES_DIR = os.path.join(DATA_DIR, 'job_files')
+
+# --- CONFIGS DE PROCESSAMENTO DE MENSAGENS ---
+WEBHOOK_ASYNC = os.environ.get('WEBHOOK_ASYNC', '1') == '1'
+MESSAGE_WORKERS = int(os.environ.get('MESSAGE_WORKERS', 8))
+MESSAGE_QUEUE_MAX = int(os.environ.get('MESSAGE_QUEUE_MAX', 1000))
+INBOX_LEASE_SECONDS = float(os.environ.get('INBOX_LEASE_SECONDS', 60))
+MAINTENANCE_INTERVAL_SECONDS = float(os.environ.get('MAINTENANCE_INTERVAL_SECONDS', 10))
+
+# --- CONFIGS DE ENVIO (Z-API) ---
+ZAPI_MAX_CONCURRENCY = int(os.environ.get('ZAPI_MAX_CONCURRENCY', 10))
+ZAPI_COALESCE_WINDOW_MS = int(os.environ.get('ZAPI_COALESCE_WINDOW_MS', 0))
+ZAPI_COALESCE_MAX_CHARS = int(os.environ.get('ZAPI_COALESCE_MAX_CHARS', 4000))
+
+# --- CONFIGS DE ENTREGA ---
+DELIVERY_STAGE_WORKERS = int(os.environ.get('DELIVERY_STAGE_WORKERS', 8))
+DELIVERY_WORKERS = int(os.environ.get('DELIVERY_WORKERS', 4))
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', min(4, os.cpu_count() or 1)))  # 0 = renderiza no próprio processo
+RENDER_QUEUE_MAX = int(os.environ.get('RENDER_QUEUE_MAX', 20))
+PRECOMPUTE_DELIVERABLES = os.environ.get('PRECOMPUTE_DELIVERABLES', '1') == '1'
+PRECOMPUTE_MAX_AGE_HOURS = float(os.environ.get('PRECOMPUTE_MAX_AGE_HOURS', 72))
+# Tarefas especulativas: vão para o fim da fila e nunca ocupam o primeiro worker, reservado às entregas.
+BACKGROUND_JOB_KINDS = ('precompute',)
+
+# --- CONFIGS DE LEMBRETES ---
+ABANDONED_SESSION_HOURS = float(os.environ.get('ABANDONED_SESSION_HOURS', 24))
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+REMINDER_WORKERS = int(os.environ.get('REMINDER_WORKERS', 8))
+REMINDER_RATE_PER_SECOND = float(os.environ.get('REMINDER_RATE_PER_SECOND', 20))
+
+# --- CONFIGS DA FILA DE TAREFAS ---
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 6))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS', 10))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get('JOB_RETRY_MAX_SECONDS', 900))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 2))
+
+# --- CONFIGS DO AGENDADOR (um único worker eleito roda as tarefas periódicas) ---
+SCHEDULER_LEASE_SECONDS = float(os.environ.get('SCHEDULER_LEASE_SECONDS', 60))
+ABANDONED_CHECK_INTERVAL_HOURS = float(os.environ.get('ABANDONED_CHECK_INTERVAL_HOURS', 6))
+
+# --- MÉTRICAS (formato texto do Prometheus, servidas em /metrics) ---
+WEBHOOK_LOG_SAMPLE_RATE = float(os.environ.get('WEBHOOK_LOG_SAMPLE_RATE', 0.05))
+WEBHOOK_LOG_MAX_CHARS = int(os.environ.get('WEBHOOK_LOG_MAX_CHARS', 500))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+metrics_registry = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs: return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock: items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in items]
+        return '\n'.join(lines)
+
+class Histogram:
+    # Só guarda contagens por faixa e a soma de cada série: observar custa um bisect e um lock.
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names, self.buckets = name, help_text, label_names, tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *labels)
+
+    def render(self):
+        with self._lock: items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return '\n'.join(lines)
+
+handler_seconds = Histogram('cadu_handler_duration_seconds', 'Tempo de processamento de uma mensagem por estado (chave de state_handlers).', ('state',))
+openai_seconds = Histogram('cadu_openai_request_duration_seconds', 'Duração das chamadas à OpenAI (sem acertos de cache) por tarefa e modelo.', ('task', 'model'))
+openai_tokens = Counter('cadu_openai_tokens_total', 'Tokens consumidos na OpenAI.', ('task', 'type'))
+openai_errors = Counter('cadu_openai_errors_total', 'Chamadas à OpenAI que falharam ou não passaram na validação.', ('task', 'model'))
+openai_cache_hits = Counter('cadu_openai_cache_hits_total', 'Respostas servidas pelo cache de completions.', ('task',))
+openai_first_token_seconds = Histogram('cadu_openai_first_token_seconds', 'Tempo até o primeiro pedaço de texto nas respostas em streaming.', ('model',))
+openai_escalations = Counter('cadu_openai_escalations_total', 'Pedidos repetidos no modelo maior após falha do modelo da rota.', ('task',))
+zapi_seconds = Histogram('cadu_zapi_request_duration_seconds', 'Latência dos envios à Z-API.', ('endpoint',))
+zapi_errors = Counter('cadu_zapi_errors_total', 'Envios à Z-API com erro (HTTP ou conexão).', ('endpoint', 'reason'))
+sqlite_seconds = Histogram('cadu_sqlite_duration_seconds', 'Tempo gasto no SQLite por operação.', ('operation',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+delivery_stage_seconds = Histogram('cadu_delivery_stage_duration_seconds', 'Duração das etapas da entrega.', ('stage',))
+pix_receipt_results = Counter('cadu_pix_receipts_total', 'Comprovantes PIX analisados, por resultado.', ('result',))
+precompute_results = Counter('cadu_precompute_results_total', 'Entregáveis pré-calculados durante a espera do pagamento, por resultado.', ('result',))
 
 # ==============================================================================
 # --- 3. FUNÇÕES DE BANCO DE DADOS
 # ==============================================================================
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 5000))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 300))
+USER_CACHE_SYNC_SECONDS = float(os.environ.get('USER_CACHE_SYNC_SECONDS', 2))
+# Uma invalidação mais velha que o TTL do cache só afetaria entradas que já expiraram em todos os workers.
+USER_INVALIDATIONS_RETENTION_SECONDS = max(USER_CACHE_TTL_SECONDS, USER_CACHE_SYNC_SECONDS) + 60
+JSON_COLUMNS = ('resume_data', 'current_experience')
+JSON1_AVAILABLE = None
+_db_local = threading.local()
+SCHEMA_VERSION = 3  # Incrementar ao mudar as tabelas de init_database, para o DDL rodar de novo no próximo deploy.
+
+USER_DEFAULTS = {
+    'state': 'awaiting_welcome', 'resume_data': json.dumps({'cargo': ''}),
+    'plan': 'none', 'template': 'none', 'payment_verified': 0,
+    'current_experience': json.dumps({}), 'payment_timestamp': None,
+    'credits': 0, 'subscription_valid_until': None, 'editing_field': None
+}
+
+def get_db_connection(path=None):
+    # Uma conexão por thread (e por arquivo), reaproveitada entre requisições: evita o custo de abrir
+    # o arquivo a cada chamada e mantém o cache de prepared statements do sqlite3 (cached_statements) quente.
+    path = path or DATABASE_FILE
+    conns = getattr(_db_local, 'conns', None)
+    if conns is None: conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conns[path] = conn
+    return conn
+
+def close_db_connection():
+    for conn in getattr(_db_local, 'conns', {}).values(): conn.close()
+    _db_local.conns = {}
+
 def init_database():
-    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            phone TEXT PRIMARY KEY, state TEXT, resume_data TEXT,
-            plan TEXT DEFAULT 'none', template TEXT DEFAULT 'none',
-            payment_verified INTEGER DEFAULT 0, last_interaction TIMESTAMP,
-            current_experience TEXT, payment_timestamp TIMESTAMP,
-            credits INTEGER DEFAULT 0, subscription_valid_until TIMESTAMP,
-            editing_field TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    logging.info("Banco de dados inicializado com novo schema.")
+    # Roda em todo processo, mas o DDL só quando o banco está numa versão anterior a SCHEMA_VERSION (uma
+    # vez por deploy que muda o schema); nos demais casos é só a leitura de PRAGMA user_version.
+    # BEGIN IMMEDIATE serializa os workers do gunicorn que sobem ao mesmo tempo.
+    conn = get_db_connection()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION: return False
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            conn.rollback()
+            return False
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                phone TEXT PRIMARY KEY, state TEXT, resume_data TEXT,
+                plan TEXT DEFAULT 'none', template TEXT DEFAULT 'none',
+                payment_verified INTEGER DEFAULT 0, last_interaction TIMESTAMP,
+                current_experience TEXT, payment_timestamp TIMESTAMP,
+                credits INTEGER DEFAULT 0, subscription_valid_until TIMESTAMP,
+                editing_field TEXT
+            )
+        ''')
+        # Todo update_user (e processos externos, como lembretes.py) registra aqui o telefone alterado, para
+        # que os caches de usuários dos outros workers descartem a entrada. `origin` é o processo que gravou.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, phone TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, origin TEXT
+            )
+        ''')
+        if 'origin' not in [row['name'] for row in conn.execute("PRAGMA table_info(user_invalidations)")]:
+            conn.execute("ALTER TABLE user_invalidations ADD COLUMN origin TEXT")
+        # Caixa de entrada por telefone, que ordena as mensagens entre os workers; ver PhoneInbox.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS inbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, phone TEXT NOT NULL, payload TEXT NOT NULL,
+                owner TEXT, lease_until REAL, created_at REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_phone ON inbox (phone, id)")
+        # A varredura de sessões abandonadas percorre este índice por estado, sem ler a tabela.
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_state_last_interaction ON users (state, last_interaction, phone)")
+        # Fila durável de tarefas longas (entregas); ver JobQueue.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, phone TEXT, payload TEXT,
+                status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, max_attempts INTEGER,
+                run_after REAL, lease_owner TEXT, lease_until REAL, checkpoints TEXT DEFAULT '{}',
+                last_error TEXT, created_at REAL, updated_at REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, run_after)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_phone ON jobs (phone, kind, status)")
+        # Comprovantes PIX já analisados (hash exato e perceptual); ver ReceiptRegistry.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pix_receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sha256 TEXT, phash TEXT,
+                band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+                phone TEXT, verified INTEGER, created_at REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pix_receipts_sha256 ON pix_receipts (sha256)")
+        for band in range(PIX_PHASH_BANDS):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_pix_receipts_band{band} ON pix_receipts (band{band})")
+        # PDFs e tradução preparados enquanto o usuário paga; ver PrecomputedDeliverables.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS precomputed_deliverables (
+                phone TEXT PRIMARY KEY, resume_hash TEXT, pt_pdf BLOB,
+                english_data TEXT, en_pdf BLOB, created_at REAL
+            )
+        ''')
+        # Eleição do processo que roda as tarefas agendadas e a última execução de cada uma; ver ElectedScheduler.
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, lease_until REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS scheduler_runs (job TEXT PRIMARY KEY, last_run REAL)")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logging.info(f"Banco de dados inicializado com o schema versão {SCHEMA_VERSION} (WAL).")
+    return True
+
+class UserCache:
+    # Cache write-through (LRU + TTL) das linhas de `users`, com resume_data e current_experience
+    # já decodificados. Quem lê recebe uma cópia própria da linha (inclusive dos dicts JSON): alterações
+    # só chegam ao cache e ao banco via update_user.
+    def __init__(self, max_size, ttl):
+        self.max_size, self.ttl = max_size, ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sync, self._last_invalidation_id = 0.0, None
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, phone):
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(phone)
+                self.hits += 1
+                return copy_user_row(entry[1])
+            if entry: del self._entries[phone]
+            self.misses += 1
+            return None
+
+    def put(self, phone, user):
+        with self._lock:
+            self._entries[phone] = (time.monotonic(), user)
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def apply(self, phone, data, resume_fields=None, resume_append=None, resume_prepend=None):
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry:
+                entry[1].update(data)
+                if resume_fields or resume_append or resume_prepend:
+                    apply_resume_patch(entry[1]['resume_data'], resume_fields, resume_append, resume_prepend)
+
+    def invalidate(self, phone=None):
+        with self._lock:
+            if phone is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(phone, None):
+                self.invalidations += 1
+
+    def sync(self, conn, force=False):
+        # Consulta user_invalidations no máximo a cada USER_CACHE_SYNC_SECONDS (ou sempre, com `force`).
+        # Gravações deste próprio processo já estão no cache.
+        now = time.monotonic()
+        if not force and now - self._last_sync < USER_CACHE_SYNC_SECONDS: return
+        self._last_sync = now
+        if self._last_invalidation_id is None:
+            self._last_invalidation_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM user_invalidations").fetchone()[0]
+            return
+        rows = conn.execute("SELECT id, phone, origin FROM user_invalidations WHERE id > ? ORDER BY id", (self._last_invalidation_id,)).fetchall()
+        origin = process_identity()
+        changed = {row['phone'] for row in rows if row['origin'] != origin}
+        for phone in changed: self.invalidate(phone)
+        if rows: self._last_invalidation_id = rows[-1]['id']
+        # Entregáveis pré-calculados por este processo também podem ter ficado velhos com a edição.
+        for phone in changed: precomputed_deliverables.revalidate(phone)
+
+    def check_version(self, phone, last_interaction):
+        # last_interaction muda a cada gravação da linha: se o do banco é outro, a entrada ficou velha.
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry and entry[1].get('last_interaction') != last_interaction:
+                del self._entries[phone]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions, 'invalidations': self.invalidations
+            }
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
+def process_identity():
+    # Identifica o processo (worker do gunicorn) nas tabelas compartilhadas; calculado na hora, depois do fork.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def copy_user_row(user):
+    # Cópia da linha com os dicts JSON copiados também; o cache nunca entrega os seus próprios objetos.
+    return {key: copy.deepcopy(value) if key in JSON_COLUMNS else value for key, value in user.items()}
+
+def _cached_value(key, value):
+    # Deixa o valor no mesmo formato de uma leitura do banco (JSON decodificado, datas como texto).
+    # Dicts recebidos do chamador são copiados: ele pode continuar alterando o seu.
+    if key in JSON_COLUMNS: return json.loads(value) if isinstance(value, str) else (copy.deepcopy(value) if value is not None else {})
+    if isinstance(value, datetime): return value.isoformat(" ")
+    return value
 
 def get_user(phone):
-    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE phone = ?", (phone,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def update_user(phone, data):
-    user = get_user(phone)
-    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    if not user:
-        initial_data = {
-            'phone': phone, 'state': 'awaiting_welcome', 'resume_data': json.dumps({'cargo': ''}),
-            'plan': 'none', 'template': 'none', 'payment_verified': 0,
-            'last_interaction': datetime.now(), 'current_experience': json.dumps({}),
-            'payment_timestamp': None, 'credits': 0, 'subscription_valid_until': None,
-            'editing_field': None
-        }
-        initial_data.update(data)
-        columns = ', '.join(initial_data.keys())
-        placeholders = ', '.join('?' * len(initial_data))
-        sql = f'INSERT INTO users ({columns}) VALUES ({placeholders})'
-        cursor.execute(sql, tuple(initial_data.values()))
-    else:
-        data['last_interaction'] = datetime.now()
-        set_clause = ', '.join([f'{key} = ?' for key in data.keys()])
-        values = list(data.values()) + [phone]
-        sql = f"UPDATE users SET {set_clause} WHERE phone = ?"
-        cursor.execute(sql, tuple(values))
-    conn.commit()
-    conn.close()
+    conn = get_db_connection()
+    user_cache.sync(conn)
+    user = user_cache.get(phone)
+    if user is not None: return user
+    with sqlite_seconds.time('get_user'):
+        row = conn.execute("SELECT * FROM users WHERE phone = ?", (phone,)).fetchone()
+    if row is None: return None
+    user = {key: _cached_value(key, row[key]) for key in row.keys()}
+    user_cache.put(phone, user)
+    return copy_user_row(user)
+
+def apply_resume_patch(resume_data, resume_fields=None, resume_append=None, resume_prepend=None):
+    # Mesma semântica do patch SQL de update_user, aplicada a um dict em memória.
+    for key, items in (resume_append or {}).items():
+        if not isinstance(resume_data.get(key), list): resume_data[key] = []
+        resume_data[key].extend(items)
+    for key, items in (resume_prepend or {}).items():
+        resume_data[key] = list(items) + (resume_data[key] if isinstance(resume_data.get(key), list) else [])
+    resume_data.update(resume_fields or {})
+    return resume_data
+
+def _resume_patch_sql(resume_fields, resume_append, resume_prepend=None):
+    # Monta uma expressão JSON1 que altera só os campos informados de resume_data: json_set para valores,
+    # json_insert com '[#]' para acrescentar itens em listas e, para pôr itens no início (JSON1 não tem
+    # essa operação), a lista é remontada como texto. A expressão anterior aparece mais de uma vez no
+    # SQL, então os seus parâmetros são repetidos na mesma ordem.
+    expr, params = "COALESCE(resume_data, '{}')", []
+    for key, items in (resume_append or {}).items():
+        path = f'$."{key}"'
+        expr = f"CASE WHEN json_type({expr}, '{path}') = 'array' THEN {expr} ELSE json_set({expr}, '{path}', json('[]')) END"
+        expr = f"json_insert({expr}, " + ", ".join(f"'{path}[#]', json(?)" for _ in items) + ")"
+        params = params * 3 + [json.dumps(item) for item in items]
+    for key, items in (resume_prepend or {}).items():
+        path = f'$."{key}"'
+        current = f"(CASE WHEN json_type({expr}, '{path}') = 'array' THEN json_extract({expr}, '{path}') ELSE '[]' END)"
+        head = " || ',' || ".join("json(?)" for _ in items)
+        expr = f"json_set({expr}, '{path}', json('[' || {head} || CASE WHEN json_array_length({current}) > 0 THEN ',' || substr({current}, 2) ELSE ']' END))"
+        params = params + [json.dumps(item) for item in items] + params * 4
+    if resume_fields:
+        expr = f"json_set({expr}, " + ", ".join(f"'$.\"{key}\"', json(?)" for key in resume_fields) + ")"
+        params += [json.dumps(value) for value in resume_fields.values()]
+    return expr, params
+
+def _has_json1():
+    try:
+        get_db_connection().execute("SELECT json_insert('[]', '$[#]', json('1'))").fetchone()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def update_user(phone, data, resume_fields=None, resume_append=None, resume_prepend=None):
+    # Cria ou atualiza em uma única ida ao banco (INSERT ... ON CONFLICT). Os valores padrão só
+    # valem na criação; numa linha existente apenas as colunas de `data` e last_interaction mudam.
+    # resume_fields/resume_append/resume_prepend alteram campos isolados de resume_data sem regravar o JSON inteiro.
+    global JSON1_AVAILABLE
+    if JSON1_AVAILABLE is None: JSON1_AVAILABLE = _has_json1()
+    data = dict(data, last_interaction=datetime.now())
+    patch_params = []
+    if (resume_fields or resume_append or resume_prepend) and not JSON1_AVAILABLE:
+        current = get_user(phone)
+        base = current['resume_data'] if current else json.loads(USER_DEFAULTS['resume_data'])
+        data['resume_data'] = apply_resume_patch(base, resume_fields, resume_append, resume_prepend)
+        resume_fields = resume_append = resume_prepend = None
+    row = dict(USER_DEFAULTS, phone=phone)
+    row.update({key: json.dumps(value) if key in JSON_COLUMNS and not isinstance(value, str) else value for key, value in data.items()})
+    update_keys = [key for key in data.keys() if key != 'phone']
+    set_clause = ', '.join([f'{key} = excluded.{key}' for key in update_keys])
+    if resume_fields or resume_append or resume_prepend:
+        row['resume_data'] = json.dumps(apply_resume_patch(json.loads(row['resume_data']), resume_fields, resume_append, resume_prepend))
+        patch_expr, patch_params = _resume_patch_sql(resume_fields, resume_append, resume_prepend)
+        set_clause += f", resume_data = {patch_expr}"
+    columns = ', '.join(row.keys())
+    placeholders = ', '.join('?' * len(row))
+    sql = f"INSERT INTO users ({columns}) VALUES ({placeholders}) ON CONFLICT(phone) DO UPDATE SET {set_clause}"
+    conn = get_db_connection()
+    try:
+        with sqlite_seconds.time('update_user'), conn:
+            conn.execute(sql, tuple(row.values()) + tuple(patch_params))
+            # Na mesma transação: os outros workers descartam a linha do cache antes de usá-la de novo.
+            conn.execute("INSERT INTO user_invalidations (phone, origin) VALUES (?, ?)", (phone, process_identity()))
+    except Exception:
+        user_cache.invalidate(phone)
+        raise
+    user_cache.apply(phone, {key: _cached_value(key, value) for key, value in data.items()}, resume_fields, resume_append, resume_prepend)
+    if resume_fields or resume_append or resume_prepend or 'resume_data' in data or 'template' in data or 'plan' in data:
+        precomputed_deliverables.invalidate(phone)
 
 # ==============================================================================
 # --- 4. COMUNICAÇÃO E PROCESSAMENTO ASSÍNCRONO
 # ==============================================================================
-def send_whatsapp_message(phone, message):
-    logging.info(f"Enviando mensagem para {phone}: {message}")
-    url = f"https://api.z-api.io/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/send-text"
-    payload = {"phone": phone, "message": message}
-    headers = {"Content-Type": "application/json", "Client-Token": ZAPI_CLIENT_TOKEN}
+zapi_session = requests.Session()
+for _scheme in ('https://', 'http://'):
+    zapi_session.mount(_scheme, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=ZAPI_MAX_CONCURRENCY))
+zapi_session.headers.update({"Content-Type": "application/json", "Client-Token": ZAPI_CLIENT_TOKEN})
+_zapi_slots = threading.BoundedSemaphore(ZAPI_MAX_CONCURRENCY)
+_phone_send_locks = [threading.RLock() for _ in range(64)]
+_outbox, _outbox_lock = {}, threading.Lock()
+
+def _zapi_post(endpoint, payload=None, timeout=10, body=None):
+    # `body` é um JSON já serializado (arquivo em memória), usado para documentos grandes.
+    url = f"{ZAPI_BASE_URL}/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/{endpoint}"
+    started_at = time.perf_counter()
     try:
-        requests.post(url, json=payload, headers=headers, timeout=10)
+        with _zapi_slots:
+            response = zapi_session.post(url, json=payload, data=body, timeout=timeout)
+    except requests.exceptions.RequestException:
+        zapi_errors.inc(endpoint, 'exception')
+        raise
+    finally:
+        zapi_seconds.observe(time.perf_counter() - started_at, endpoint)
+    if not response.ok: zapi_errors.inc(endpoint, 'http')
+    return response.ok
+
+def _post_text(phone, message):
+    try:
+        return _zapi_post("send-text", {"phone": phone, "message": message}, timeout=10)
     except requests.exceptions.RequestException as e:
         logging.error(f"Erro ao enviar mensagem para {phone}: {e}")
+        return False
+
+def _drain_outbox(phone):
+    # Precisa ser chamado com o lock do telefone: envia os textos acumulados antes de qualquer envio novo.
+    with _outbox_lock:
+        parts = _outbox.pop(phone, None)
+    if parts: _post_text(phone, "\n\n".join(parts))
 
-def send_whatsapp_document(phone, doc_path, filename, caption=""):
+def flush_whatsapp_messages(phone):
+    with _phone_send_locks[hash(phone) % len(_phone_send_locks)]:
+        _drain_outbox(phone)
+
+def send_whatsapp_message(phone, message, coalesce=True):
+    logging.info(f"Enviando mensagem para {phone}: {message}")
+    if ZAPI_COALESCE_WINDOW_MS > 0 and coalesce:
+        # Textos seguidos para o mesmo telefone dentro da janela viram um único envio.
+        with _outbox_lock:
+            parts = _outbox.get(phone)
+            if parts is None:
+                _outbox[phone] = [message]
+                timer = threading.Timer(ZAPI_COALESCE_WINDOW_MS / 1000, flush_whatsapp_messages, args=(phone,))
+                timer.daemon = True
+                timer.start()
+                return True
+            if sum(len(part) + 2 for part in parts) + len(message) <= ZAPI_COALESCE_MAX_CHARS:
+                parts.append(message)
+                return True
+        flush_whatsapp_messages(phone)
+        return send_whatsapp_message(phone, message, coalesce)
+    with _phone_send_locks[hash(phone) % len(_phone_send_locks)]:
+        _drain_outbox(phone)
+        return _post_text(phone, message)
+
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+def build_document_body(phone, doc_bytes, filename, caption=""):
+    # Monta o JSON do send-document direto em um buffer, codificando o PDF em base64 por blocos:
+    # evita as cópias intermediárias (string base64, data URI, json.dumps) do documento inteiro.
+    body = io.BytesIO()
+    body.write(f'{{"phone": {json.dumps(phone)}, "fileName": {json.dumps(filename)}, "caption": {json.dumps(caption)}, "document": "data:application/pdf;base64,'.encode('utf-8'))
+    view = memoryview(doc_bytes)
+    for offset in range(0, len(view), BASE64_CHUNK_SIZE):
+        body.write(binascii.b2a_base64(view[offset:offset + BASE64_CHUNK_SIZE], newline=False))
+    body.write(b'"}')
+    body.seek(0)
+    return body
+
+def send_whatsapp_document(phone, document, filename, caption=""):
+    # `document` são os bytes do PDF (ou, por compatibilidade, o caminho de um arquivo).
     logging.info(f"Enviando documento {filename} para {phone}")
-    url = f"https://api.z-api.io/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/send-document/pdf"
-    with open(doc_path, 'rb') as f:
-        doc_bytes = f.read()
-    doc_base64 = base64.b64encode(doc_bytes).decode('utf-8')
-    payload = {"phone": phone, "document": f"data:application/pdf;base64,{doc_base64}", "fileName": filename, "caption": caption}
-    headers = {"Content-Type": "application/json", "Client-Token": ZAPI_CLIENT_TOKEN}
-    try:
-        requests.post(url, json=payload, headers=headers, timeout=30)
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao enviar documento para {phone}: {e}")
+    if isinstance(document, str):
+        with open(document, 'rb') as f:
+            document = f.read()
+    body = build_document_body(phone, document, filename, caption)
+    with _phone_send_locks[hash(phone) % len(_phone_send_locks)]:
+        _drain_outbox(phone)
+        try:
+            return _zapi_post("send-document/pdf", body=body, timeout=30)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro ao enviar documento para {phone}: {e}")
+            return False
+
+class BoundedExecutor:
+    # Executor (threads ou processos) com limite de tarefas em fila + em execução. Quando está cheio,
+    # submit espera até `timeout` segundos por uma vaga (backpressure) e devolve None se não conseguir.
+    # O executor de verdade só é criado na primeira tarefa, depois do fork dos workers do gunicorn.
+    def __init__(self, name, factory, workers, max_queue):
+        self.name, self.workers, self.max_queue, self._factory = name, workers, max_queue, factory
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._submitted = self._completed = self._failed = self._rejected = 0
+        self._total_wait = self._max_wait = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None: self._executor = self._factory(self.workers)
+            return self._executor
+
+    def submit(self, func, *args, timeout=None):
+        started_at = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock: self._rejected += 1
+            return None
+        wait = time.monotonic() - started_at
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+            self._submitted += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        self._slots.release()
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self._futures.discard(future)
+            if error:
+                self._failed += 1
+                # Um processo filho que morre quebra o pool inteiro; o próximo submit cria outro.
+                if isinstance(error, BrokenProcessPool): self._executor = None
+            else:
+                self._completed += 1
+        if error: logging.error(f"Erro em tarefa do executor '{self.name}': {error}", exc_info=error)
+
+    def stats(self):
+        with self._lock:
+            in_flight = sum(1 for future in self._futures if future.running())
+            return {
+                'workers': self.workers, 'max_queue': self.max_queue, 'queue_length': len(self._futures) - in_flight, 'in_flight': in_flight,
+                'submitted': self._submitted, 'completed': self._completed, 'failed': self._failed, 'rejected': self._rejected,
+                'avg_backpressure_wait_ms': round(1000 * self._total_wait / self._submitted, 2) if self._submitted else 0.0,
+                'max_backpressure_wait_ms': round(1000 * self._max_wait, 2)
+            }
+
+class JobLeaseLost(Exception):
+    pass
 
-def run_long_task_in_background(target_func, args=()):
-    logging.info(f"Iniciando tarefa {target_func.__name__} em segundo plano.")
-    thread = threading.Thread(target=target_func, args=args)
-    thread.daemon = True
-    thread.start()
+job_handlers = {}
+
+def job_handler(kind, on_give_up=None):
+    def decorator(func):
+        job_handlers[kind] = (func, on_give_up)
+        return func
+    return decorator
+
+class JobQueue:
+    # Fila durável de tarefas longas na tabela `jobs`. Os workers pegam cada tarefa com um lease que é
+    # renovado enquanto ela roda; se o processo morrer, o lease expira e outro worker (deste ou de outro
+    # processo) a retoma a partir dos checkpoints gravados. Falhas são repetidas com backoff exponencial.
+    # Tarefas de BACKGROUND_JOB_KINDS só são pegas quando não há outras prontas, e nunca pelo worker 0.
+    def __init__(self, workers, lease_seconds, poll_seconds):
+        self.workers, self.lease_seconds, self.poll_seconds = workers, lease_seconds, poll_seconds
+        self.owner = None
+        self._lock = threading.Condition()
+        self._threads = []
+        self._running = {}
+        self.completed = self.retried = self.failed = 0
+
+    def start(self):
+        # Workers sobem sob demanda (e não no import), o que é seguro com fork do gunicorn.
+        with self._lock:
+            if self._threads: return
+            self.owner = f"{socket.gethostname()}:{os.getpid()}"
+            for i in range(self.workers):
+                background = i > 0 or self.workers == 1
+                self._threads.append(threading.Thread(target=self._worker_loop, args=(background,), name=f"job-worker-{i}", daemon=True))
+            self._threads.append(threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True))
+            for thread in self._threads: thread.start()
+
+    def _begin(self):
+        conn = get_db_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def enqueue(self, kind, phone, payload, max_attempts=JOB_MAX_ATTEMPTS):
+        # Uma tarefa ativa por (tipo, telefone): pedidos repetidos devolvem a que já está na fila. Se ela
+        # ainda não começou, passa a usar o payload mais recente; uma que já está rodando segue com o dela.
+        now = time.time()
+        payload = json.dumps(payload, ensure_ascii=False, default=str)
+        conn = self._begin()
+        try:
+            row = conn.execute("SELECT id, status FROM jobs WHERE kind = ? AND phone = ? AND status IN ('pending', 'running')", (kind, phone)).fetchone()
+            if row and row['status'] == 'pending':
+                conn.execute("UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?", (payload, now, row['id']))
+            job_id = row['id'] if row else conn.execute(
+                "INSERT INTO jobs (kind, phone, payload, max_attempts, run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, phone, payload, max_attempts, now, now, now)).lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.start()
+        with self._lock: self._lock.notify_all()
+        return job_id
+
+    def _claim(self, background=True):
+        now = time.time()
+        kinds = ', '.join('?' * len(BACKGROUND_JOB_KINDS))
+        conn = self._begin()
+        try:
+            row = conn.execute(f'''
+                SELECT * FROM jobs WHERE ((status = 'pending' AND run_after <= ?) OR (status = 'running' AND lease_until < ?))
+                AND (? OR kind NOT IN ({kinds}))
+                ORDER BY kind IN ({kinds}), run_after, id LIMIT 1
+            ''', (now, now, background, *BACKGROUND_JOB_KINDS, *BACKGROUND_JOB_KINDS)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                             (self.owner, now + self.lease_seconds, now, row['id']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if row is None: return None
+        job = dict(row, attempts=row['attempts'] + 1)
+        job['payload'], job['checkpoints'] = json.loads(job['payload']), json.loads(job['checkpoints'] or '{}')
+        return job
+
+    def _worker_loop(self, background=True):
+        while True:
+            try:
+                job = self._claim(background)
+            except sqlite3.Error as e:
+                logging.error(f"Erro ao buscar tarefas na fila: {e}")
+                job = None
+            if job is None:
+                with self._lock: self._lock.wait(self.poll_seconds)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        handler, on_give_up = job_handlers.get(job['kind'], (None, None))
+        with self._lock: self._running[job['id']] = job
+        try:
+            if job['attempts'] > job['max_attempts']:
+                raise RuntimeError("Tarefa excedeu o número de tentativas (o lease expirou em todas).")
+            if handler is None:
+                raise RuntimeError(f"Tipo de tarefa desconhecido: {job['kind']}")
+            logging.info(f"Executando tarefa {job['id']} ({job['kind']}) de {job['phone']}, tentativa {job['attempts']}.")
+            handler(job)
+            self._finish(job, 'done')
+        except JobLeaseLost:
+            logging.warning(f"Tarefa {job['id']} foi assumida por outro worker; abandonando esta execução.")
+        except Exception as e:
+            logging.error(f"Erro na tarefa {job['id']} ({job['kind']}) de {job['phone']}: {e}", exc_info=True)
+            self._fail(job, e, on_give_up)
+        finally:
+            with self._lock: self._running.pop(job['id'], None)
+
+    def _finish(self, job, status, error=None, run_after=None):
+        with self._lock:
+            checkpoints = json.dumps(job['checkpoints'], ensure_ascii=False)
+        with get_db_connection() as conn:
+            conn.execute("UPDATE jobs SET status = ?, checkpoints = ?, last_error = ?, run_after = COALESCE(?, run_after), lease_owner = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+                         (status, checkpoints, error, run_after, time.time(), job['id']))
+        if status != 'pending':
+            for name in os.listdir(JOB_FILES_DIR) if os.path.isdir(JOB_FILES_DIR) else []:
+                if name.startswith(f"{job['id']}_"): os.remove(os.path.join(JOB_FILES_DIR, name))
+        if status == 'done':
+            with self._lock: self.completed += 1
+
+    def _fail(self, job, error, on_give_up):
+        if job['attempts'] < job['max_attempts']:
+            delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1), JOB_RETRY_MAX_SECONDS) * random.uniform(0.8, 1.2)
+            with self._lock: self.retried += 1
+            self._finish(job, 'pending', str(error), time.time() + delay)
+            logging.info(f"Tarefa {job['id']} será repetida em {delay:.0f}s.")
+            return
+        with self._lock: self.failed += 1
+        self._finish(job, 'failed', str(error))
+        if on_give_up:
+            try:
+                on_give_up(job, error)
+            except Exception as e:
+                logging.error(f"Erro ao tratar a falha definitiva da tarefa {job['id']}: {e}", exc_info=True)
+
+    def _heartbeat_loop(self):
+        # Renova o lease das tarefas em execução neste processo enquanto ele estiver vivo.
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock: job_ids = list(self._running)
+            if not job_ids: continue
+            try:
+                with get_db_connection() as conn:
+                    conn.execute(f"UPDATE jobs SET lease_until = ? WHERE lease_owner = ? AND id IN ({', '.join('?' * len(job_ids))})",
+                                 (time.time() + self.lease_seconds, self.owner, *job_ids))
+            except sqlite3.Error as e:
+                logging.error(f"Erro ao renovar leases da fila: {e}")
+
+    def checkpoint(self, job, stage, value=True):
+        # Grava a etapa concluída; se outro worker assumiu a tarefa, esta execução é interrompida.
+        with self._lock:
+            job['checkpoints'][stage] = value
+            checkpoints = json.dumps(job['checkpoints'], ensure_ascii=False)
+        with get_db_connection() as conn:
+            cursor = conn.execute("UPDATE jobs SET checkpoints = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                                  (checkpoints, time.time(), job['id'], self.owner))
+        if cursor.rowcount == 0: raise JobLeaseLost(job['id'])
+
+    def save_artifact(self, job, name, data):
+        # Arquivos intermediários (PDFs já gerados) sobrevivem a um restart e são apagados no fim da tarefa.
+        os.makedirs(JOB_FILES_DIR, exist_ok=True)
+        path = os.path.join(JOB_FILES_DIR, f"{job['id']}_{name}")
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def load_artifact(self, job, name):
+        try:
+            with open(os.path.join(JOB_FILES_DIR, f"{job['id']}_{name}"), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def stats(self):
+        counts = {row['status']: row['total'] for row in get_db_connection().execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status")}
+        with self._lock:
+            return {'workers': self.workers, 'running_here': len(self._running), 'by_status': counts,
+                    'completed': self.completed, 'retried': self.retried, 'failed': self.failed}
+
+# Entregas (rede, banco e espera pelos PDFs) rodam nos workers da fila durável; a renderização, que é
+# CPU pura e disputaria o GIL com os threads do webhook, vai para um pool de processos.
+job_queue = JobQueue(DELIVERY_WORKERS, JOB_LEASE_SECONDS, JOB_POLL_SECONDS)
+
+class PhoneOrderedExecutor:
+    # Pool limitado de workers com uma fila por telefone: mensagens do mesmo telefone são
+    # processadas estritamente na ordem de chegada, telefones diferentes rodam em paralelo.
+    def __init__(self, workers, max_pending, name='msg-worker'):
+        self.workers, self.max_pending, self.name = workers, max_pending, name
+        self._lock = threading.Condition()
+        self._mailboxes = {}
+        self._ready = queue.Queue()
+        self._threads = []
+        self._pending = self._in_flight = self._processed = self._rejected = 0
+        self._total_wait = self._max_wait = 0.0
+
+    def _ensure_started(self):
+        # Workers sobem na primeira mensagem (e não no import), o que é seguro com fork do gunicorn.
+        if self._threads: return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                return False
+            self._ensure_started()
+            self._pending += 1
+            mailbox = self._mailboxes.get(key)
+            if mailbox is None:
+                self._mailboxes[key] = deque([(time.monotonic(), func, args)])
+                self._ready.put(key)
+            else:
+                mailbox.append((time.monotonic(), func, args))
+        return True
+
+    def _worker_loop(self):
+        while True:
+            key = self._ready.get()
+            with self._lock:
+                enqueued_at, func, args = self._mailboxes[key].popleft()
+                wait = time.monotonic() - enqueued_at
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                self._pending -= 1
+                self._in_flight += 1
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Erro ao processar tarefa de {key}: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._processed += 1
+                    # O telefone só volta para a fila de prontos depois de terminar a mensagem atual.
+                    if self._mailboxes[key]: self._ready.put(key)
+                    else: del self._mailboxes[key]
+                    self._lock.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self._lock:
+            return self._lock.wait_for(lambda: self._pending == 0 and self._in_flight == 0, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers, 'queue_depth': self._pending, 'in_flight': self._in_flight,
+                'phones_waiting': len(self._mailboxes), 'processed': self._processed, 'rejected': self._rejected,
+                'avg_wait_ms': round(1000 * self._total_wait / self._processed, 2) if self._processed else 0.0,
+                'max_wait_ms': round(1000 * self._max_wait, 2)
+            }
+
+message_executor = PhoneOrderedExecutor(MESSAGE_WORKERS, MESSAGE_QUEUE_MAX)
+
+class PhoneInbox:
+    # Caixa de entrada durável (tabela `inbox`) que ordena as mensagens de cada telefone entre os workers do
+    # gunicorn. O webhook grava a mensagem (o id é a sequência) e tenta consumir a caixa do telefone. Só há
+    # um consumidor por telefone de cada vez: ele marca a primeira mensagem com um lease e segue até esvaziar
+    # a caixa; um worker que receba outra mensagem desse telefone nesse meio tempo só a grava e a deixa lá.
+    # Garantia: as mensagens de um telefone rodam uma de cada vez, na ordem em que foram gravadas (a de
+    # chegada dos webhooks); telefones diferentes nunca esperam um pelo outro. O lease é renovado pela
+    # manutenção do processo; se ele morrer, o lease expira e outro worker retoma a caixa, rodando de novo
+    # a mensagem que estava em andamento (entrega pelo menos uma vez).
+    def __init__(self, lease_seconds):
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._running = {}  # id da mensagem -> dono do lease
+
+    def push(self, phone, message_data):
+        with get_db_connection() as conn:
+            return conn.execute("INSERT INTO inbox (phone, payload, created_at) VALUES (?, ?, ?)",
+                                (phone, json.dumps(message_data, ensure_ascii=False), time.time())).lastrowid
+
+    def discard(self, message_id):
+        # Desfaz um push que ninguém começou a consumir (fila de mensagens cheia).
+        with get_db_connection() as conn:
+            return conn.execute("DELETE FROM inbox WHERE id = ? AND lease_until IS NULL", (message_id,)).rowcount == 1
+
+    def _claim(self, phone, done_id=None):
+        # Na mesma transação: apaga a mensagem concluída e pega a próxima, se ninguém estiver com a caixa.
+        # Junto vem o last_interaction do usuário, que diz se a linha do cache local ainda vale.
+        now, owner = time.time(), f"{process_identity()}:{threading.get_ident()}"
+        conn = get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if done_id is not None: conn.execute("DELETE FROM inbox WHERE id = ?", (done_id,))
+            row = conn.execute('''
+                SELECT inbox.id, inbox.payload, inbox.lease_until, users.last_interaction FROM inbox
+                LEFT JOIN users ON users.phone = inbox.phone WHERE inbox.phone = ? ORDER BY inbox.id LIMIT 1
+            ''', (phone,)).fetchone()
+            if row and row['lease_until'] is not None and row['lease_until'] >= now: row = None
+            if row: conn.execute("UPDATE inbox SET owner = ?, lease_until = ? WHERE id = ?", (owner, now + self.lease_seconds, row['id']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock: self._running.pop(done_id, None)
+        if row:
+            with self._lock: self._running[row['id']] = owner
+        return row
+
+    def drain(self, phone):
+        # Consome a caixa do telefone até esvaziá-la ou encontrá-la com outro consumidor.
+        done_id = None
+        while True:
+            row = self._claim(phone, done_id)
+            if row is None: return
+            done_id = row['id']
+            user_cache.check_version(phone, row['last_interaction'])
+            try:
+                process_message(phone, json.loads(row['payload']))
+            except Exception as e:
+                logging.error(f"Erro ao processar a mensagem {row['id']} de {phone}: {e}", exc_info=True)
+
+    def heartbeat(self):
+        # Renova os leases das mensagens em andamento neste processo e retoma caixas abandonadas
+        # (lease vencido, ou mensagem gravada há mais de um lease sem ninguém consumir).
+        now = time.time()
+        with self._lock: running = list(self._running.items())
+        if running:
+            with get_db_connection() as conn:
+                conn.executemany("UPDATE inbox SET lease_until = ? WHERE id = ? AND owner = ?",
+                                 [(now + self.lease_seconds, message_id, owner) for message_id, owner in running])
+        rows = get_db_connection().execute("SELECT DISTINCT phone FROM inbox WHERE lease_until < ? OR (lease_until IS NULL AND created_at < ?)",
+                                           (now, now - self.lease_seconds)).fetchall()
+        for row in rows: message_executor.submit(row['phone'], self.drain, row['phone'])
+
+phone_inbox = PhoneInbox(INBOX_LEASE_SECONDS)
 
 # ==============================================================================
 # --- 5. FUNÇÕES DE IA E FORMATAÇÃO
 # ==============================================================================
-def get_openai_response(prompt_messages, is_json=False):
-    if not openai.api_key: return None
+class CompletionCache:
+    # Cache persistente (SQLite, ao lado do banco principal) de respostas da OpenAI, endereçado pelo
+    # hash do pedido. Expira por TTL e, acima de OPENAI_CACHE_MAX_MB, descarta as menos usadas (LRU).
+    EVICTION_INTERVAL = 50
+
+    def __init__(self, path, max_bytes, ttl_seconds):
+        self.path, self.max_bytes, self.ttl = path, max_bytes, ttl_seconds
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+        self.hits = self.misses = 0
+        self.saved_ms = 0.0
+
+    def _conn(self):
+        conn = get_db_connection(self.path)
+        if not self._initialized:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS completions (
+                        key TEXT PRIMARY KEY, response TEXT, latency_ms REAL,
+                        size INTEGER, created_at REAL, last_used_at REAL
+                    )
+                ''')
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used_at)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def make_key(model, messages, temperature, response_format):
+        request_body = json.dumps({'model': model, 'messages': messages, 'temperature': temperature, 'response_format': response_format}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request_body.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT response, latency_ms, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row and now - row['created_at'] < self.ttl:
+                with conn:
+                    conn.execute("UPDATE completions SET last_used_at = ? WHERE key = ?", (now, key))
+                with self._lock:
+                    self.hits += 1
+                    self.saved_ms += row['latency_ms']
+                return row['response']
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao ler cache da OpenAI: {e}")
+        with self._lock: self.misses += 1
+        return None
+
+    def put(self, key, response, latency_ms):
+        try:
+            conn = self._conn()
+            now = time.time()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO completions (key, response, latency_ms, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, response, latency_ms, len(response.encode('utf-8')), now, now))
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % self.EVICTION_INTERVAL == 0
+            if evict: self.evict()
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao gravar cache da OpenAI: {e}")
+
+    def evict(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl,))
+            excess = (conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]) - self.max_bytes
+            if excess <= 0: return
+            to_delete = []
+            for row in conn.execute("SELECT key, size FROM completions ORDER BY last_used_at"):
+                to_delete.append((row['key'],))
+                excess -= row['size']
+                if excess <= 0: break
+            conn.executemany("DELETE FROM completions WHERE key = ?", to_delete)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0, 'saved_ms': round(self.saved_ms, 1)}
+
+completion_cache = CompletionCache(OPENAI_CACHE_FILE, int(OPENAI_CACHE_MAX_MB * 1024 * 1024), OPENAI_CACHE_TTL_DAYS * 86400)
+
+# Roteamento por tarefa: (modelo, timeout em segundos, max_tokens). Extrações curtas vão para o modelo
+# menor; se a resposta dele não passar na validação, o pedido é repetido no OPENAI_DEFAULT_MODEL.
+OPENAI_ROUTES = {
+    'extract': (OPENAI_FAST_MODEL, 10, 200),
+    'extract:nome_completo': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:cidade_estado': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:telefone': (OPENAI_FAST_MODEL, 8, 30),
+    'extract:email': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:cargo': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:empresa': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:periodo': (OPENAI_FAST_MODEL, 8, 40),
+    'extract:formacao': (OPENAI_FAST_MODEL, 10, 120),
+    'extract:habilidades': (OPENAI_FAST_MODEL, 10, 200),
+    'extract:cursos': (OPENAI_FAST_MODEL, 10, 120),
+    'extract:resumo': (OPENAI_DEFAULT_MODEL, 20, 600),
+    'extract_bulk': (OPENAI_FAST_MODEL, 15, 1000),
+    'extract:descricao': (OPENAI_DEFAULT_MODEL, 20, 600),
+    'translate': (OPENAI_DEFAULT_MODEL, 60, 4000),
+    'improve_experiences': (OPENAI_DEFAULT_MODEL, 60, 3000),
+    'interview_questions': (OPENAI_DEFAULT_MODEL, 45, 1200),
+    'pix_receipt': (OPENAI_DEFAULT_MODEL, 30, 50),
+    'default': (OPENAI_DEFAULT_MODEL, 30, None),
+}
+# Ajuste sem deploy: OPENAI_ROUTES_OVERRIDE='{"extract:cargo": ["gpt-4o", 10, 60]}'
+OPENAI_ROUTES.update({task: tuple(route) for task, route in json.loads(os.environ.get('OPENAI_ROUTES_OVERRIDE') or '{}').items()})
+
+def get_openai_route(task):
+    return OPENAI_ROUTES.get(task) or OPENAI_ROUTES.get(task.split(':')[0]) or OPENAI_ROUTES['default']
+
+def _stream_completion(on_text, **request):
+    # Consome a resposta em streaming, repassando cada pedaço de texto a `on_text` assim que chega.
+    parts, finish_reason, usage, started_at = [], None, None, time.monotonic()
+    for chunk in openai.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request):
+        if getattr(chunk, 'usage', None): usage = chunk.usage
+        if not chunk.choices: continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if not parts: openai_first_token_seconds.observe(time.monotonic() - started_at, request['model'])
+            parts.append(delta)
+            on_text(delta)
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+    message = types.SimpleNamespace(content=''.join(parts))
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage)
+
+def _openai_request(task, model, timeout, max_tokens, prompt_messages, is_json, cache, validate, on_text=None):
+    # Uma chamada a um modelo: devolve o conteúdo se passou na validação, senão None.
+    temperature = 0.3
+    response_format = {"type": "json_object"} if is_json else {"type": "text"}
+    cache_key = CompletionCache.make_key(model, prompt_messages, temperature, response_format) if cache else None
+    if cache_key:
+        cached_response = completion_cache.get(cache_key)
+        if cached_response is not None:
+            openai_cache_hits.inc(task)
+            if on_text: on_text(cached_response)
+            return cached_response
+    started_at = time.monotonic()
     try:
-        model_to_use = "gpt-4o"
-        response_format = {"type": "json_object"} if is_json else {"type": "text"}
-        completion = openai.chat.completions.create(model=model_to_use, messages=prompt_messages, temperature=0.3, response_format=response_format)
-        response_content = completion.choices[0].message.content.strip()
-        if is_json:
-            try: json.loads(response_content)
-            except json.JSONDecodeError:
-                logging.error(f"OpenAI retornou JSON inválido: {response_content}")
-                return None
-        return response_content
+        request = dict(model=model, messages=prompt_messages, temperature=temperature, response_format=response_format, timeout=timeout)
+        if max_tokens: request['max_tokens'] = max_tokens
+        with openai_seconds.time(task, model):
+            completion = _stream_completion(on_text, **request) if on_text else openai.chat.completions.create(**request)
     except Exception as e:
-        logging.error(f"Erro na API da OpenAI: {e}")
+        logging.error(f"Erro na API da OpenAI ({task}, {model}): {e}")
+        openai_errors.inc(task, model)
         return None
+    usage = getattr(completion, 'usage', None)
+    if usage:
+        openai_tokens.inc(task, 'prompt', amount=usage.prompt_tokens)
+        openai_tokens.inc(task, 'completion', amount=usage.completion_tokens)
+    choice = completion.choices[0]
+    response_content = (choice.message.content or '').strip()
+    try:
+        if not response_content or getattr(choice, 'finish_reason', None) == 'length': raise ValueError("resposta vazia ou cortada")
+        parsed = json.loads(response_content) if is_json else response_content
+        if validate and not validate(parsed): raise ValueError("resposta fora do formato esperado")
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logging.error(f"OpenAI retornou resposta inválida ({task}, {model}): {e}: {response_content[:200]}")
+        openai_errors.inc(task, model)
+        return None
+    if cache_key: completion_cache.put(cache_key, response_content, 1000 * (time.monotonic() - started_at))
+    return response_content
+
+def get_openai_response(prompt_messages, is_json=False, cache=False, task='default', validate=None, on_text=None):
+    # cache=True reaproveita respostas idênticas já obtidas (não usar onde a resposta depende de algo fora do prompt).
+    # `validate` recebe a resposta (já decodificada se is_json) e diz se ela é aproveitável.
+    # Com `on_text`, a resposta vem em streaming e cada pedaço é repassado ao chegar; o retorno continua
+    # sendo o texto completo (validado), para quem precisa dele inteiro.
+    if not openai.api_key: return None
+    model, timeout, max_tokens = get_openai_route(task)
+    emitted = []
+    def forward(text):
+        emitted.append(True)
+        on_text(text)
+    response_content = _openai_request(task, model, timeout, max_tokens, prompt_messages, is_json, cache, validate, forward if on_text else None)
+    # Só escala se nada foi repassado ainda: repetir o streaming duplicaria o que o usuário já recebeu.
+    if response_content is None and model != OPENAI_DEFAULT_MODEL and not emitted:
+        logging.warning(f"Escalando a tarefa '{task}' de {model} para {OPENAI_DEFAULT_MODEL}.")
+        openai_escalations.inc(task)
+        response_content = _openai_request(task, OPENAI_DEFAULT_MODEL, max(timeout, 30), max_tokens and 2 * max_tokens, prompt_messages, is_json, cache, validate, on_text)
+    return response_content
+
+# --- Extração local (sem IA) para campos estruturados ---
+local_extractors = {}
+def local_extractor(*field_keys):
+    def decorator(func):
+        for key in field_keys: local_extractors[key] = func
+        return func
+    return decorator
+
+extraction_stats = {'local': 0, 'llm': 0, 'bulk': 0, 'bulk_fields': 0, 'by_field': {}}
+_extraction_stats_lock = threading.Lock()
+
+NAME_CONNECTIVES = {'de', 'da', 'do', 'das', 'dos', 'e'}
+CITY_TRAILING_CONNECTIVES = {'de', 'da', 'do', 'das', 'dos', 'no', 'na', 'em'}
+NOT_A_NAME_WORDS = {'oi', 'ola', 'tudo', 'bem', 'meu', 'minha', 'nome', 'sou', 'nao', 'sim', 'pular', 'quero', 'obrigado', 'obrigada', 'bom', 'boa', 'dia', 'tarde', 'noite'}
+UFS = {'ac', 'al', 'ap', 'am', 'ba', 'ce', 'df', 'es', 'go', 'ma', 'mt', 'ms', 'mg', 'pa', 'pb', 'pr', 'pe', 'pi', 'rj', 'rn', 'rs', 'ro', 'rr', 'sc', 'sp', 'se', 'to'}
+STATE_NAMES = {
+    'acre': 'AC', 'alagoas': 'AL', 'amapa': 'AP', 'amazonas': 'AM', 'bahia': 'BA', 'ceara': 'CE', 'distrito federal': 'DF',
+    'espirito santo': 'ES', 'goias': 'GO', 'maranhao': 'MA', 'mato grosso': 'MT', 'mato grosso do sul': 'MS', 'minas gerais': 'MG',
+    'para': 'PA', 'paraiba': 'PB', 'parana': 'PR', 'pernambuco': 'PE', 'piaui': 'PI', 'rio de janeiro': 'RJ',
+    'rio grande do norte': 'RN', 'rio grande do sul': 'RS', 'rondonia': 'RO', 'roraima': 'RR', 'santa catarina': 'SC',
+    'sao paulo': 'SP', 'sergipe': 'SE', 'tocantins': 'TO'
+}
+MONTHS = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+MONTH_PREFIXES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
+YES_ANSWERS = {'sim', 's', 'claro', 'quero', 'pode', 'pode sim', 'quero sim', 'com certeza', 'ok', 'bora', 'yes'}
+NO_ANSWERS = {'nao', 'n', 'nao quero', 'agora nao', 'nao obrigado', 'nao obrigada', 'dispenso', 'no'}
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+NAME_PREFIX_RE = re.compile(r"^(?:meu nome(?: completo)? (?:é|e)|me chamo|eu sou (?:o|a)|sou (?:o|a)|nome:)\s*", re.IGNORECASE)
+CITY_PREFIX_RE = re.compile(r"^(?:eu )?(?:moro em|moro no|moro na|sou de|resido em|em)\s+", re.IGNORECASE)
+PHONE_RE = re.compile(r"(?:\+?\s*55[\s-]*)?\(?\s*([1-9]{2})\s*\)?[\s.-]*(9?)[\s.-]*(\d{4})[\s.-]*(\d{4})(?!\d)")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PERIOD_TOKEN_RE = re.compile(r"(?:\b(jan|fev|mar|abr|mai|jun|jul|ago|set|out|nov|dez)[a-z]*\.?\s*(?:de\s+|/\s*)?|\b(\d{1,2})\s*/\s*)?\b((?:19|20)\d{2})\b|\b(atualmente|atual|hoje|o momento|presente|agora)\b")
+PERIOD_FILLER_WORDS = {'de', 'do', 'a', 'ao', 'ate', 'entre', 'e', 'fiquei', 'trabalhei', 'desde', 'em', 'no', 'na', 'periodo', 'dias', 'os', 'momento', 'o'}
+
+def strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def capitalize_words(words):
+    def cap(word): return '-'.join("'".join(part.capitalize() for part in piece.split("'")) for piece in word.split('-'))
+    return ' '.join(word.lower() if i and word.lower() in NAME_CONNECTIVES else cap(word) for i, word in enumerate(words))
+
+def parse_yes_no(text):
+    answer = strip_accents(text.lower()).strip(' .!,')
+    if answer in YES_ANSWERS: return True
+    if answer in NO_ANSWERS: return False
+    return None
+
+@local_extractor('nome_completo')
+def extract_name_locally(message):
+    words = NAME_PREFIX_RE.sub('', message.strip()).strip(' .!').split()
+    if not 2 <= len(words) <= 7 or not all(WORD_RE.fullmatch(word) for word in words): return None, 0.0
+    if any(strip_accents(word.lower()) in NOT_A_NAME_WORDS for word in words): return None, 0.0
+    return capitalize_words(words), 1.0
+
+@local_extractor('telefone')
+def extract_phone_locally(message):
+    matches = list(PHONE_RE.finditer(message))
+    if len(matches) != 1: return None, 0.0
+    ddd, nine, prefix, suffix = matches[0].groups()
+    rest = message[:matches[0].start()] + message[matches[0].end():]
+    confidence = 1.0 if not re.search(r'\d', rest) and len(rest.split()) <= 3 else 0.5
+    return f"({ddd}) {nine}{prefix}-{suffix}", confidence
+
+@local_extractor('email')
+def extract_email_locally(message):
+    matches = EMAIL_RE.findall(message)
+    if len(matches) != 1: return None, 0.0
+    rest = message.replace(matches[0], '')
+    return matches[0].strip('.').lower(), 1.0 if len(rest.split()) <= 3 else 0.5
+
+@local_extractor('cidade_estado')
+def extract_city_state_locally(message):
+    text = CITY_PREFIX_RE.sub('', message.strip()).strip(' .!')
+    parts = [part for part in re.split(r"\s+[-–]\s+|[\s,/]+", text) if part]
+    if parts and '-' in parts[-1] and strip_accents(parts[-1].rsplit('-', 1)[1]).lower() in UFS:
+        parts[-1:] = parts[-1].rsplit('-', 1)
+    uf, city_words = None, []
+    if len(parts) >= 2 and parts[-1].lower() in UFS:
+        uf, city_words = parts[-1].upper(), parts[:-1]
+    else:
+        for size in range(4, 0, -1):
+            state = strip_accents(' '.join(parts[-size:])).lower()
+            if len(parts) > size and state in STATE_NAMES:
+                uf, city_words = STATE_NAMES[state], parts[:-size]
+                break
+    # "Belém do Pará", "Porto Alegre no RS": o conectivo antes do estado não faz parte da cidade. Sem ele o
+    # resultado provavelmente está certo, mas a frase foge do formato esperado; a confirmação fica com a IA.
+    confidence = 1.0
+    while city_words and city_words[-1].lower() in CITY_TRAILING_CONNECTIVES:
+        city_words, confidence = city_words[:-1], 0.5
+    if not uf or not 1 <= len(city_words) <= 5 or not all(WORD_RE.fullmatch(word) for word in city_words): return None, 0.0
+    return f"{capitalize_words(city_words)} - {uf}", confidence
+
+@local_extractor('periodo')
+def extract_period_locally(message):
+    text = strip_accents(message.lower())
+    dates = []
+    for match in PERIOD_TOKEN_RE.finditer(text):
+        month_name, month_number, year, present = match.groups()
+        if present: dates.append('Atual')
+        elif month_name: dates.append(f"{MONTHS[MONTH_PREFIXES.index(month_name)]} de {year}")
+        elif month_number and 1 <= int(month_number) <= 12: dates.append(f"{MONTHS[int(month_number) - 1]} de {year}")
+        elif month_number: return None, 0.0
+        else: dates.append(year)
+    if not 1 <= len(dates) <= 2: return None, 0.0
+    if len(dates) == 1 and dates[0] != 'Atual' and re.search(r'\bdesde\b', text): dates.append('Atual')
+    leftover = [word for word in re.findall(r'[a-z]+', PERIOD_TOKEN_RE.sub(' ', text)) if word not in PERIOD_FILLER_WORDS]
+    return ' - '.join(dates), 1.0 if not leftover else 0.5
+
+def extract_locally(field_key, user_message):
+    extractor = local_extractors.get(field_key)
+    value, confidence = extractor(user_message) if extractor else (None, 0.0)
+    source = 'local' if value and confidence >= LOCAL_EXTRACTION_MIN_CONFIDENCE else 'llm'
+    with _extraction_stats_lock:
+        extraction_stats[source] += 1
+        field_stats = extraction_stats['by_field'].setdefault(field_key, {'local': 0, 'llm': 0})
+        field_stats[source] += 1
+    return value if source == 'local' else None
+
+def get_extraction_stats():
+    with _extraction_stats_lock:
+        total = extraction_stats['local'] + extraction_stats['llm']
+        return dict(extraction_stats, by_field={key: dict(value) for key, value in extraction_stats['by_field'].items()},
+                    local_share=round(extraction_stats['local'] / total, 4) if total else 0.0)
 
 def extract_and_format_info(field_key, question, user_message):
+    local_info = extract_locally(field_key, user_message)
+    if local_info: return local_info
+
     system_prompt = "Você é um assistente que extrai a informação principal da resposta de um usuário, de forma limpa e direta, sem saudações ou frases adicionais. Apenas a informação pura."
     user_prompt_template = 'Pergunta: "{question}"\nResposta do usuário: "{user_message}"\n\nExtraia a informação relevante:'
 
@@ -181,68 +1349,429 @@ def extract_and_format_info(field_key, question, user_message):
     extracted_info = get_openai_response([
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
-    ]) or user_message
+    ], cache=True, task=f'extract:{field_key}') or user_message
 
     return extracted_info.strip()
 
-def analyze_pix_receipt(image_url):
+# --- Extração de vários campos de uma vez (bloco de contato ou experiência colados numa mensagem) ---
+BULK_MIN_CHARS = 60
+BULK_LIST_FIELDS = ('habilidades', 'cursos')
+EXPERIENCE_FIELDS = ('cargo', 'empresa', 'periodo', 'descricao')
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+# Respostas de texto livre: longas e com várias linhas por natureza, então ali só contam sinais de campos.
+FREE_TEXT_FIELDS = ('resumo', 'formacao', 'habilidades', 'descricao')
+
+def looks_like_bulk_message(message, free_text=False):
+    # Sinais baratos de que a mensagem traz mais de um campo; só então vale a chamada de extração em lote.
+    # Em etapas de texto livre são exigidos dois campos distintos (e-mail, telefone, período de/até).
+    field_signals = [bool(EMAIL_RE.search(message)), bool(PHONE_RE.search(message)), len(PERIOD_TOKEN_RE.findall(message.lower())) >= 2]
+    if free_text: return sum(field_signals) >= 2
+    signals = [bool(EMAIL_RE.search(message)), bool(PHONE_RE.search(message)), bool(YEAR_RE.search(message)),
+               len([line for line in message.splitlines() if line.strip()]) >= 2, len(message) >= BULK_MIN_CHARS]
+    return sum(signals) >= 2
+
+def extract_bulk_fields(message):
+    # Uma única chamada em modo JSON devolve todos os campos do currículo (e de uma experiência) presentes na mensagem.
+    system_prompt = (
+        "Você extrai dados de currículo de uma mensagem de WhatsApp. Retorne APENAS um objeto JSON com as chaves cujas informações "
+        "aparecem explicitamente na mensagem; omita as demais e não invente nada. Chaves possíveis: "
+        "nome_completo (capitalização correta, conectivos como 'de' e 'da' em minúsculo), cidade_estado ('Cidade - UF'), telefone, email, "
+        "resumo, formacao, habilidades (lista de strings), cursos (lista de strings) e experiencia (objeto com cargo, empresa, "
+        "periodo no formato 'Mês de Ano - Mês de Ano' ou 'Ano - Ano', e descricao)."
+    )
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
+    response_str = get_openai_response(messages, is_json=True, cache=True, task='extract_bulk', validate=lambda data: isinstance(data, dict))
+    if not response_str: return {}
+    data, fields = json.loads(response_str), {}
+    for key in [key for key, _ in CONVERSATION_FLOW]:
+        value = data.get(key)
+        if key in BULK_LIST_FIELDS:
+            items = value if isinstance(value, list) else str(value or '').split(',')
+            value = [str(item).strip() for item in items if str(item).strip()]
+        elif isinstance(value, str):
+            value = value.strip()
+            extractor = local_extractors.get(key)
+            if value and extractor:
+                # Telefone, e-mail e cidade passam pelo mesmo formatador da extração local.
+                normalized, confidence = extractor(value)
+                if normalized and confidence >= LOCAL_EXTRACTION_MIN_CONFIDENCE: value = normalized
+        else:
+            value = None
+        if value: fields[key] = value
+    experience = data.get('experiencia')
+    if isinstance(experience, dict):
+        experience = {key: str(experience[key]).strip() for key in EXPERIENCE_FIELDS if experience.get(key) and str(experience[key]).strip()}
+        if experience: fields['experiencia'] = experience
+    with _extraction_stats_lock:
+        extraction_stats['bulk'] += 1
+        extraction_stats['bulk_fields'] += len(fields) + len(fields.get('experiencia', {})) - ('experiencia' in fields)
+    return fields
+
+def apply_bulk_fields(phone, resume_data, fields, current_experience=None):
+    # Grava só o que ainda não foi respondido; uma experiência completa vai direto para a lista.
+    resume_fields, resume_append = {}, {}
+    for key, value in fields.items():
+        if key == 'experiencia' or resume_data.get(key): continue
+        if key in BULK_LIST_FIELDS: resume_append[key] = value
+        else: resume_fields[key] = value
+    experience = dict(fields.get('experiencia', {}), **{key: value for key, value in (current_experience or {}).items() if value})
+    if resume_fields or resume_append:
+        update_user(phone, {}, resume_fields=resume_fields or None, resume_append=resume_append or None)
+        resume_data = apply_resume_patch(dict(resume_data), resume_fields, resume_append)
+    return resume_data, experience
+
+class ReceiptRegistry:
+    # Comprovantes já analisados, na tabela `pix_receipts`: hash exato (sha256 dos bytes) e hash
+    # perceptual (dHash de 64 bits, que sobrevive a recompressão e redimensionamento). O dHash é
+    # guardado também em PIX_PHASH_BANDS faixas de 16 bits indexadas: dois hashes a distância
+    # < PIX_PHASH_BANDS têm ao menos uma faixa idêntica, então a busca por vizinhos usa só o índice.
+    def lookup_exact(self, sha256):
+        return get_db_connection().execute("SELECT * FROM pix_receipts WHERE sha256 = ? ORDER BY verified DESC, id LIMIT 1", (sha256,)).fetchone()
+
+    def lookup_similar(self, phash, exclude_phone):
+        bands = self.bands(phash)
+        rows = get_db_connection().execute(
+            "SELECT * FROM pix_receipts WHERE verified = 1 AND phone != ? AND (" + ' OR '.join(f'band{i} = ?' for i in range(PIX_PHASH_BANDS)) + ")",
+            (exclude_phone, *bands)).fetchall()
+        matches = [row for row in rows if bin(int(row['phash'], 16) ^ phash).count('1') <= PIX_PHASH_MAX_DISTANCE]
+        return min(matches, key=lambda row: bin(int(row['phash'], 16) ^ phash).count('1')) if matches else None
+
+    def record(self, sha256, phash, phone, verified):
+        with get_db_connection() as conn:
+            conn.execute(f"INSERT INTO pix_receipts (sha256, phash, {', '.join(f'band{i}' for i in range(PIX_PHASH_BANDS))}, phone, verified, created_at) VALUES (?, ?, {', '.join('?' * PIX_PHASH_BANDS)}, ?, ?, ?)",
+                         (sha256, f"{phash:016x}", *self.bands(phash), phone, int(verified), time.time()))
+
+    @staticmethod
+    def bands(phash):
+        return [(phash >> (16 * i)) & 0xFFFF for i in range(PIX_PHASH_BANDS)]
+
+receipt_registry = ReceiptRegistry()
+
+def download_receipt_image(image_url):
+    # Baixa a imagem uma única vez, com limite de tamanho; None se não der (a análise usa a URL).
+    try:
+        with requests.get(image_url, timeout=(5, 20), stream=True) as response:
+            response.raise_for_status()
+            content = b''
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > PIX_IMAGE_MAX_BYTES: raise ValueError(f"imagem maior que {PIX_IMAGE_MAX_BYTES} bytes")
+            return content
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Erro ao baixar comprovante {image_url}: {e}")
+        return None
+
+def dhash(image):
+    # Hash perceptual por diferença: compara pixels vizinhos de uma miniatura 9x8 em tons de cinza.
+    pixels = image.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def prepare_receipt_image(image):
+    # Reduz para o que o modelo de visão usa de fato (cabe em PIX_IMAGE_MAX_LONG_SIDE e o lado menor
+    # fica em até PIX_IMAGE_MAX_SHORT_SIDE) e envia como JPEG embutido na mensagem.
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    scale = min(1.0, PIX_IMAGE_MAX_LONG_SIDE / max(image.size), PIX_IMAGE_MAX_SHORT_SIDE / min(image.size))
+    if scale < 1.0: image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=PIX_IMAGE_JPEG_QUALITY, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def ask_receipt_model(image_ref):
     system_prompt = f'Analise a imagem de um comprovante PIX. Verifique se o nome do recebedor é "{PIX_RECIPIENT_NAME}". Responda APENAS com um objeto JSON com a chave "verified" (true/false). Não inclua a formatação markdown ```json```.'
-    messages = [{"role": "user", "content": [{"type": "text", "text": system_prompt}, {"type": "image_url", "image_url": {"url": image_url}}]}]
-    json_response_str = get_openai_response(messages, is_json=True)
-    if json_response_str: return json.loads(json_response_str)
-    return {'verified': False}
+    messages = [{"role": "user", "content": [{"type": "text", "text": system_prompt}, {"type": "image_url", "image_url": {"url": image_ref, "detail": "high"}}]}]
+    json_response_str = get_openai_response(messages, is_json=True, task='pix_receipt', validate=lambda data: isinstance(data.get('verified'), bool))
+    return json.loads(json_response_str)['verified'] if json_response_str else None  # None: o modelo não respondeu
+
+def analyze_pix_receipt(image_url, phone=None):
+    # A imagem é baixada uma vez: reenvios do mesmo arquivo pelo mesmo telefone são respondidos pelo
+    # registro, sem nova chamada ao modelo; um comprovante já aceito não vale de novo (em outro telefone
+    # o admin é avisado). Semelhança perceptual com comprovante aceito de outro telefone só gera alerta:
+    # comprovantes do mesmo banco têm layout quase igual e podem ficar próximos no dHash.
+    content = download_receipt_image(image_url)
+    try:
+        image = Image.open(io.BytesIO(content)) if content else None
+        if image: image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        logging.error(f"Comprovante de {phone} não é uma imagem válida: {e}")
+        image = None
+    if image is None:
+        pix_receipt_results.inc('unprocessed')
+        return {'verified': bool(ask_receipt_model(image_url))}
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    previous = receipt_registry.lookup_exact(sha256)
+    if previous and previous['verified']:
+        pix_receipt_results.inc('reused')
+        if previous['phone'] != phone:
+            send_whatsapp_message(ADMIN_PHONE_NUMBER, f"⚠️ Comprovante PIX repetido!\n\nTelefone: {phone}\nJá usado por: {previous['phone']}\nImagem: {image_url}")
+        return {'verified': False, 'reused': True}
+    if previous and previous['phone'] == phone:
+        pix_receipt_results.inc('cached')
+        return {'verified': False}
+
+    phash = dhash(image)
+    verified = ask_receipt_model(prepare_receipt_image(image))
+    if verified is None: return {'verified': False}
+    receipt_registry.record(sha256, phash, phone, verified)
+    pix_receipt_results.inc('verified' if verified else 'rejected')
+    similar = receipt_registry.lookup_similar(phash, phone) if verified else None
+    if similar:
+        pix_receipt_results.inc('similar')
+        send_whatsapp_message(ADMIN_PHONE_NUMBER, f"⚠️ Comprovante PIX parecido com um já usado, confira.\n\nTelefone: {phone}\nParecido com o de: {similar['phone']}\nImagem: {image_url}")
+    return {'verified': verified}
+
+ENGLISH_RESUME_KEYS = {
+    'nome_completo': 'full_name', 'cidade_estado': 'city_state', 'telefone': 'phone', 'email': 'email',
+    'cargo': 'desired_role', 'resumo': 'professional_summary', 'experiencias': 'work_experience',
+    'formacao': 'education', 'habilidades': 'skills', 'cursos': 'courses_certifications'
+}
+ENGLISH_EXPERIENCE_KEYS = {'cargo': 'title', 'empresa': 'company', 'periodo': 'period', 'descricao': 'description'}
+TRANSLATED_RESUME_FIELDS = ('cargo', 'resumo', 'formacao', 'habilidades', 'cursos')
+TRANSLATED_EXPERIENCE_FIELDS = ('cargo', 'periodo', 'descricao')
+
+class TranslationMemory:
+    # Memória de tradução por valor: cada texto em português é traduzido uma única vez e guardado
+    # pelo hash do conteúdo (no mesmo arquivo do cache da OpenAI).
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+        self.hits = self.misses = 0
+
+    def _conn(self):
+        conn = get_db_connection(self.path)
+        if not self._initialized:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS translations (hash TEXT PRIMARY KEY, source TEXT, target TEXT, created_at REAL)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def lookup(self, texts):
+        hashes = {self.text_hash(text): text for text in texts}
+        found = {}
+        try:
+            placeholders = ', '.join('?' * len(hashes))
+            for row in self._conn().execute(f"SELECT hash, target FROM translations WHERE hash IN ({placeholders})", tuple(hashes)):
+                found[hashes[row['hash']]] = row['target']
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao ler memória de tradução: {e}")
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def store(self, translations):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO translations (hash, source, target, created_at) VALUES (?, ?, ?, ?)",
+                                 [(self.text_hash(source), source, target, time.time()) for source, target in translations.items()])
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao gravar memória de tradução: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+translation_memory = TranslationMemory(OPENAI_CACHE_FILE)
+
+def translate_texts_to_english(texts):
+    # Só os textos que ainda não estão na memória vão para o modelo, todos em um único pedido.
+    texts = list(dict.fromkeys(text for text in texts if text))
+    if not texts: return {}
+    translations = translation_memory.lookup(texts)
+    missing = [text for text in texts if text not in translations]
+    if not missing: return translations
+    system_prompt = "Você é um tradutor especialista em currículos. Traduza cada valor do JSON a seguir do português para o inglês profissional, mantendo exatamente as mesmas chaves. Retorne APENAS o JSON traduzido."
+    batch = {str(i): text for i, text in enumerate(missing)}
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": json.dumps(batch, ensure_ascii=False)}]
+    translated_json_str = get_openai_response(messages, is_json=True, task='translate',
+                                              validate=lambda data: isinstance(data, dict) and all(isinstance(data.get(key), str) for key in batch))
+    if not translated_json_str: return None
+    translated = json.loads(translated_json_str)
+    if not isinstance(translated, dict) or not all(isinstance(translated.get(key), str) for key in batch):
+        logging.error(f"Tradução incompleta: {translated_json_str}")
+        return None
+    new_translations = {text: translated[key].strip() for key, text in batch.items()}
+    translation_memory.store(new_translations)
+    translations.update(new_translations)
+    return translations
 
 def translate_resume_data_to_english(resume_data):
-    system_prompt = "Você é um tradutor especialista em currículos. Traduza o seguinte JSON de dados de um currículo do português para o inglês profissional. Traduza tanto as chaves (keys) quanto os valores (values) para o inglês. Use estas chaves em inglês: 'full_name', 'city_state', 'phone', 'email', 'cargo' (para 'desired_role'), 'resumo' (para 'professional_summary'), 'experiencias' (para 'work_experience'), 'formacao' (para 'education'), 'habilidades' (para 'skills'), 'cursos' (para 'courses_certifications'). O valor de 'work_experience' deve ser uma lista de dicionários, traduza o conteúdo dentro deles também (cargo, empresa, periodo, descricao). Retorne APENAS o JSON traduzido."
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": json.dumps(resume_data, ensure_ascii=False)}]
-    translated_json_str = get_openai_response(messages, is_json=True)
-    if translated_json_str:
-        try: return json.loads(translated_json_str)
-        except json.JSONDecodeError as e:
-            logging.error(f"Erro ao decodificar JSON traduzido: {e}\nJSON: {translated_json_str}")
-            return None
-    return None
-
-def improve_experience_descriptions(experiences):
+    def texts_of(value):
+        if isinstance(value, str): return [value]
+        if isinstance(value, list): return [str(item) for item in value if item]
+        return []
+
+    experiences = [exp for exp in resume_data.get('experiencias') or [] if isinstance(exp, dict)]
+    texts = [text for key in TRANSLATED_RESUME_FIELDS for text in texts_of(resume_data.get(key))]
+    texts += [text for exp in experiences for key in TRANSLATED_EXPERIENCE_FIELDS for text in texts_of(exp.get(key))]
+    translations = translate_texts_to_english(texts)
+    if translations is None: return None
+
+    def translate(value):
+        if isinstance(value, str): return translations.get(value, value)
+        if isinstance(value, list): return [translations.get(str(item), item) for item in value if item]
+        return value
+
+    english_data = {}
+    for key, english_key in ENGLISH_RESUME_KEYS.items():
+        if key == 'experiencias':
+            english_data[english_key] = [
+                {ENGLISH_EXPERIENCE_KEYS.get(exp_key, exp_key): translate(value) if exp_key in TRANSLATED_EXPERIENCE_FIELDS else value for exp_key, value in exp.items()}
+                for exp in experiences
+            ]
+        elif key in resume_data:
+            english_data[english_key] = translate(resume_data[key]) if key in TRANSLATED_RESUME_FIELDS else resume_data[key]
+    return english_data
+
+class JsonItemStream:
+    # Recebe um JSON em pedaços e devolve cada objeto de lista assim que ele fecha, sem esperar o resto.
+    def __init__(self):
+        self.buffer, self._pos, self._stack, self._in_string, self._escape, self._start = '', 0, [], False, False, None
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        for i in range(self._pos, len(self.buffer)):
+            char = self.buffer[i]
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif char == '\\': self._escape = True
+                elif char == '"': self._in_string = False
+            elif char == '"': self._in_string = True
+            elif char in '[{':
+                if char == '{' and self._stack and self._stack[-1] == '[' and self._start is None: self._start = (i, len(self._stack))
+                self._stack.append(char)
+            elif char in ']}' and self._stack:
+                self._stack.pop()
+                if char == '}' and self._start and self._start[1] == len(self._stack):
+                    try: items.append(json.loads(self.buffer[self._start[0]:i + 1]))
+                    except json.JSONDecodeError: pass
+                    self._start = None
+        self._pos = len(self.buffer)
+        return items
+
+def improve_experience_descriptions(experiences, on_experience=None):
+    # on_experience(indice, experiencia) é chamado para cada experiência reescrita assim que ela chega no streaming.
+    # Retorna None se a IA falhar; quem chama mantém as experiências originais.
     system_prompt = "Você é um especialista em RH que otimiza currículos. Reescreva a lista de experiências profissionais a seguir para que foquem em resultados e ações, usando verbos de impacto e um tom profissional. Transforme responsabilidades em conquistas. Mantenha a estrutura de lista de dicionários do JSON original e retorne apenas o JSON."
     user_prompt = f"Experiências originais: {json.dumps(experiences, ensure_ascii=False)}\n\nReescreva as descrições de forma profissional e focada em resultados (retorne apenas a lista em JSON):"
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
-    response_str = get_openai_response(messages, is_json=True)
+    item_stream, received = JsonItemStream(), []
+    def stream_items(text):
+        for item in item_stream.feed(text):
+            received.append(item)
+            on_experience(len(received) - 1, item)
+    response_str = get_openai_response(messages, is_json=True, task='improve_experiences', on_text=stream_items if on_experience else None,
+                                       validate=lambda data: isinstance(data, list) or (isinstance(data, dict) and isinstance(data.get('work_experience'), list)))
     if response_str:
         try:
             response_data = json.loads(response_str)
             if isinstance(response_data, dict) and 'work_experience' in response_data: return response_data['work_experience']
             elif isinstance(response_data, list): return response_data
-        except (json.JSONDecodeError, TypeError): return experiences
-    return experiences
+        except (json.JSONDecodeError, TypeError): pass
+    return None
+
+QUESTION_START_RE = re.compile(r"^[ \t*]*\d+\s*[.)-]", re.MULTILINE)
 
-def generate_interview_questions(resume_data):
+def generate_interview_questions(resume_data, on_question=None):
+    # on_question(texto) recebe cada pergunta numerada assim que ela termina (quando a próxima começa).
+    # Se a resposta falhar no meio, as perguntas já repassadas ficam e o resto do texto é descartado.
     system_prompt = "Você é um recrutador sênior preparando uma entrevista para a vaga de '{cargo}'. Com base no currículo do candidato, crie uma lista de 5 a 7 perguntas de entrevista perspicazes e relevantes, misturando perguntas comportamentais (STAR: Situação, Tarefa, Ação, Resultado) e técnicas baseadas nas experiências e habilidades listadas. Formate a resposta como um texto único, com cada pergunta numerada."
     user_prompt = f"Currículo do candidato:\n{json.dumps(resume_data, indent=2, ensure_ascii=False)}\n\nListe as perguntas para a entrevista:"
-    return get_openai_response([{"role": "system", "content": system_prompt.format(cargo=resume_data.get('cargo', ''))}, {"role": "user", "content": user_prompt}])
+    messages = [{"role": "system", "content": system_prompt.format(cargo=resume_data.get('cargo', ''))}, {"role": "user", "content": user_prompt}]
+    if not on_question: return get_openai_response(messages, cache=True, task='interview_questions')
+
+    pending = {'text': ''}
+    def on_text(text):
+        pending['text'] += text
+        starts = [match.start() for match in QUESTION_START_RE.finditer(pending['text'])]
+        for start, next_start in zip(starts, starts[1:]):
+            on_question(pending['text'][start:next_start].strip())
+        if len(starts) > 1: pending['text'] = pending['text'][starts[-1]:]
+
+    questions = get_openai_response(messages, cache=True, task='interview_questions', on_text=on_text)
+    # A última pergunta (ou um texto sem numeração) só termina junto com a resposta bem-sucedida.
+    if questions:
+        match = QUESTION_START_RE.search(pending['text'])
+        remainder = pending['text'][match.start():] if match else pending['text']
+        if remainder.strip(): on_question(remainder.strip())
+    return questions
 
 # ==============================================================================
 # --- 6. GERAÇÃO DE PDF (VERSÃO FINAL)
 # ==============================================================================
+class FontRegistry:
+    # As fontes DejaVu são lidas e indexadas (cmap, larguras, descritor) uma única vez por processo.
+    # Cada documento recebe uma cópia rasa desse TTFFont com o estado mutável próprio (subset,
+    # descritor e um TTFont preguiçoso sobre os bytes em memória, que o fpdf2 recorta ao salvar).
+    FONT_FILES = {'': 'DejaVuSans.ttf', 'B': 'DejaVuSans-Bold.ttf', 'I': 'DejaVuSans-Oblique.ttf', 'BI': 'DejaVuSans-BoldOblique.ttf'}
+    FAMILY = 'DejaVu'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prototypes = None
+        self._font_bytes = {}
+        self._clone_supported = True
+
+    def _load(self):
+        if not os.path.exists(FONT_DIR):
+            os.makedirs(FONT_DIR)
+            logging.warning(f"Pasta de fontes não encontrada, criada em {FONT_DIR}.")
+        font_paths = {style: os.path.join(FONT_DIR, filename) for style, filename in self.FONT_FILES.items()}
+        for path in font_paths.values():
+            if not os.path.isfile(path): raise RuntimeError(f"Arquivo de fonte não encontrado: {path}.")
+        scratch = FPDF()
+        for style, path in font_paths.items():
+            scratch.add_font(self.FAMILY, style, path)
+            with open(path, 'rb') as f:
+                self._font_bytes[f"{self.FAMILY.lower()}{style}"] = f.read()
+        self._prototypes = {fontkey: font for fontkey, font in scratch.fonts.items() if fontkey in self._font_bytes}
+        logging.info("Fontes DejaVu carregadas no registro do processo.")
+
+    def install(self, pdf):
+        with self._lock:
+            if self._prototypes is None: self._load()
+        if self._clone_supported:
+            try:
+                for fontkey, prototype in self._prototypes.items():
+                    pdf.fonts[fontkey] = self._clone(pdf, prototype, fontkey)
+                return
+            except AttributeError as e:
+                # Versões do fpdf2 com outra estrutura interna: volta para o carregamento por documento.
+                logging.warning(f"Não foi possível reaproveitar as fontes do registro ({e}); usando add_font.")
+                self._clone_supported = False
+                for fontkey in self._prototypes: pdf.fonts.pop(fontkey, None)
+        for style, filename in self.FONT_FILES.items():
+            pdf.add_font(self.FAMILY, style, os.path.join(FONT_DIR, filename))
+
+    def _clone(self, pdf, prototype, fontkey):
+        font = copy.copy(prototype)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(io.BytesIO(self._font_bytes[fontkey]), recalcTimestamp=False, lazy=True)
+        font.desc = copy.copy(prototype.desc)
+        font.biggest_size_pt = 0
+        font.missing_glyphs = []
+        font._hbfont = None
+        font.subset = SubsetMap(font)
+        return font
+
+font_registry = FontRegistry()
+
 class PDF(FPDF):
     def add_font_setup(self):
         try:
-            if not os.path.exists(FONT_DIR):
-                os.makedirs(FONT_DIR)
-                logging.warning(f"Pasta de fontes não encontrada, criada em {FONT_DIR}.")
-            font_paths = {
-                'DejaVu': os.path.join(FONT_DIR, 'DejaVuSans.ttf'),
-                'DejaVuB': os.path.join(FONT_DIR, 'DejaVuSans-Bold.ttf'),
-                'DejaVuI': os.path.join(FONT_DIR, 'DejaVuSans-Oblique.ttf'),
-                'DejaVuBI': os.path.join(FONT_DIR, 'DejaVuSans-BoldOblique.ttf'),
-            }
-            for name, path in font_paths.items():
-                if not os.path.isfile(path): raise RuntimeError(f"Arquivo de fonte não encontrado: {path}.")
-            
-            self.add_font('DejaVu', '', font_paths['DejaVu'], uni=True)
-            self.add_font('DejaVu', 'B', font_paths['DejaVuB'], uni=True)
-            self.add_font('DejaVu', 'I', font_paths['DejaVuI'], uni=True)
-            self.add_font('DejaVu', 'BI', font_paths['DejaVuBI'], uni=True)
+            font_registry.install(self)
             self.font_regular = 'DejaVu'
             self.font_bold = 'DejaVu'
         except Exception as e:
@@ -251,16 +1780,128 @@ class PDF(FPDF):
             self.font_bold = 'Helvetica'
         self.set_font(self.font_regular, '', 10)
 
-def generate_resume_pdf(data, template_choice, path):
+class PdfRenderCache:
+    # Cache em disco (volume RENDER_DISK_PATH) dos PDFs já renderizados, endereçado pelo hash canônico
+    # de (resume_data, template, idioma). Acima de PDF_CACHE_MAX_MB remove os arquivos menos usados.
+    VERSION = 1  # Incrementar ao mudar o layout dos templates, para não servir PDFs antigos.
+
+    def __init__(self, directory, max_bytes):
+        self.directory, self.max_bytes = directory, max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self.hits = self.misses = self.evictions = 0
+
+    @classmethod
+    def make_key(cls, data, template, lang):
+        canonical = json.dumps({'data': data, 'template': template, 'lang': lang, 'version': cls.VERSION}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Nome temporário único entre threads e entre os workers que dividem o volume.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(pdf_bytes)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                with contextlib.suppress(OSError): os.remove(tmp_path)
+                raise
+        except OSError as e:
+            logging.error(f"Erro ao gravar PDF no cache: {e}")
+            return
+        with self._lock:
+            if self._total_bytes is None: self._total_bytes = sum(size for _, _, size in self._scan())
+            else: self._total_bytes += len(pdf_bytes)
+            if self._total_bytes > self.max_bytes: self._evict()
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # Outros workers podem gravar no mesmo diretório: recalcula o total a partir do disco.
+        entries = sorted(self._scan())
+        self._total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._total_bytes <= self.max_bytes * 0.9: break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                    'evictions': self.evictions, 'size_bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+pdf_render_cache = PdfRenderCache(PDF_CACHE_DIR, int(PDF_CACHE_MAX_MB * 1024 * 1024))
+
+def render_template(template, data, lang='pt'):
+    # Roda dentro dos processos do pool de renderização (ou no próprio processo, sem pool).
     templates = {'moderno': generate_template_moderno, 'classico': generate_template_classico}
-    pdf_function = templates.get(template_choice, generate_template_moderno)
-    pdf_function(data, path)
+    return templates[template](data, lang)
+
+def _init_render_worker():
+    # Cada processo de renderização carrega as fontes uma vez, antes do primeiro documento.
+    PDF().add_font_setup()
+
+def _render_process_pool(workers):
+    # 'spawn' evita herdar locks e conexões dos threads do processo principal.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_render_worker)
+
+render_executor = BoundedExecutor('render', _render_process_pool, RENDER_PROCESSES, RENDER_QUEUE_MAX)
 
-def generate_template_moderno(data, path):
+def render_pdf_bytes(template, data, lang='pt'):
+    # Sem timeout: quem pede o PDF espera uma vaga no pool, o que segura novas entregas quando está cheio.
+    if RENDER_PROCESSES <= 0: return render_template(template, data, lang)
+    try:
+        return render_executor.submit(render_template, template, data, lang).result()
+    except (BrokenProcessPool, OSError) as e:
+        logging.error(f"Pool de renderização indisponível ({e}); renderizando no próprio processo.")
+        return render_template(template, data, lang)
+
+def generate_resume_pdf(data, template_choice, path=None, lang='pt'):
+    # Renderiza em memória e devolve os bytes do PDF; `path` é opcional (só para depuração).
+    # `lang` vem de quem gerou os dados ('en' para a tradução), não das chaves presentes no dicionário.
+    template = template_choice if template_choice in ('moderno', 'classico') else 'moderno'
+    cache_key = PdfRenderCache.make_key(data, template, lang) if PDF_CACHE_MAX_MB > 0 else None
+    pdf_bytes = pdf_render_cache.get(cache_key) if cache_key else None
+    if pdf_bytes is None:
+        pdf_bytes = render_pdf_bytes(template, data, lang)
+        if cache_key: pdf_render_cache.put(cache_key, pdf_bytes)
+    if path:
+        with open(path, 'wb') as f:
+            f.write(pdf_bytes)
+    return pdf_bytes
+
+def generate_template_moderno(data, lang='pt'):
     pdf = PDF()
     pdf.add_font_setup(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=15)
     SIDEBAR_COLOR, ACCENT_COLOR = (45, 52, 54), (26, 188, 156)
-    lang = 'en' if 'full_name' in data else 'pt'
 
     pdf.set_fill_color(*SIDEBAR_COLOR); pdf.rect(0, 0, 70, 297, 'F')
     pdf.set_xy(10, 20); pdf.set_text_color(255, 255, 255)
@@ -277,7 +1918,7 @@ def generate_template_moderno(data, path):
     add_sidebar_section("Contato" if lang == 'pt' else "Contact", [item for item in contact_list if item])
     add_sidebar_section("Formação" if lang == 'pt' else "Education", [data.get('formacao') or data.get('education')])
     add_sidebar_section("Habilidades" if lang == 'pt' else "Skills", data.get('habilidades') or data.get('skills'))
-    add_sidebar_section("Cursos", data.get('cursos') or data.get('courses_certifications'))
+    add_sidebar_section("Cursos" if lang == 'pt' else "Courses", data.get('cursos') or data.get('courses_certifications'))
 
     pdf.set_xy(80, 20); pdf.set_text_color(40, 40, 40)
     pdf.set_font(pdf.font_bold, 'B', 28); pdf.multi_cell(120, 11, data.get('nome_completo') or data.get('full_name', ''))
@@ -299,19 +1940,18 @@ def generate_template_moderno(data, path):
             pdf.set_x(80); pdf.multi_cell(120, 6, content)
         pdf.ln(6)
 
-    title_map = {"resumo": "Resumo Profissional", "experiencias": "Experiência Profissional"} if lang == 'pt' else {"professional_summary": "Professional Summary", "work_experience": "Work Experience"}
+    title_map = {"resumo": "Resumo Profissional", "experiencias": "Experiência Profissional"} if lang == 'pt' else {"resumo": "Professional Summary", "experiencias": "Work Experience"}
     add_right_section(title_map.get('resumo', 'Resumo'), data.get('resumo') or data.get('professional_summary'))
     add_right_section(title_map.get('experiencias', 'Experiências'), data.get('experiencias') or data.get('work_experience'))
-    pdf.output(path)
+    return pdf.output()
 
-def generate_template_classico(data, path):
+def generate_template_classico(data, lang='pt'):
     pdf = PDF()
     pdf.add_font_setup(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=15)
-    lang = 'en' if 'full_name' in data else 'pt'
     
     pdf.set_font(pdf.font_bold, 'B', 24); pdf.cell(0, 10, (data.get('nome_completo') or data.get('full_name', '')).upper(), 0, 1, 'C')
     pdf.set_font(pdf.font_regular, '', 11)
-    contato = f"{data.get('cidade_estado', '')} | {data.get('telefone', '')} | {data.get('email', '')}"
+    contato = f"{data.get('cidade_estado') or data.get('city_state', '')} | {data.get('telefone') or data.get('phone', '')} | {data.get('email', '')}"
     pdf.cell(0, 8, contato, 0, 1, 'C'); pdf.ln(2)
     pdf.set_font(pdf.font_bold, '', 12); pdf.cell(0, 8, (data.get('cargo') or data.get('desired_role', '')).upper(), 0, 1, 'C')
     pdf.ln(5); pdf.line(10, pdf.get_y(), 200, pdf.get_y()); pdf.ln(7)
@@ -333,13 +1973,13 @@ def generate_template_classico(data, path):
             pdf.set_x(pdf.l_margin); pdf.multi_cell(0, 6, content)
         pdf.ln(4)
         
-    title_map = {"resumo": "Resumo", "experiencias": "Experiência Profissional", "formacao": "Formação Acadêmica", "habilidades": "Habilidades", "cursos": "Cursos e Certificações"} if lang == 'pt' else {"professional_summary": "Summary", "work_experience": "Work Experience", "education": "Education", "skills": "Skills", "courses_certifications": "Courses & Certifications"}
+    title_map = {"resumo": "Resumo", "experiencias": "Experiência Profissional", "formacao": "Formação Acadêmica", "habilidades": "Habilidades", "cursos": "Cursos e Certificações"} if lang == 'pt' else {"resumo": "Summary", "experiencias": "Work Experience", "formacao": "Education", "habilidades": "Skills", "cursos": "Courses & Certifications"}
     add_section(title_map.get('resumo', 'Resumo'), data.get('resumo') or data.get('professional_summary'))
     add_section(title_map.get('experiencias', 'Experiências'), data.get('experiencias') or data.get('work_experience'))
     add_section(title_map.get('formacao', 'Formação'), [data.get('formacao')] if data.get('formacao') else [data.get('education')])
     add_section(title_map.get('habilidades', 'Habilidades'), data.get('habilidades') or data.get('skills'))
     add_section(title_map.get('cursos', 'Cursos'), data.get('cursos') or data.get('courses_certifications'))
-    pdf.output(path)
+    return pdf.output()
 
 # ==============================================================================
 # --- 7. LÓGICA E FLUXO DA CONVERSA
@@ -422,15 +2062,25 @@ def show_review_menu(phone, resume_data):
     send_whatsapp_message(phone, review_text)
     update_user(phone, {'state': 'awaiting_review_choice', 'editing_field': None})
 
-def go_to_next_step(phone, resume_data, current_idx):
+def go_to_next_step(phone, resume_data, current_idx, current_experience=None):
+    # Pula as etapas que já foram respondidas (ex.: preenchidas pela extração em lote). `current_experience`
+    # é a experiência extraída desta mensagem; sem ela, vale a que já está gravada (colada numa mensagem
+    # anterior). A coluna só é limpa ao recomeçar o currículo ou ao concluir a experiência.
     user_name = resume_data.get('nome_completo', '').split(' ')[0].capitalize()
-    if current_idx + 1 < len(CONVERSATION_FLOW):
-        next_key, next_question = CONVERSATION_FLOW[current_idx + 1]
+    next_idx = current_idx + 1
+    while next_idx < len(CONVERSATION_FLOW) and resume_data.get(CONVERSATION_FLOW[next_idx][0]): next_idx += 1
+    if next_idx < len(CONVERSATION_FLOW):
+        next_key, next_question = CONVERSATION_FLOW[next_idx]
         next_question = next_question.format(nome=user_name)
         send_whatsapp_message(phone, next_question)
-        update_user(phone, {'state': f'flow_{next_key}'})
+        update_user(phone, {'state': f'flow_{next_key}', **({'current_experience': current_experience} if current_experience else {})})
+        return
+    current_experience = current_experience or (get_user(phone) or {}).get('current_experience')
+    if current_experience:
+        send_whatsapp_message(phone, f"Ótimo, {user_name}. Já anotei sua experiência como *{current_experience.get('cargo', '')}*, vamos completá-la.")
+        advance_experience(phone, resume_data, current_experience)
     else:
-        update_user(phone, {'state': 'awaiting_experience_job_title', 'current_experience': json.dumps({})})
+        update_user(phone, {'state': 'awaiting_experience_job_title'})
         send_whatsapp_message(phone, f"Ótimo, {user_name}. Agora vamos adicionar suas experiências profissionais, começando pela mais recente. Se não tiver, é só dizer 'pular'. Qual foi seu cargo?")
 
 # --- Handlers de Estado ---
@@ -474,85 +2124,102 @@ def create_flow_handler(current_step_index):
     @handle_state(f'flow_{current_key}')
     def flow_handler(user, message_data):
         phone, message = user['phone'], message_data.get('text', '')
-        resume_data = json.loads(user['resume_data'])
+        resume_data = user['resume_data']
         
         if message.lower().strip() in PULAR_COMMANDS and current_key == 'resumo':
             extracted_info = "Não informado"
         elif message.lower().strip() in PRONTO_COMMANDS and current_key == 'cursos':
             go_to_next_step(phone, resume_data, current_step_index)
             return
+        elif current_key != 'cursos' and looks_like_bulk_message(message, free_text=current_key in FREE_TEXT_FIELDS):
+            # Mensagem com vários campos: preenche todos e segue para a primeira etapa ainda sem resposta.
+            fields = extract_bulk_fields(message)
+            if fields:
+                if not fields.get(current_key):
+                    extracted_info = extract_and_format_info(current_key, current_question, message)
+                    fields[current_key] = [item.strip() for item in extracted_info.split(',') if item.strip()] if current_key in BULK_LIST_FIELDS else extracted_info
+                resume_data, experience = apply_bulk_fields(phone, resume_data, fields, user['current_experience'])
+                go_to_next_step(phone, resume_data, current_step_index, experience)
+                return
+            extracted_info = extract_and_format_info(current_key, current_question, message)
         else:
             extracted_info = extract_and_format_info(current_key, current_question, message)
         
         if current_key in ['habilidades', 'cursos']:
-            if not resume_data.get(current_key): resume_data[current_key] = []
             if current_key == 'habilidades':
-                resume_data[current_key].extend([h.strip() for h in extracted_info.split(',')])
+                update_user(phone, {}, resume_append={current_key: [h.strip() for h in extracted_info.split(',')]})
             else:
-                resume_data[current_key].append(extracted_info)
-            if current_key == 'cursos':
                 send_whatsapp_message(phone, 'Curso adicionado. Me diga o próximo ou digite "pronto" para finalizar.')
-                update_user(phone, {'resume_data': json.dumps(resume_data)}); return
+                update_user(phone, {}, resume_append={current_key: [extracted_info]}); return
         else:
-            resume_data[current_key] = extracted_info
+            resume_data = dict(resume_data, **{current_key: extracted_info})
+            update_user(phone, {}, resume_fields={current_key: extracted_info})
             
-        update_user(phone, {'resume_data': json.dumps(resume_data)})
         go_to_next_step(phone, resume_data, current_step_index)
 
 for i in range(len(CONVERSATION_FLOW)): create_flow_handler(i)
 
+EXPERIENCE_STEPS = [
+    ('cargo', 'awaiting_experience_job_title', "Qual foi seu cargo?"),
+    ('empresa', 'awaiting_experience_company', "Entendido. E o nome da empresa?"),
+    ('periodo', 'awaiting_experience_period', "Anotado. Qual foi o período? (Ex: 2020 - 2022 ou Jan 2021 - Dez 2022)"),
+    ('descricao', 'awaiting_experience_description', "Ok. Agora descreva brevemente suas responsabilidades e conquistas nesse cargo.")
+]
+
+def advance_experience(phone, resume_data, current_experience):
+    # Pergunta o primeiro campo da experiência que ainda falta; com todos preenchidos, adiciona a experiência.
+    for key, state, question in EXPERIENCE_STEPS:
+        if not current_experience.get(key):
+            update_user(phone, {'state': state, 'current_experience': current_experience})
+            send_whatsapp_message(phone, question)
+            return
+    # A experiência nova entra no início da lista (a mais recente aparece primeiro no currículo).
+    resume_fields = {}
+    if not resume_data.get('cargo'):
+        resume_fields['cargo'] = current_experience.get('cargo')
+        logging.info(f"Cargo principal definido como: {resume_fields['cargo']}")
+
+    update_user(phone, {'state': 'awaiting_another_experience', 'current_experience': {}},
+                resume_fields=resume_fields or None, resume_prepend={'experiencias': [current_experience]})
+    send_whatsapp_message(phone, "Experiência adicionada! Deseja adicionar outra? (Responda com *sim* ou *não*)")
+
+def fill_experience_from_message(user, field_key, question, message):
+    # Com uma experiência inteira colada na mensagem, preenche todos os campos de uma vez.
+    current_experience = dict(user['current_experience'] or {})
+    if looks_like_bulk_message(message, free_text=field_key in FREE_TEXT_FIELDS):
+        fields = extract_bulk_fields(message)
+        if fields.get('experiencia', {}).get(field_key):
+            _, experience = apply_bulk_fields(user['phone'], user['resume_data'], fields, current_experience)
+            return experience
+    current_experience[field_key] = extract_and_format_info(field_key, question, message)
+    return current_experience
+
 @handle_state('awaiting_experience_job_title')
 def handle_exp_job_title(user, message_data):
     phone, message = user['phone'], message_data.get('text', '')
     if message.lower().strip() in PULAR_COMMANDS:
-        show_review_menu(phone, json.loads(user['resume_data'])); return
-    
-    cargo = extract_and_format_info('cargo', "Qual foi seu cargo?", message)
-    current_experience = {'cargo': cargo}
-    update_user(phone, {'state': 'awaiting_experience_company', 'current_experience': json.dumps(current_experience)})
-    send_whatsapp_message(phone, "Entendido. E o nome da empresa?")
+        show_review_menu(phone, user['resume_data']); return
+    advance_experience(phone, user['resume_data'], fill_experience_from_message(dict(user, current_experience={}), 'cargo', "Qual foi seu cargo?", message))
 
 @handle_state('awaiting_experience_company')
 def handle_exp_company(user, message_data):
-    phone, message = user['phone'], message_data.get('text', '')
-    empresa = extract_and_format_info('empresa', "Qual o nome da empresa?", message)
-    current_experience = json.loads(user['current_experience'])
-    current_experience['empresa'] = empresa
-    update_user(phone, {'state': 'awaiting_experience_period', 'current_experience': json.dumps(current_experience)})
-    send_whatsapp_message(phone, "Anotado. Qual foi o período? (Ex: 2020 - 2022 ou Jan 2021 - Dez 2022)")
+    advance_experience(user['phone'], user['resume_data'], fill_experience_from_message(user, 'empresa', "Qual o nome da empresa?", message_data.get('text', '')))
 
 @handle_state('awaiting_experience_period')
 def handle_exp_period(user, message_data):
-    phone, message = user['phone'], message_data.get('text', '')
-    periodo = extract_and_format_info('periodo', "Qual foi o período?", message)
-    current_experience = json.loads(user['current_experience'])
-    current_experience['periodo'] = periodo
-    update_user(phone, {'state': 'awaiting_experience_description', 'current_experience': json.dumps(current_experience)})
-    send_whatsapp_message(phone, "Ok. Agora descreva brevemente suas responsabilidades e conquistas nesse cargo.")
+    advance_experience(user['phone'], user['resume_data'], fill_experience_from_message(user, 'periodo', "Qual foi o período?", message_data.get('text', '')))
 
 @handle_state('awaiting_experience_description')
 def handle_exp_description(user, message_data):
     phone, message = user['phone'], message_data.get('text', '')
-    descricao = extract_and_format_info('descricao', "Descreva suas responsabilidades.", message)
-    current_experience = json.loads(user['current_experience'])
-    current_experience['descricao'] = descricao
-    resume_data = json.loads(user['resume_data'])
-    
-    if 'experiencias' not in resume_data or not isinstance(resume_data['experiencias'], list): resume_data['experiencias'] = []
-    resume_data['experiencias'].insert(0, current_experience)
-    
-    if not resume_data.get('cargo'):
-        resume_data['cargo'] = current_experience.get('cargo')
-        logging.info(f"Cargo principal definido como: {resume_data['cargo']}")
-
-    update_user(phone, {'state': 'awaiting_another_experience', 'resume_data': json.dumps(resume_data)})
-    send_whatsapp_message(phone, "Experiência adicionada! Deseja adicionar outra? (Responda com *sim* ou *não*)")
+    current_experience = dict(user['current_experience'] or {}, descricao=extract_and_format_info('descricao', "Descreva suas responsabilidades.", message))
+    advance_experience(phone, user['resume_data'], current_experience)
 
 @handle_state('awaiting_another_experience')
 def handle_another_experience(user, message_data):
     phone, choice = user['phone'], message_data.get('text', '').lower().strip()
-    if choice == 'sim':
-        update_user(phone, {'state': 'awaiting_experience_job_title', 'current_experience': json.dumps({})})
+    if parse_yes_no(choice):
+        update_user(phone, {'state': 'awaiting_experience_job_title', 'current_experience': {}})
         send_whatsapp_message(phone, "Vamos lá. Qual era o seu cargo na próxima experiência?")
     else:
         update_user(phone, {'state': 'awaiting_improve_choice'})
@@ -561,13 +2228,24 @@ def handle_another_experience(user, message_data):
 @handle_state('awaiting_improve_choice')
 def handle_improve_choice(user, message_data):
     phone, choice = user['phone'], message_data.get('text', '').lower().strip()
-    resume_data = json.loads(user['resume_data'])
-    if choice == 'sim' and resume_data.get('experiencias'):
+    resume_data = user['resume_data']
+    if parse_yes_no(choice) and resume_data.get('experiencias'):
         send_whatsapp_message(phone, "Excelente! Deixa comigo, estou otimizando seus textos... ✍️ Isso pode levar um instante.")
-        improved_experiences = improve_experience_descriptions(resume_data.get('experiencias', []))
-        if improved_experiences: resume_data['experiencias'] = improved_experiences
-        update_user(phone, {'resume_data': json.dumps(resume_data)})
-        send_whatsapp_message(phone, "Prontinho! Textos melhorados.")
+        experiences, progress_sent = resume_data.get('experiencias', []), []
+        def on_experience(index, experience):
+            progress_sent.append(index)
+            title = experience.get('cargo') or experience.get('title') if isinstance(experience, dict) else None
+            send_whatsapp_message(phone, f"✅ Experiência {index + 1} de {len(experiences)} otimizada{f': *{title}*' if title else ''}.")
+        improved_experiences = improve_experience_descriptions(experiences, on_experience=on_experience)
+        if improved_experiences:
+            resume_data = dict(resume_data, experiencias=improved_experiences)
+            update_user(phone, {}, resume_fields={'experiencias': improved_experiences})
+            send_whatsapp_message(phone, "Prontinho! Textos melhorados.")
+        elif progress_sent:
+            # Parte das experiências já apareceu como otimizada: deixa claro que nada daquilo foi salvo.
+            send_whatsapp_message(phone, "Tive um problema para terminar a otimização, então não salvei as versões acima e mantive as suas descrições originais.")
+        else:
+            send_whatsapp_message(phone, "Não consegui melhorar os textos agora, então mantive as suas descrições originais.")
     else:
         send_whatsapp_message(phone, "Sem problemas! Vamos para a revisão final.")
     show_review_menu(phone, resume_data)
@@ -579,9 +2257,10 @@ def handle_review_choice(user, message_data):
         prices = {'basico': PRECO_BASICO, 'premium': PRECO_PREMIUM, 'revisao_humana': PRECO_REVISAO_HUMANA, 'assinatura': PRECO_ASSINATURA}
         price = prices.get(user['plan'], 0.0)
         send_whatsapp_message(phone, f"Ótimo! Para o plano *{user['plan'].replace('_', ' ').capitalize()}* (R$ {price:.2f}), pague com o PIX abaixo:")
-        send_whatsapp_message(phone, PIX_PAYLOAD_STRING)
+        send_whatsapp_message(phone, PIX_PAYLOAD_STRING, coalesce=False)
         send_whatsapp_message(phone, "Depois de pagar, é só me enviar a *foto do comprovante* que eu libero seus arquivos! ✨")
         update_user(phone, {'state': 'awaiting_payment_proof'})
+        if PRECOMPUTE_DELIVERABLES: job_queue.enqueue('precompute', phone, {'phone': phone}, max_attempts=1)
         return
     if message.isdigit() and 1 <= int(message) <= len(REVIEW_ORDER):
         item_index = int(message) - 1
@@ -598,12 +2277,12 @@ def handle_correction_input(user, message_data):
     if not field_to_edit:
         handle_default(user, message_data); return
     
-    resume_data = json.loads(user['resume_data'])
+    resume_data = user['resume_data']
     question = f"Qual o(a) {REVIEW_KEY_MAP.get(field_to_edit, field_to_edit)} correto(a)?"
     corrected_info = extract_and_format_info(field_to_edit, question, message)
-    resume_data[field_to_edit] = corrected_info
+    resume_data = dict(resume_data, **{field_to_edit: corrected_info})
     
-    update_user(phone, {'resume_data': json.dumps(resume_data), 'editing_field': None})
+    update_user(phone, {'editing_field': None}, resume_fields={field_to_edit: corrected_info})
     show_review_menu(phone, resume_data)
 
 @handle_state('awaiting_payment_proof')
@@ -612,8 +2291,10 @@ def handle_payment_proof(user, message_data):
     if 'image' in message_data and 'url' in message_data['image']:
         image_url = message_data['image']['url']
         send_whatsapp_message(phone, "Oba, recebi seu comprovante! 🕵️‍♂️ Analisando com a IA, só um segundo...")
-        analysis = analyze_pix_receipt(image_url)
-        if analysis and analysis.get('verified'):
+        analysis = analyze_pix_receipt(image_url, phone)
+        if analysis.get('reused'):
+            send_whatsapp_message(phone, "Esse comprovante já foi usado em outro pagamento. 🤔 Se for um engano, nossa equipe vai conferir e falar com você.")
+        elif analysis.get('verified'):
             send_whatsapp_message(phone, "Pagamento confirmado! ✅ Já estou preparando seus arquivos e te envio em instantes...")
             user_data_to_pass = dict(user)
             update_data = {'payment_verified': 1, 'state': 'delivering', 'payment_timestamp': datetime.now()}
@@ -621,7 +2302,7 @@ def handle_payment_proof(user, message_data):
                 update_data['subscription_valid_until'] = datetime.now() + timedelta(days=30)
             update_user(phone, update_data)
             user_data_to_pass.update(update_data)
-            run_long_task_in_background(target_func=deliver_final_product, args=(user_data_to_pass,))
+            job_queue.enqueue('delivery', phone, delivery_payload(user_data_to_pass))
         else:
             send_whatsapp_message(phone, "Hmm, não consegui confirmar o pagamento para o nome correto. Tente enviar uma imagem mais nítida do comprovante.")
     else:
@@ -630,16 +2311,31 @@ def handle_payment_proof(user, message_data):
 @handle_state('awaiting_interview_prep_choice')
 def handle_interview_prep(user, message_data):
     phone, choice = user['phone'], message_data.get('text', '').lower().strip()
-    if choice == 'sim':
+    if parse_yes_no(choice):
         send_whatsapp_message(phone, "Ótima ideia! Analisando seu perfil para criar as melhores perguntas... 🧠")
-        resume_data = json.loads(user['resume_data'])
-        questions = generate_interview_questions(resume_data)
-        if questions: send_whatsapp_message(phone, f"Aqui estão algumas perguntas para você treinar:\n\n{questions}")
-        send_whatsapp_message(phone, "Boa sorte na sua preparação! 🚀")
+        resume_data = user['resume_data']
+        sent_questions = []
+        def send_question(question):
+            # Cada pergunta sai assim que o modelo termina de escrevê-la.
+            if not sent_questions: send_whatsapp_message(phone, "Aqui estão algumas perguntas para você treinar:")
+            sent_questions.append(question)
+            send_whatsapp_message(phone, question)
+        questions = generate_interview_questions(resume_data, on_question=send_question)
+        if questions and sent_questions: send_whatsapp_message(phone, "Boa sorte na sua preparação! 🚀")
+        elif sent_questions: send_whatsapp_message(phone, "Tive um problema para terminar a lista, mas as perguntas acima já servem para você treinar. Boa sorte! 🚀")
+        else: send_whatsapp_message(phone, "Não consegui gerar as perguntas agora. 😕 Muito sucesso na sua jornada! 🚀")
     else:
         send_whatsapp_message(phone, "Entendido! Sem problemas. Muito sucesso na sua jornada! 🚀")
     update_user(phone, {'state': 'completed'})
 
+@handle_state('delivering')
+def handle_delivering(user, message_data):
+    send_whatsapp_message(user['phone'], "Seus arquivos estão sendo preparados e chegam em instantes! ⏳")
+
+@handle_state('delivery_failed')
+def handle_delivery_failed(user, message_data):
+    send_whatsapp_message(user['phone'], "Nossa equipe já está cuidando da entrega dos seus arquivos e vai falar com você em breve. Para criar um currículo novo, digite 'oi'.")
+
 @handle_state('completed')
 def handle_completed(user, message_data):
     send_whatsapp_message(user['phone'], f"Olá! Eu sou o {BOT_NAME}. Já finalizamos seu currículo. Se precisar criar um novo ou usar seus benefícios, digite 'oi' para ver as opções! 😉")
@@ -652,63 +2348,261 @@ def handle_default(user, message_data=None):
             if datetime.now() < valid_until:
                 days_left = (valid_until - datetime.now()).days
                 send_whatsapp_message(phone, f"Olá de novo! Sua assinatura está ativa por mais {days_left} dias. 👍\nVamos criar uma nova versão do seu currículo.")
-                update_user(phone, {'state': 'choosing_template', 'resume_data': json.dumps({'cargo': ''})})
+                update_user(phone, {'state': 'choosing_template', 'resume_data': {'cargo': ''}, 'current_experience': {}, 'editing_field': None})
                 send_whatsapp_message(phone, "Qual dos 3 templates você gostaria de usar desta vez?")
                 return
         except (TypeError, ValueError):
             logging.error(f"Timestamp inválido para assinante {phone}")
     
     update_user(phone, {
-        'state': 'awaiting_welcome', 'resume_data': json.dumps({'cargo': ''}), 'plan': 'none', 
+        'state': 'awaiting_welcome', 'resume_data': {'cargo': ''}, 'plan': 'none', 
         'template': 'none', 'payment_verified': 0, 'payment_timestamp': None, 
-        'credits': 0, 'subscription_valid_until': None, 'current_experience': json.dumps({}), 'editing_field': None
+        'credits': 0, 'subscription_valid_until': None, 'current_experience': {}, 'editing_field': None
     })
     handle_welcome({'phone': phone}, message_data)
 
-def deliver_final_product(user_data, test_data=None, debug=False):
+delivery_stage_executor = ThreadPoolExecutor(max_workers=DELIVERY_STAGE_WORKERS, thread_name_prefix='delivery-stage')
+delivery_stage_stats = {}
+_delivery_stats_lock = threading.Lock()
+
+def timed_stage(timings, stage, func, *args, **kwargs):
+    started_at = time.monotonic()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed_ms = 1000 * (time.monotonic() - started_at)
+        timings[stage] = round(elapsed_ms, 1)
+        delivery_stage_seconds.observe(elapsed_ms / 1000, stage)
+        with _delivery_stats_lock:
+            stats = delivery_stage_stats.setdefault(stage, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+def get_delivery_stats():
+    with _delivery_stats_lock:
+        return {stage: {'count': stats['count'], 'avg_ms': round(stats['total_ms'] / stats['count'], 1), 'max_ms': round(stats['max_ms'], 1)}
+                for stage, stats in delivery_stage_stats.items()}
+
+def notify_admin_for_review(phone, resume_data, pdf_bytes, filename):
+    send_whatsapp_message(ADMIN_PHONE_NUMBER, f"Nova revisão solicitada!\n\nCliente: {resume_data.get('nome_completo')}\nTelefone: {phone}\nPlano: Revisão Humana")
+    return send_whatsapp_document(ADMIN_PHONE_NUMBER, pdf_bytes, f"REVISAR_{filename}")
+
+def delivery_payload(user_data):
+    return {key: user_data.get(key) for key in ('phone', 'plan', 'template', 'credits', 'resume_data')}
+
+def give_up_delivery(job, error):
+    phone = job['phone']
+    update_user(phone, {'state': 'delivery_failed'})
+    send_whatsapp_message(phone, "Tivemos um problema para entregar seus arquivos 😞. Nossa equipe já foi avisada e vai te enviar tudo em breve.")
+    send_whatsapp_message(ADMIN_PHONE_NUMBER, f"Entrega falhou após {job['attempts']} tentativas.\n\nTelefone: {phone}\nEtapas concluídas: {', '.join(job['checkpoints']) or 'nenhuma'}\nErro: {error}")
+
+@job_handler('delivery', on_give_up=give_up_delivery)
+def run_delivery_job(job):
+    deliver_final_product(job['payload'], job=job)
+
+class PrecomputedDeliverables:
+    # Entregáveis (PDF em português e, nos planos com inglês, tradução e PDF em inglês) preparados
+    # enquanto o usuário paga, na tabela `precomputed_deliverables`. Cada linha vale só para o hash do
+    # currículo com que foi gerada; qualquer edição muda o hash e update_user ainda apaga a linha. Edições
+    # feitas em outro processo chegam pelo user_invalidations (UserCache.sync -> revalidate).
+    def __init__(self):
+        self._phones = set()  # telefones com linha gravada por este processo (evita DELETE a cada update_user)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_hash(resume_data, template, plan):
+        canonical = json.dumps({'data': resume_data, 'template': template, 'english': plan in ENGLISH_PLANS, 'version': PdfRenderCache.VERSION},
+                               sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, phone, resume_hash):
+        row = get_db_connection().execute("SELECT * FROM precomputed_deliverables WHERE phone = ? AND resume_hash = ?", (phone, resume_hash)).fetchone()
+        precompute_results.inc('hit' if row else 'miss')
+        if row is None: return None
+        with self._lock: self._phones.add(phone)
+        return {'pt_pdf': row['pt_pdf'], 'en_pdf': row['en_pdf'], 'english_data': json.loads(row['english_data']) if row['english_data'] else None}
+
+    def put(self, phone, resume_hash, pt_pdf, english_data=None, en_pdf=None):
+        with get_db_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO precomputed_deliverables (phone, resume_hash, pt_pdf, english_data, en_pdf, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (phone, resume_hash, pt_pdf, json.dumps(english_data, ensure_ascii=False) if english_data else None, en_pdf, time.time()))
+        with self._lock: self._phones.add(phone)
+        precompute_results.inc('stored')
+
+    def invalidate(self, phone):
+        # Chamado a cada edição do currículo; só vai ao banco se este processo gravou algo para o telefone.
+        with self._lock:
+            if phone not in self._phones: return
+        self.discard(phone)
+        precompute_results.inc('invalidated')
+
+    def revalidate(self, phone):
+        # A linha do usuário mudou em outro processo: apaga o pré-cálculo só se o hash do currículo não bate mais.
+        with self._lock:
+            if phone not in self._phones: return
+        user = get_db_connection().execute("SELECT resume_data, template, plan FROM users WHERE phone = ?", (phone,)).fetchone()
+        resume_hash = self.make_hash(json.loads(user['resume_data'] or '{}'), user['template'], user['plan']) if user else ''
+        with get_db_connection() as conn:
+            if conn.execute("DELETE FROM precomputed_deliverables WHERE phone = ? AND resume_hash != ?", (phone, resume_hash)).rowcount:
+                precompute_results.inc('invalidated')
+            if conn.execute("SELECT 1 FROM precomputed_deliverables WHERE phone = ?", (phone,)).fetchone() is None:
+                with self._lock: self._phones.discard(phone)
+
+    def discard(self, phone):
+        with get_db_connection() as conn:
+            conn.execute("DELETE FROM precomputed_deliverables WHERE phone = ?", (phone,))
+        with self._lock: self._phones.discard(phone)
+
+    def purge(self, max_age_hours):
+        # Quem nunca pagou: as linhas antigas saem na varredura periódica.
+        with get_db_connection() as conn:
+            return conn.execute("DELETE FROM precomputed_deliverables WHERE created_at < ?", (time.time() - max_age_hours * 3600,)).rowcount
+
+    def stats(self):
+        row = get_db_connection().execute("SELECT COUNT(*) AS total, COALESCE(SUM(LENGTH(pt_pdf) + COALESCE(LENGTH(en_pdf), 0)), 0) AS size FROM precomputed_deliverables").fetchone()
+        return {'enabled': PRECOMPUTE_DELIVERABLES, 'stored': row['total'], 'size_bytes': row['size']}
+
+precomputed_deliverables = PrecomputedDeliverables()
+
+@job_handler('precompute')
+def run_precompute_job(job):
+    # Roda nos workers da fila assim que o usuário entra em awaiting_payment_proof. Se ele já saiu desse
+    # estado (pagou, recomeçou) ou editou o currículo durante o cálculo, o resultado é descartado.
+    phone = job['phone']
+    user = get_user(phone)
+    if not user or user['state'] != 'awaiting_payment_proof': return
+    resume_data, template, plan = user['resume_data'], user['template'], user['plan']
+    resume_hash = PrecomputedDeliverables.make_hash(resume_data, template, plan)
+    timings = {}
+    pt_pdf = timed_stage(timings, 'precompute_render_pt', generate_resume_pdf, resume_data, template)
+    english_data = en_pdf = None
+    if plan in ENGLISH_PLANS:
+        english_data = timed_stage(timings, 'precompute_translate_en', translate_resume_data_to_english, resume_data)
+        if english_data: en_pdf = timed_stage(timings, 'precompute_render_en', generate_resume_pdf, english_data, template, lang='en')
+    current = get_user(phone)
+    if (not current or current['state'] != 'awaiting_payment_proof'
+            or PrecomputedDeliverables.make_hash(current['resume_data'], current['template'], current['plan']) != resume_hash):
+        precompute_results.inc('stale'); return
+    precomputed_deliverables.put(phone, resume_hash, pt_pdf, english_data, en_pdf)
+    logging.info(f"Entregáveis de {phone} pré-calculados. Tempos por etapa (ms): {timings}")
+
+def recover_stuck_deliveries():
+    # Usuários em 'delivering' sem tarefa ativa na fila (ex.: entregas iniciadas antes da fila durável).
+    rows = get_db_connection().execute('''
+        SELECT phone FROM users WHERE state = 'delivering'
+        AND NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.phone = users.phone AND kind = 'delivery' AND status IN ('pending', 'running'))
+    ''').fetchall()
+    for row in rows:
+        logging.warning(f"Entrega de {row['phone']} estava parada em 'delivering'; reenfileirando.")
+        job_queue.enqueue('delivery', row['phone'], delivery_payload(get_user(row['phone'])))
+    return len(rows)
+
+def deliver_final_product(user_data, test_data=None, debug=False, job=None):
+    # Pipeline de entrega: a tradução começa junto com a renderização do PDF em português, os envios
+    # ao usuário saem em ordem por um canal próprio enquanto o próximo PDF é gerado, e o envio ao
+    # admin (revisão humana) corre em paralelo. O tempo de cada etapa fica em `timings`.
+    # Rodando pela fila (`job`), cada etapa concluída vira checkpoint: uma nova tentativa recomeça da
+    # etapa que falhou, reaproveitando os PDFs e a tradução já gerados.
     with app.app_context():
         phone, plan, template = user_data['phone'], user_data['plan'], user_data['template']
-        resume_data = test_data if test_data else json.loads(user_data['resume_data'])
-        
-        if plan != 'assinatura' and not debug and user_data.get('credits', 0) < 1:
+        resume_data = test_data if test_data else user_data['resume_data']
+        checkpoints = job['checkpoints'] if job else {}
+
+        def mark(stage, value=True):
+            if job: job_queue.checkpoint(job, stage, value)
+            else: checkpoints[stage] = value
+
+        def notify(stage, message):
+            if stage not in checkpoints:
+                send_whatsapp_message(phone, message)
+                mark(stage)
+
+        if plan != 'assinatura' and not debug and user_data.get('credits', 0) < 1 and 'credit_debited' not in checkpoints:
             send_whatsapp_message(phone, "Você não tem mais créditos. Digite 'oi' para ver os planos.")
             update_user(phone, {'state': 'awaiting_welcome'}); return
         
-        send_whatsapp_message(phone, "Preparando seu currículo principal...")
-        pdf_path = os.path.join(TEMP_DIR, f"Curriculo_{resume_data.get('nome_completo', 'user').replace(' ', '_')}.pdf")
-        generate_resume_pdf(resume_data, template, pdf_path)
-        send_whatsapp_document(phone, pdf_path, os.path.basename(pdf_path), "Seu currículo novinho em folha!")
-        
-        if plan in ['premium', 'revisao_humana', 'assinatura']:
-            send_whatsapp_message(phone, "Gerando sua versão em Inglês...")
-            english_data = translate_resume_data_to_english(resume_data)
-            if english_data:
-                english_pdf_path = os.path.join(TEMP_DIR, f"Resume_{english_data.get('full_name', 'user').replace(' ', '_')}.pdf")
-                generate_resume_pdf(english_data, template, english_pdf_path)
-                send_whatsapp_document(phone, english_pdf_path, os.path.basename(english_pdf_path), "Aqui está sua versão em Inglês!")
-                os.remove(english_pdf_path)
-            else:
-                send_whatsapp_message(phone, "Desculpe, não foi possível gerar a versão em inglês do seu currículo neste momento.")
-
-        if plan == 'revisao_humana':
-            send_whatsapp_message(ADMIN_PHONE_NUMBER, f"Nova revisão solicitada!\n\nCliente: {resume_data.get('nome_completo')}\nTelefone: {phone}\nPlano: Revisão Humana")
-            send_whatsapp_document(ADMIN_PHONE_NUMBER, pdf_path, f"REVISAR_{os.path.basename(pdf_path)}")
-            send_whatsapp_message(phone, "Sua solicitação de revisão foi enviada para nossa equipe! Em até 24h úteis um especialista entrará em contato. 👨‍💼")
-        
-        os.remove(pdf_path)
+        timings, started_at = {}, time.monotonic()
+        send_failed = threading.Event()
+
+        wants_english = plan in ENGLISH_PLANS
+        # Pré-calculado na espera do pagamento (run_precompute_job): só vale se o hash do currículo bater.
+        precomputed = precomputed_deliverables.get(phone, PrecomputedDeliverables.make_hash(resume_data, template, plan)) if not test_data else None
+
+        def rendered_pdf(lang, data):
+            pdf_bytes = job_queue.load_artifact(job, f"{lang}.pdf") if job and f"{lang}_rendered" in checkpoints else None
+            if pdf_bytes is None and precomputed and precomputed[f"{lang}_pdf"] and (lang == 'pt' or data == precomputed['english_data']):
+                pdf_bytes = precomputed[f"{lang}_pdf"]
+            if pdf_bytes is None:
+                pdf_bytes = timed_stage(timings, f'render_{lang}', generate_resume_pdf, data, template, lang=lang)
+                if job: job_queue.save_artifact(job, f"{lang}.pdf", pdf_bytes)
+                mark(f"{lang}_rendered")
+            return pdf_bytes
+
+        def send_stage(stage, func, *args):
+            # Envios ao usuário em ordem: se um falhar, os seguintes não saem e a tarefa é repetida.
+            if send_failed.is_set() or f"{stage}_sent" in checkpoints: return
+            if not timed_stage(timings, f'upload_{stage}', func, *args):
+                send_failed.set()
+                raise RuntimeError(f"Falha no envio da etapa '{stage}' para {phone}")
+            mark(f"{stage}_sent")
+
+        english_data = checkpoints.get('en_translated') or (precomputed and precomputed['english_data'])
+        needs_translation = wants_english and 'en_sent' not in checkpoints and english_data is None
+        translation_future = delivery_stage_executor.submit(timed_stage, timings, 'translate_en', translate_resume_data_to_english, resume_data) if needs_translation else None
+        user_channel = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'delivery-{phone}')
+        pending_sends = []
+        try:
+            filename = f"Curriculo_{resume_data.get('nome_completo', 'user').replace(' ', '_')}.pdf"
+            if 'pt_sent' not in checkpoints or (plan == 'revisao_humana' and 'admin_sent' not in checkpoints):
+                pending_sends.append(user_channel.submit(notify, 'pt_notice', "Preparando seu currículo principal..."))
+                pdf_bytes = rendered_pdf('pt', resume_data)
+                pending_sends.append(user_channel.submit(send_stage, 'pt', send_whatsapp_document, phone, pdf_bytes, filename, "Seu currículo novinho em folha!"))
+                if plan == 'revisao_humana' and 'admin_sent' not in checkpoints:
+                    pending_sends.append(delivery_stage_executor.submit(send_stage, 'admin', notify_admin_for_review, phone, resume_data, pdf_bytes, filename))
+            
+            if wants_english and 'en_sent' not in checkpoints:
+                pending_sends.append(user_channel.submit(notify, 'en_notice', "Gerando sua versão em Inglês..."))
+                if translation_future:
+                    try:
+                        english_data = translation_future.result()
+                    except Exception as e:
+                        logging.error(f"Erro ao traduzir currículo de {phone}: {e}", exc_info=True)
+                        english_data = None
+                    if english_data: mark('en_translated', english_data)
+                    elif job and job['attempts'] < job['max_attempts']: raise RuntimeError(f"Tradução do currículo de {phone} falhou")
+                if english_data:
+                    english_filename = f"Resume_{english_data.get('full_name', 'user').replace(' ', '_')}.pdf"
+                    english_pdf_bytes = rendered_pdf('en', english_data)
+                    pending_sends.append(user_channel.submit(send_stage, 'en', send_whatsapp_document, phone, english_pdf_bytes, english_filename, "Aqui está sua versão em Inglês!"))
+                else:
+                    pending_sends.append(user_channel.submit(send_stage, 'en', send_whatsapp_message, phone, "Desculpe, não foi possível gerar a versão em inglês do seu currículo neste momento."))
+
+            if plan == 'revisao_humana':
+                pending_sends.append(user_channel.submit(notify, 'review_notice', "Sua solicitação de revisão foi enviada para nossa equipe! Em até 24h úteis um especialista entrará em contato. 👨‍💼"))
+        finally:
+            user_channel.shutdown(wait=True)
+            errors = [future.exception() for future in pending_sends if future.exception()]
+            for error in errors: logging.error(f"Erro em envio da entrega de {phone}: {error}")
+        if errors: raise errors[0]
         
-        if plan != 'assinatura' and not debug:
+        if plan != 'assinatura' and not debug and 'credit_debited' not in checkpoints:
             new_credits = user_data['credits'] - 1
             update_user(phone, {'credits': new_credits})
+            mark('credit_debited')
             send_whatsapp_message(phone, f"Crédito utilizado! Você ainda tem {new_credits} crédito(s).")
             
+        if not test_data: precomputed_deliverables.discard(phone)
         update_user(phone, {'state': 'awaiting_interview_prep_choice'})
         send_whatsapp_message(phone, "Seus arquivos foram entregues! 📄✨\n\nComo um bônus final, gostaria de gerar uma lista de perguntas de entrevista com base no seu currículo? (Responda com *sim* ou *não*)")
+        timings['total'] = round(1000 * (time.monotonic() - started_at), 1)
+        logging.info(f"Entrega para {phone} concluída. Tempos por etapa (ms): {timings}")
 
 # ==============================================================================
 # --- 8. WEBHOOK E INICIALIZAÇÃO
 # ==============================================================================
 def process_message(phone, message_data):
+    # Chamado pela PhoneInbox, que entrega uma mensagem por telefone de cada vez, em ordem, entre os workers.
     message_text = message_data.get('text', '').lower().strip()
     user = get_user(phone)
 
@@ -722,7 +2616,13 @@ def process_message(phone, message_data):
 
     if handler:
         logging.info(f"Direcionando usuário {phone} (estado: {state}) para o handler: {handler.__name__}")
-        handler(user, message_data)
+        try:
+            with handler_seconds.time(state):
+                handler(user, message_data)
+        except Exception:
+            # O handler pode ter alterado os dicts do cache sem gravar; força releitura do banco.
+            user_cache.invalidate(phone)
+            raise
     else:
         logging.warning(f"Nenhum handler encontrado para o estado '{state}' do usuário {phone}. Redirecionando para o default.")
         handle_default(user, message_data)
@@ -731,11 +2631,50 @@ def process_message(phone, message_data):
 def health_check():
     return "Cadu está no ar! Versão PRO.", 200
 
+@app.route('/queue')
+def queue_status():
+    return jsonify(message_executor.stats()), 200
+
+@app.route('/cache')
+def cache_status():
+    return jsonify(user_cache.stats()), 200
+
+@app.route('/extraction')
+def extraction_status():
+    return jsonify(get_extraction_stats()), 200
+
+@app.route('/llm-cache')
+def llm_cache_status():
+    return jsonify(dict(completion_cache.stats(), translation_memory=translation_memory.stats())), 200
+
+@app.route('/llm-routes')
+def llm_routes_status():
+    return jsonify({task: {'model': model, 'timeout': timeout, 'max_tokens': max_tokens} for task, (model, timeout, max_tokens) in OPENAI_ROUTES.items()}), 200
+
+@app.route('/delivery')
+def delivery_status():
+    return jsonify(dict(get_delivery_stats(), precomputed=precomputed_deliverables.stats())), 200
+
+@app.route('/executors')
+def executors_status():
+    return jsonify({'jobs': job_queue.stats(), 'render': render_executor.stats()}), 200
+
+@app.route('/pdf-cache')
+def pdf_cache_status():
+    return jsonify(pdf_render_cache.stats()), 200
+
+@app.route('/metrics')
+def metrics():
+    return '\n'.join(metric.render() for metric in metrics_registry) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     try:
         data = request.json
-        logging.info(f"Webhook recebido: {json.dumps(data, indent=2)}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Webhook recebido: {json.dumps(data, ensure_ascii=False)}")
+        elif random.random() < WEBHOOK_LOG_SAMPLE_RATE:
+            logging.info(f"Webhook recebido (amostra): {json.dumps(data, ensure_ascii=False)[:WEBHOOK_LOG_MAX_CHARS]}")
         
         phone = data.get('phone')
         message_data = {}
@@ -748,8 +2687,14 @@ def webhook():
         elif 'image' in data and isinstance(data.get('image'), dict) and 'imageUrl' in data['image']:
              message_data['image'] = {'url': data['image']['imageUrl']}
 
+        start_background_services()
         if phone and message_data:
-            process_message(phone, message_data)
+            message_id = phone_inbox.push(phone, message_data)
+            if not WEBHOOK_ASYNC:
+                phone_inbox.drain(phone)
+            elif not message_executor.submit(phone, phone_inbox.drain, phone) and phone_inbox.discard(message_id):
+                logging.warning(f"Fila de mensagens cheia, recusando webhook de {phone}.")
+                return jsonify({'status': 'busy'}), 503
         else:
             logging.warning(f"Webhook de {phone} recebido sem dados de mensagem válidos.")
             
@@ -758,26 +2703,196 @@ def webhook():
         logging.error(f"Erro crítico no webhook: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def mark_sessions_reminded(conn, state, rows):
+    # Uma transação por página, com a mesma marcação de lembretes.py (shared.mark_sessions_reminded).
+    shared.mark_sessions_reminded(conn, [(row['phone'], state, row['last_interaction']) for row in rows], process_identity())
+    for row in rows: user_cache.invalidate(row['phone'])
+
 def check_abandoned_sessions():
+    # Varre estado por estado pelo índice (state, last_interaction), em páginas com keyset: memória e
+    # tempo por página são limitados. Os lembretes de cada página saem em paralelo sob REMINDER_RATE_PER_SECOND.
     with app.app_context():
         logging.info("Verificando sessões abandonadas...")
-        conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        time_limit = datetime.now() - timedelta(hours=24)
-        cursor.execute("SELECT * FROM users WHERE last_interaction < ? AND state NOT IN ('completed', 'reminded', 'delivering')", (time_limit,))
-        abandoned_users = cursor.fetchall()
-        for user in abandoned_users:
-            logging.info(f"Enviando lembrete para: {user['phone']}")
-            message = f"Olá, {BOT_NAME} passando para dar um oi! 👋 Vi que começamos a montar seu currículo mas não terminamos. Que tal continuarmos de onde paramos? É só responder a última pergunta!"
-            send_whatsapp_message(user['phone'], message)
-            update_user(user['phone'], {'state': 'reminded'})
-        conn.close()
-
-init_database()
+        started_at = time.monotonic()
+        conn = get_db_connection()
+        precomputed_deliverables.purge(PRECOMPUTE_MAX_AGE_HOURS)
+        time_limit = datetime.now() - timedelta(hours=ABANDONED_SESSION_HOURS)
+        states = sorted(set(state_handlers) - {'completed', 'reminded', 'delivering', 'delivery_failed'})
+        message = f"Olá, {BOT_NAME} passando para dar um oi! 👋 Vi que começamos a montar seu currículo mas não terminamos. Que tal continuarmos de onde paramos? É só responder a última pergunta!"
+        limiter = RateLimiter(REMINDER_RATE_PER_SECOND)
+
+        def send_reminder(phone):
+            limiter.acquire()
+            logging.info(f"Enviando lembrete para: {phone}")
+            return send_whatsapp_message(phone, message)
+
+        scanned = reminded = 0
+        with ThreadPoolExecutor(max_workers=REMINDER_WORKERS, thread_name_prefix='reminder') as pool:
+            for state in states:
+                last_key = ('', '')
+                while True:
+                    rows = conn.execute('''
+                        SELECT phone, last_interaction FROM users
+                        WHERE state = ? AND last_interaction < ? AND (last_interaction, phone) > (?, ?)
+                        ORDER BY last_interaction, phone LIMIT ?
+                    ''', (state, time_limit, *last_key, REMINDER_BATCH_SIZE)).fetchall()
+                    if not rows: break
+                    last_key = (rows[-1]['last_interaction'], rows[-1]['phone'])
+                    results = list(pool.map(send_reminder, [row['phone'] for row in rows]))
+                    sent_rows = [row for row, ok in zip(rows, results) if ok]
+                    if sent_rows: mark_sessions_reminded(conn, state, sent_rows)
+                    scanned, reminded = scanned + len(rows), reminded + len(sent_rows)
+                    if len(rows) < REMINDER_BATCH_SIZE: break
+        logging.info(f"Sessões abandonadas: {scanned} encontradas, {reminded} lembradas em {time.monotonic() - started_at:.1f}s.")
+        recover_stuck_deliveries()
+
+class LeaderLease:
+    # Lease de liderança numa linha da tabela `leases`: um único upsert condicional pega a linha se ela
+    # está livre, expirou ou já é nossa. Quem não renova em `ttl` segundos (processo morto) perde a vez.
+    def __init__(self, name, ttl):
+        self.name, self.ttl = name, ttl
+
+    @property
+    def owner(self):
+        return process_identity()
+
+    def try_acquire(self):
+        now = time.time()
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO leases (name, owner, lease_until) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+                WHERE leases.owner = excluded.owner OR leases.lease_until < ?
+            ''', (self.name, self.owner, now + self.ttl, now))
+        return cursor.rowcount == 1
+
+    def is_held(self):
+        row = get_db_connection().execute("SELECT owner, lease_until FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return bool(row and row['owner'] == self.owner and row['lease_until'] > time.time())
+
+    def release(self):
+        with get_db_connection() as conn:
+            conn.execute("UPDATE leases SET lease_until = 0 WHERE name = ? AND owner = ?", (self.name, self.owner))
+
+class ElectedScheduler:
+    # Todo worker tenta o lease a cada ttl/3; só o líder mantém um BackgroundScheduler com as tarefas
+    # periódicas. A última execução de cada tarefa fica em `scheduler_runs`, então uma troca de líder (deploy,
+    # worker reiniciado) continua o intervalo de onde parou em vez de recomeçar a contagem.
+    def __init__(self, lease, jobs):
+        self.lease, self.jobs = lease, jobs  # jobs: [(função, intervalo em segundos)]
+        self._scheduler = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid, self._scheduler = os.getpid(), None
+            threading.Thread(target=self._election_loop, name="scheduler-election", daemon=True).start()
+
+    def _election_loop(self):
+        while True:
+            try:
+                leader = self.lease.try_acquire()
+            except sqlite3.Error as e:
+                logging.error(f"Erro ao renovar o lease do agendador: {e}")
+                leader = False
+            with self._lock:
+                if leader and self._scheduler is None: self._become_leader()
+                elif not leader and self._scheduler is not None:
+                    logging.warning(f"Processo {self.lease.owner} perdeu o lease do agendador.")
+                    self._step_down()
+            time.sleep(self.lease.ttl / 3)
+
+    def _become_leader(self):
+        logging.info(f"Processo {self.lease.owner} assumiu o agendador.")
+        conn, now = get_db_connection(), time.time()
+        scheduler = BackgroundScheduler(daemon=True)
+        for func, interval in self.jobs:
+            row = conn.execute("SELECT last_run FROM scheduler_runs WHERE job = ?", (func.__name__,)).fetchone()
+            if row is None: self._record_run(func.__name__, now)  # primeira vez: conta o intervalo a partir de agora
+            next_run = max(now, row['last_run'] + interval) if row else now + interval
+            scheduler.add_job(self._run, 'interval', seconds=interval, args=(func,), id=func.__name__,
+                              next_run_time=datetime.fromtimestamp(next_run), coalesce=True, max_instances=1)
+        scheduler.add_job(recover_stuck_deliveries)  # uma vez, ao assumir
+        scheduler.start()
+        self._scheduler = scheduler
+
+    def _step_down(self):
+        self._scheduler.shutdown(wait=False)
+        self._scheduler = None
+
+    def _record_run(self, job, started_at):
+        with get_db_connection() as conn:
+            conn.execute("INSERT INTO scheduler_runs (job, last_run) VALUES (?, ?) ON CONFLICT(job) DO UPDATE SET last_run = excluded.last_run", (job, started_at))
+
+    def _run(self, func):
+        # Confere o lease antes de rodar: um líder que ficou parado além do ttl pode já ter sido substituído.
+        if not self.lease.is_held():
+            logging.warning(f"Tarefa {func.__name__} ignorada: este processo não é mais o líder.")
+            return
+        self._record_run(func.__name__, time.time())
+        func()
+
+    def stop(self):
+        with self._lock:
+            if self._pid != os.getpid(): return
+            if self._scheduler is None: return
+            self._step_down()
+            try:
+                self.lease.release()
+                logging.info(f"Processo {self.lease.owner} liberou o agendador.")
+            except sqlite3.Error as e:
+                logging.error(f"Erro ao liberar o lease do agendador: {e}")
+
+scheduler_service = ElectedScheduler(LeaderLease('scheduler', SCHEDULER_LEASE_SECONDS),
+                                     [(check_abandoned_sessions, ABANDONED_CHECK_INTERVAL_HOURS * 3600)])
+_services_pid, _services_lock = None, threading.Lock()
+
+def purge_user_invalidations():
+    # Roda em todo worker (não depende de haver um líder do agendador); o DELETE é idempotente.
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM user_invalidations WHERE created_at < datetime('now', ?)", (f"-{int(USER_INVALIDATIONS_RETENTION_SECONDS)} seconds",))
+
+def run_process_maintenance():
+    # Manutenção de cada worker, independente do agendador eleito (que roda num só processo).
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            phone_inbox.heartbeat()
+            user_cache.sync(get_db_connection())  # mesmo sem mensagens chegando (só tarefas da fila)
+            purge_user_invalidations()
+        except Exception as e:
+            logging.error(f"Erro na manutenção do processo: {e}", exc_info=True)
+
+def start_background_services():
+    # Uma vez por processo, depois do fork: confere o schema, sobe a fila de tarefas e entra na eleição
+    # do agendador. Chamado pelo hook post_worker_init do gunicorn e, como garantia, a cada webhook.
+    global _services_pid
+    if _services_pid == os.getpid(): return
+    with _services_lock:
+        if _services_pid == os.getpid(): return
+        init_database()
+        job_queue.start()
+        scheduler_service.start()
+        threading.Thread(target=run_process_maintenance, name="maintenance", daemon=True).start()
+        atexit.register(stop_background_services)
+        _services_pid = os.getpid()
+
+def stop_background_services():
+    # Ao sair, o líder solta o lease para outro worker assumir sem esperar ele expirar.
+    scheduler_service.stop()
+
+def create_app():
+    # Ponto de entrada para o gunicorn: gunicorn -c gunicorn.conf.py "main:create_app()".
+    # Com preload_app isto roda uma vez no master: o schema é criado antes do fork e a conexão é fechada
+    # para não ser herdada. Threads (fila, eleição do agendador) só sobem nos workers.
+    init_database()
+    close_db_connection()
+    return app
+
 if __name__ == '__main__':
-    scheduler = BackgroundScheduler(daemon=True)
-    scheduler.add_job(check_abandoned_sessions, 'interval', hours=6)
-    scheduler.start()
+    create_app()
+    start_background_services()
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
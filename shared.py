@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Configuração e utilitários usados pelo bot (main.py) e pelos scripts do cron (lembretes.py).
+# Só biblioteca padrão: os scripts importam isto sem carregar o app Flask, a OpenAI ou o fpdf.
+import os
+import threading
+import time
+from datetime import datetime
+
+# --- CAMINHOS DE ARQUIVOS ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('RENDER_DISK_PATH', SCRIPT_DIR)
+DATABASE_FILE = os.path.join(DATA_DIR, 'cadu_database.db')
+
+def mark_sessions_reminded(conn, sessions, origin):
+    # Usado pelas duas varreduras de lembretes (a do bot e lembretes.py), para que marquem do mesmo jeito.
+    # sessions: [(phone, state, last_interaction)] como lidos; só muda quem continua no mesmo estado e sem
+    # interação nova desde a leitura. Na mesma transação avisa os caches de usuários dos workers do bot.
+    now = datetime.now()
+    with conn:
+        conn.executemany("UPDATE users SET state = 'reminded', last_interaction = ? WHERE phone = ? AND state = ? AND last_interaction = ?",
+                         [(now, phone, state, last_interaction) for phone, state, last_interaction in sessions])
+        conn.executemany("INSERT INTO user_invalidations (phone, origin) VALUES (?, ?)", [(phone, origin) for phone, _, _ in sessions])
+
+class RateLimiter:
+    # Token bucket: no máximo `rate` chamadas por segundo (rajadas de até `burst`); rate <= 0 desliga o limite.
+    def __init__(self, rate, burst=None):
+        self.rate, self.capacity = rate, burst or max(1.0, rate)
+        self._tokens, self._updated = self.capacity, time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
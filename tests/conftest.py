@@ -0,0 +1,12 @@
+# main.py lê a configuração e abre o banco em RENDER_DISK_PATH: os testes usam um diretório temporário.
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('RENDER_DISK_PATH', tempfile.mkdtemp(prefix='cadu_tests_'))
+os.environ.setdefault('RENDER_PROCESSES', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+main.init_database()
@@ -0,0 +1,28 @@
+import threading
+
+import main
+
+
+def test_connection_is_reused_per_thread_in_wal_mode():
+    conn = main.get_db_connection()
+    assert main.get_db_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == main.DB_BUSY_TIMEOUT_MS
+    other = []
+    thread = threading.Thread(target=lambda: other.append(main.get_db_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_upsert_only_touches_the_given_columns():
+    phone = '5511900001401'
+    main.update_user(phone, {'state': 'flow_email', 'plan': 'premium', 'credits': 2})
+    main.user_cache.invalidate(phone)
+    user = main.get_user(phone)
+    assert (user['state'], user['plan'], user['credits']) == ('flow_email', 'premium', 2)
+    main.update_user(phone, {'state': 'flow_telefone'})
+    main.user_cache.invalidate(phone)
+    user = main.get_user(phone)
+    assert (user['state'], user['plan'], user['credits']) == ('flow_telefone', 'premium', 2)
+    assert main.get_db_connection().execute("SELECT COUNT(*) FROM users WHERE phone = ?", (phone,)).fetchone()[0] == 1
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import main
+
+RESUME = {'nome_completo': 'Ana Lima', 'resumo': 'Vendedora.'}
+
+
+def _stub(monkeypatch, translation):
+    # Registra, na ordem, o que chega a cada telefone; a tradução demora mais que o PDF em português.
+    outbox, lock = [], threading.Lock()
+
+    def record(phone, item):
+        with lock: outbox.append((phone, item))
+        return True
+
+    def translate(data):
+        time.sleep(0.05)
+        return translation
+
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: record(phone, message))
+    monkeypatch.setattr(main, 'send_whatsapp_document', lambda phone, document, filename, caption='': record(phone, filename))
+    monkeypatch.setattr(main, 'generate_resume_pdf', lambda data, template, path=None, lang='pt': f'%PDF-{lang}'.encode())
+    monkeypatch.setattr(main, 'translate_resume_data_to_english', translate)
+    return outbox
+
+
+def _deliver(phone, plan):
+    main.update_user(phone, {'state': 'delivering', 'plan': plan, 'credits': 1, 'template': 'moderno', 'resume_data': dict(RESUME)})
+    main.deliver_final_product(main.get_user(phone))
+    return main.get_user(phone)
+
+
+def test_user_sends_keep_their_order_and_admin_runs_alongside(monkeypatch):
+    outbox = _stub(monkeypatch, {'full_name': 'Ana Lima'})
+    phone = '5511900001101'
+    user = _deliver(phone, 'revisao_humana')
+    to_user = [item for to, item in outbox if to == phone]
+    assert to_user[:4] == ["Preparando seu currículo principal...", 'Curriculo_Ana_Lima.pdf', "Gerando sua versão em Inglês...", 'Resume_Ana_Lima.pdf']
+    assert to_user[4].startswith("Sua solicitação de revisão") and to_user[-1].startswith("Seus arquivos foram entregues")
+    assert 'REVISAR_Curriculo_Ana_Lima.pdf' in [item for to, item in outbox if to == main.ADMIN_PHONE_NUMBER]
+    assert user['credits'] == 0 and user['state'] == 'awaiting_interview_prep_choice'
+
+
+def test_failed_translation_outside_the_queue_still_finishes(monkeypatch):
+    outbox = _stub(monkeypatch, None)
+    phone = '5511900001102'
+    user = _deliver(phone, 'premium')
+    to_user = [item for to, item in outbox if to == phone]
+    assert 'Curriculo_Ana_Lima.pdf' in to_user and not any(item.startswith('Resume_') for item in to_user)
+    assert any(item.startswith("Desculpe, não foi possível gerar a versão em inglês") for item in to_user)
+    assert user['state'] == 'awaiting_interview_prep_choice'
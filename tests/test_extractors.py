@@ -0,0 +1,99 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('maria da silva souza', 'Maria da Silva Souza'),
+    ('Meu nome é joão dos santos', 'João dos Santos'),
+    ("ana d'ávila", "Ana D'Ávila"),
+])
+def test_name(message, expected):
+    assert main.extract_name_locally(message) == (expected, 1.0)
+
+
+@pytest.mark.parametrize('message', ['maria', 'não tenho nome completo agora', '123 456'])
+def test_name_rejects(message):
+    assert main.extract_name_locally(message) == (None, 0.0)
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('51999998888', '(51) 99999-8888'),
+    ('(11) 98765-4321', '(11) 98765-4321'),
+])
+def test_phone(message, expected):
+    assert main.extract_phone_locally(message) == (expected, 1.0)
+
+
+def test_phone_with_extra_digits_is_low_confidence():
+    value, confidence = main.extract_phone_locally('51999998888 ramal 22')
+    assert confidence < main.LOCAL_EXTRACTION_MIN_CONFIDENCE
+
+
+def test_email():
+    assert main.extract_email_locally('Maria.Souza@Email.com.') == ('maria.souza@email.com', 1.0)
+    assert main.extract_email_locally('a@b.com e c@d.com')[0] is None
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('porto alegre rs', 'Porto Alegre - RS'),
+    ('São Paulo - SP', 'São Paulo - SP'),
+    ('Rio de Janeiro, RJ', 'Rio de Janeiro - RJ'),
+    ('curitiba paraná', 'Curitiba - PR'),
+])
+def test_city_state(message, expected):
+    assert main.extract_city_state_locally(message) == (expected, 1.0)
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('Belém do Pará', 'Belém - PA'),
+    ('Porto Alegre no Rio Grande do Sul', 'Porto Alegre - RS'),
+    ('Feira de Santana na Bahia', 'Feira de Santana - BA'),
+])
+def test_city_state_trailing_connective_goes_to_llm(message, expected):
+    value, confidence = main.extract_city_state_locally(message)
+    assert value == expected
+    assert confidence < main.LOCAL_EXTRACTION_MIN_CONFIDENCE
+    assert main.extract_locally('cidade_estado', message) is None
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('março de 2020 até hoje', 'Março de 2020 - Atual'),
+    ('2018 - 2021', '2018 - 2021'),
+    ('fevereiro de 2023 até janeiro 2025', 'Fevereiro de 2023 - Janeiro de 2025'),
+])
+def test_period(message, expected):
+    assert main.extract_period_locally(message) == (expected, 1.0)
+
+
+@pytest.mark.parametrize('message', [
+    'Maria Souza\nmaria@gmail.com',
+    'Analista de Vendas na Loja X de 2019 a 2023, cuidava da carteira de clientes do Nordeste',
+    'meu email é maria@gmail.com e o telefone (81) 99876-5432',
+])
+def test_bulk_message(message):
+    assert main.looks_like_bulk_message(message)
+
+
+@pytest.mark.parametrize('message', ['Maria Souza', 'maria@gmail.com', 'Recife - PE', 'Analista de Vendas', 'de 2019 a 2023', 'sim'])
+def test_not_bulk_message(message):
+    assert not main.looks_like_bulk_message(message)
+
+
+@pytest.mark.parametrize('message', [
+    'Sou apaixonada por atendimento ao cliente e tenho experiência com vendas desde 2015.\nBusco crescer na área comercial e liderar equipes.',
+    'Graduação em Administração pela UFPE, de 2015 a 2019, e pós-graduação em Finanças concluída em 2021',
+    'Comunicação, Excel avançado, Power BI, negociação,\nliderança de equipes, atendimento ao cliente, inglês intermediário',
+    'Cuidava do financeiro de 2019 a 2023, atendia fornecedores e fechava o caixa.\nReduzi os atrasos de pagamento em 30%.',
+])
+def test_free_text_answers_are_not_bulk(message):
+    assert main.looks_like_bulk_message(message)  # Fora das etapas de texto livre, ainda contam como lote.
+    assert not main.looks_like_bulk_message(message, free_text=True)
+
+
+@pytest.mark.parametrize('message', [
+    'Maria Souza, maria@gmail.com, (81) 99876-5432',
+    'Analista de Vendas na Loja X de 2019 a 2023. Contato: maria@gmail.com',
+])
+def test_free_text_bulk_needs_two_fields(message):
+    assert main.looks_like_bulk_message(message, free_text=True)
@@ -0,0 +1,33 @@
+import main
+
+PHONE = '5511900000401'
+PASTED = ('Resumo: quero crescer na área comercial. Analista de Vendas na Loja X de 2019 a 2023. '
+          'Contato: maria@gmail.com, (81) 99876-5432')
+BULK_FIELDS = {'resumo': 'Quero crescer na área comercial.',
+               'experiencia': {'cargo': 'Analista de Vendas', 'empresa': 'Loja X', 'periodo': '2019 - 2023'}}
+
+
+def _send(phone, text):
+    user = main.get_user(phone)
+    main.state_handlers[user['state']](user, {'text': text})
+    return main.get_user(phone)
+
+
+def test_experience_pasted_mid_flow_is_completed_in_the_experience_section(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: sent.append(message))
+    monkeypatch.setattr(main, 'extract_bulk_fields', lambda message: dict(BULK_FIELDS))
+    main.update_user(PHONE, {'state': 'flow_resumo', 'current_experience': {},
+                             'resume_data': {'cargo': '', 'nome_completo': 'Maria Souza', 'cidade_estado': 'Recife - PE',
+                                             'telefone': '(81) 99876-5432', 'email': 'maria@gmail.com'}})
+    assert _send(PHONE, PASTED)['state'] == 'flow_formacao'
+    _send(PHONE, 'Graduação em Administração')
+    _send(PHONE, 'Excel, negociação')
+    _send(PHONE, 'Excel avançado')
+    user = _send(PHONE, 'pronto')
+    assert user['state'] == 'awaiting_experience_description'
+    assert user['current_experience'] == BULK_FIELDS['experiencia']
+    user = _send(PHONE, 'Atendia a carteira de clientes do Nordeste')
+    assert user['state'] == 'awaiting_another_experience'
+    assert user['current_experience'] == {}
+    assert user['resume_data']['experiencias'] == [dict(BULK_FIELDS['experiencia'], descricao='Atendia a carteira de clientes do Nordeste')]
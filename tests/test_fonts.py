@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+
+import main
+
+TEXT = "Currículo de João Ávila — Gestão, Logística e Atenção ao Cliente (São Paulo - SP) ✓"
+
+
+def _render(registry, text=TEXT):
+    pdf = main.FPDF()
+    pdf.set_creation_date(datetime(2025, 1, 1, tzinfo=timezone.utc))
+    registry.install(pdf)
+    pdf.add_page()
+    for style in ('', 'B', 'I', 'BI'):
+        pdf.set_font(main.FontRegistry.FAMILY, style, 12)
+        pdf.multi_cell(0, 8, text, new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+def test_cloned_fonts_render_like_add_font():
+    # Se uma versão nova do fpdf2 mudar os internos usados por _clone, este teste falha em vez de o
+    # registro cair em silêncio no add_font por documento.
+    cloned = main.FontRegistry()
+    fresh = main.FontRegistry()
+    fresh._clone_supported = False
+    first = _render(cloned)
+    assert cloned._clone_supported
+    assert first == _render(fresh)
+    # Um segundo documento do mesmo registro não herda o subset (glifos usados) do primeiro.
+    assert _render(cloned, 'Experiência: 2019 - 2023') == _render(fresh, 'Experiência: 2019 - 2023')
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import main
+
+
+def _clear():
+    with main.get_db_connection() as conn: conn.execute("DELETE FROM inbox")
+
+
+def _in_other_thread(func, *args):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func(*args)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_drain_processes_messages_of_a_phone_in_order(monkeypatch):
+    _clear()
+    processed = []
+    monkeypatch.setattr(main, 'process_message', lambda phone, message_data: processed.append(message_data['text']))
+    for text in ['1', '2', '3']: main.phone_inbox.push('5511900000501', {'text': text})
+    main.phone_inbox.push('5511900000502', {'text': 'outro'})
+    main.phone_inbox.drain('5511900000501')
+    assert processed == ['1', '2', '3']
+    assert main.get_db_connection().execute("SELECT phone FROM inbox").fetchall()[0]['phone'] == '5511900000502'
+
+
+def test_only_one_consumer_per_phone():
+    _clear()
+    inbox = main.PhoneInbox(lease_seconds=60)
+    inbox.push('5511900000503', {'text': '1'})
+    inbox.push('5511900000503', {'text': '2'})
+    inbox.push('5511900000504', {'text': 'a'})
+    first = inbox._claim('5511900000503')
+    assert first is not None
+    # Outro consumidor (outro worker) não pega a caixa ocupada nem pula para a mensagem seguinte...
+    assert _in_other_thread(inbox._claim, '5511900000503') is None
+    # ...mas telefones diferentes não esperam.
+    assert _in_other_thread(inbox._claim, '5511900000504') is not None
+    second = inbox._claim('5511900000503', done_id=first['id'])
+    assert second['payload'] == '{"text": "2"}'
+
+
+def test_expired_lease_is_taken_over():
+    _clear()
+    inbox = main.PhoneInbox(lease_seconds=60)
+    inbox.push('5511900000505', {'text': '1'})
+    first = inbox._claim('5511900000505')
+    with main.get_db_connection() as conn: conn.execute("UPDATE inbox SET lease_until = ?", (time.time() - 1,))
+    assert _in_other_thread(inbox._claim, '5511900000505')['id'] == first['id']
+
+
+def test_discard_only_removes_unclaimed_messages():
+    _clear()
+    inbox = main.PhoneInbox(lease_seconds=60)
+    first = inbox.push('5511900000506', {'text': '1'})
+    second = inbox.push('5511900000506', {'text': '2'})
+    inbox._claim('5511900000506')
+    assert not inbox.discard(first)
+    assert inbox.discard(second)
+
+
+def test_stale_cache_entry_is_dropped_before_processing(monkeypatch):
+    _clear()
+    main.update_user('5511900000507', {'state': 'flow_email'})
+    assert main.get_user('5511900000507')['state'] == 'flow_email'
+    # Outro worker grava a linha; este processo ainda não leu user_invalidations.
+    with main.get_db_connection() as conn:
+        conn.execute("UPDATE users SET state = 'flow_resumo', last_interaction = ? WHERE phone = '5511900000507'", (main.datetime.now(),))
+    seen = []
+    monkeypatch.setattr(main, 'process_message', lambda phone, message_data: seen.append(main.get_user(phone)['state']))
+    main.phone_inbox.push('5511900000507', {'text': 'x'})
+    main.phone_inbox.drain('5511900000507')
+    assert seen == ['flow_resumo']
@@ -0,0 +1,91 @@
+import time
+
+import main
+
+
+def _insert(kind, phone, run_after):
+    with main.get_db_connection() as conn:
+        conn.execute("INSERT INTO jobs (kind, phone, payload, max_attempts, run_after, created_at, updated_at) VALUES (?, ?, '{}', 1, ?, ?, ?)",
+                     (kind, phone, run_after, run_after, run_after))
+
+
+def test_background_jobs_wait_for_the_rest_and_skip_the_reserved_worker():
+    with main.get_db_connection() as conn: conn.execute("DELETE FROM jobs")
+    queue = main.JobQueue(2, 60, 1)
+    queue.owner = 'test'
+    now = time.time()
+    _insert('precompute', '5511900000201', now - 10)
+    _insert('delivery', '5511900000202', now - 1)
+    assert queue._claim(background=False)['kind'] == 'delivery'
+    assert queue._claim(background=False) is None
+    assert queue._claim(background=True)['kind'] == 'precompute'
+
+
+def _queue(monkeypatch):
+    with main.get_db_connection() as conn: conn.execute("DELETE FROM jobs")
+    queue = main.JobQueue(1, 60, 1)
+    queue.owner = 'test'
+    monkeypatch.setattr(queue, 'start', lambda: None)
+    return queue
+
+
+def test_enqueue_dedupe_refreshes_the_pending_payload(monkeypatch):
+    queue = _queue(monkeypatch)
+    job_id = queue.enqueue('delivery', '5511900000203', {'plan': 'basico'})
+    assert queue.enqueue('delivery', '5511900000203', {'plan': 'premium'}) == job_id
+    job = queue._claim(background=False)
+    assert job['id'] == job_id and job['payload'] == {'plan': 'premium'}
+    # Já rodando: a execução em andamento segue com o payload que pegou.
+    assert queue.enqueue('delivery', '5511900000203', {'plan': 'assinatura'}) == job_id
+    row = main.get_db_connection().execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert row['payload'] == '{"plan": "premium"}'
+
+
+def test_failures_back_off_exponentially_then_give_up(monkeypatch):
+    queue = _queue(monkeypatch)
+    given_up = []
+    monkeypatch.setitem(main.job_handlers, 'flaky', (lambda job: 1 / 0, lambda job, error: given_up.append(job['id'])))
+    monkeypatch.setattr(main, 'JOB_RETRY_BASE_SECONDS', 10)
+    job_id = queue.enqueue('flaky', '5511900000204', {}, max_attempts=3)
+    for attempt in (1, 2):
+        started_at = time.time()
+        queue._run(queue._claim(background=False))
+        row = main.get_db_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        assert row['status'] == 'pending' and row['attempts'] == attempt and 'division by zero' in row['last_error']
+        delay = 10 * 2 ** (attempt - 1)
+        assert started_at + 0.8 * delay <= row['run_after'] <= time.time() + 1.2 * delay
+        assert queue._claim(background=False) is None
+        with main.get_db_connection() as conn: conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    queue._run(queue._claim(background=False))
+    assert main.get_db_connection().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()['status'] == 'failed'
+    assert given_up == [job_id]
+    assert (queue.completed, queue.retried, queue.failed) == (0, 2, 1)
+
+
+def test_delivery_retry_resumes_from_checkpoints(monkeypatch):
+    queue = _queue(monkeypatch)
+    monkeypatch.setattr(main, 'job_queue', queue)
+    phone = '5511900000205'
+    main.update_user(phone, {'state': 'delivering', 'plan': 'basico', 'credits': 1, 'template': 'moderno', 'resume_data': {'nome_completo': 'Ana Lima'}})
+    renders, documents, messages = [], [], []
+    monkeypatch.setattr(main, 'generate_resume_pdf', lambda data, template, path=None, lang='pt': renders.append(lang) or b'%PDF-pt')
+
+    def send_document(phone, pdf_bytes, filename, caption):
+        documents.append(filename)
+        return len(documents) > 1  # o primeiro envio falha
+
+    monkeypatch.setattr(main, 'send_whatsapp_document', send_document)
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: messages.append(message) or True)
+    job_id = queue.enqueue('delivery', phone, main.delivery_payload(main.get_user(phone)))
+    queue._run(queue._claim(background=False))
+    row = main.get_db_connection().execute("SELECT status, checkpoints FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert row['status'] == 'pending' and 'pt_rendered' in row['checkpoints'] and 'pt_sent' not in row['checkpoints']
+    assert main.get_user(phone)['credits'] == 1
+
+    with main.get_db_connection() as conn: conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    queue._run(queue._claim(background=False))
+    assert main.get_db_connection().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()['status'] == 'done'
+    assert renders == ['pt'] and len(documents) == 2
+    assert messages.count("Preparando seu currículo principal...") == 1
+    user = main.get_user(phone)
+    assert user['credits'] == 0 and user['state'] == 'awaiting_interview_prep_choice'
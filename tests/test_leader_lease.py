@@ -0,0 +1,36 @@
+import main
+
+
+def _as(monkeypatch, identity):
+    monkeypatch.setattr(main, 'process_identity', lambda: identity)
+
+
+def test_lease_is_exclusive_until_it_expires(monkeypatch):
+    lease = main.LeaderLease('test-exclusive', ttl=60)
+    _as(monkeypatch, 'host:1')
+    assert lease.try_acquire() and lease.is_held()
+    assert lease.try_acquire()  # renovação pelo próprio dono
+    _as(monkeypatch, 'host:2')
+    assert not lease.try_acquire() and not lease.is_held()
+
+
+def test_lease_is_taken_over_after_expiry(monkeypatch):
+    lease = main.LeaderLease('test-takeover', ttl=60)
+    _as(monkeypatch, 'host:1')
+    assert lease.try_acquire()
+    with main.get_db_connection() as conn:
+        conn.execute("UPDATE leases SET lease_until = lease_until - 120 WHERE name = 'test-takeover'")
+    assert not lease.is_held()
+    _as(monkeypatch, 'host:2')
+    assert lease.try_acquire() and lease.is_held()
+    _as(monkeypatch, 'host:1')
+    assert not lease.try_acquire()
+
+
+def test_release_lets_another_process_acquire(monkeypatch):
+    lease = main.LeaderLease('test-release', ttl=60)
+    _as(monkeypatch, 'host:1')
+    assert lease.try_acquire()
+    lease.release()
+    _as(monkeypatch, 'host:2')
+    assert lease.try_acquire()
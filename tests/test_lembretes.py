@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+import lembretes
+import main
+
+
+def _inactive_user(phone, state):
+    with main.get_db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO users (phone, state, resume_data, last_interaction) VALUES (?, ?, '{\"nome_completo\": \"Ana Lima\"}', ?)",
+                     (phone, state, datetime.now() - timedelta(days=2)))
+
+
+def test_run_reminds_inactive_users_once(monkeypatch):
+    _inactive_user('5511900000701', 'flow_email')
+    _inactive_user('5511900000702', 'completed')
+    sent = []
+    monkeypatch.setattr(lembretes, 'send_reminder', lambda phone, name: sent.append(phone) or True)
+    lembretes.check_for_inactive_users()
+    lembretes.check_for_inactive_users()
+    assert sent.count('5511900000701') == 1 and '5511900000702' not in sent
+    row = main.get_db_connection().execute("SELECT state FROM users WHERE phone = '5511900000701'").fetchone()
+    assert row['state'] == 'reminded'
+    origin = main.get_db_connection().execute("SELECT origin FROM user_invalidations WHERE phone = '5511900000701'").fetchone()
+    assert origin['origin'] == 'lembretes'
+
+
+def test_user_who_moved_on_is_not_marked():
+    _inactive_user('5511900000703', 'flow_email')
+    conn = main.get_db_connection()
+    read = dict(conn.execute("SELECT phone, state, last_interaction FROM users WHERE phone = '5511900000703'").fetchone())
+    # O usuário mudou de estado sem que last_interaction mudasse (ex.: gravação direta de outro processo).
+    with conn: conn.execute("UPDATE users SET state = 'completed' WHERE phone = '5511900000703'")
+    lembretes.mark_reminders_as_sent(conn, [read])
+    assert conn.execute("SELECT state FROM users WHERE phone = '5511900000703'").fetchone()['state'] == 'completed'
@@ -0,0 +1,35 @@
+import main
+
+
+def test_histogram_renders_cumulative_buckets(monkeypatch):
+    monkeypatch.setattr(main, 'metrics_registry', [])
+    histogram = main.Histogram('teste_seconds', 'Ajuda.', ('task',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3): histogram.observe(value, 'extract:cargo')
+    lines = histogram.render().split('\n')
+    assert lines[:2] == ['# HELP teste_seconds Ajuda.', '# TYPE teste_seconds histogram']
+    assert lines[2:] == [
+        'teste_seconds_bucket{task="extract:cargo",le="0.1"} 2',
+        'teste_seconds_bucket{task="extract:cargo",le="1"} 3',
+        'teste_seconds_bucket{task="extract:cargo",le="+Inf"} 4',
+        'teste_seconds_sum{task="extract:cargo"} 3.65',
+        'teste_seconds_count{task="extract:cargo"} 4',
+    ]
+    assert main.metrics_registry == [histogram]
+
+
+def test_counter_escapes_label_values(monkeypatch):
+    monkeypatch.setattr(main, 'metrics_registry', [])
+    counter = main.Counter('teste_total', 'Ajuda.', ('reason',))
+    counter.inc('erro "grave"\nlinha 2', amount=2)
+    assert counter.render().split('\n')[-1] == 'teste_total{reason="erro \\"grave\\"\\nlinha 2"} 2'
+
+
+def test_metrics_endpoint_exposes_handler_latency(monkeypatch):
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: True)
+    main.update_user('5511900001301', {'state': 'flow_email', 'resume_data': {'nome_completo': 'Ana Lima'}})
+    main.process_message('5511900001301', {'text': 'ana@x.com'})
+    response = main.app.test_client().get('/metrics')
+    assert response.status_code == 200 and response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert 'cadu_handler_duration_seconds_count{state="flow_email"}' in body
+    assert '# TYPE cadu_openai_request_duration_seconds histogram' in body
@@ -0,0 +1,76 @@
+import types
+
+import main
+
+
+def _fake_openai(monkeypatch, replies):
+    # Substitui o cliente da OpenAI: `replies` diz o que cada modelo responde; as chamadas ficam em `calls`.
+    calls = []
+
+    def create(model, messages, **kwargs):
+        calls.append(model)
+        content, finish_reason = replies[model] if isinstance(replies[model], tuple) else (replies[model], 'stop')
+        choice = types.SimpleNamespace(message=types.SimpleNamespace(content=content), finish_reason=finish_reason)
+        return types.SimpleNamespace(choices=[choice], usage=None)
+
+    fake = types.SimpleNamespace(api_key='test', chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(main, 'openai', fake)
+    return calls
+
+
+def _cache(monkeypatch, tmp_path, max_bytes=1024 * 1024, ttl=3600):
+    cache = main.CompletionCache(str(tmp_path / 'completions.db'), max_bytes, ttl)
+    monkeypatch.setattr(main, 'completion_cache', cache)
+    return cache
+
+
+def test_identical_requests_are_served_from_the_cache(monkeypatch, tmp_path):
+    calls = _fake_openai(monkeypatch, {main.OPENAI_DEFAULT_MODEL: '{"cargo": "Analista"}'})
+    cache = _cache(monkeypatch, tmp_path)
+    messages = [{'role': 'user', 'content': 'Cargo: analista'}]
+    for _ in range(3):
+        assert main.get_openai_response(messages, is_json=True, cache=True) == '{"cargo": "Analista"}'
+    assert len(calls) == 1 and (cache.hits, cache.misses) == (2, 1)
+    main.get_openai_response([{'role': 'user', 'content': 'Cargo: gerente'}], is_json=True, cache=True)
+    main.get_openai_response(messages, is_json=True)
+    assert len(calls) == 3
+
+
+def test_invalid_responses_are_not_cached(monkeypatch, tmp_path):
+    calls = _fake_openai(monkeypatch, {main.OPENAI_DEFAULT_MODEL: 'não é json'})
+    _cache(monkeypatch, tmp_path)
+    messages = [{'role': 'user', 'content': 'x'}]
+    assert main.get_openai_response(messages, is_json=True, cache=True) is None
+    assert main.get_openai_response(messages, is_json=True, cache=True) is None
+    assert len(calls) == 2
+
+
+def test_cache_expires_and_evicts_least_recently_used(monkeypatch, tmp_path):
+    cache = _cache(monkeypatch, tmp_path, max_bytes=25, ttl=3600)
+    for key in ('a', 'b', 'c'): cache.put(key, 'x' * 10, 100)
+    assert cache.get('a') is not None  # 'a' passa a ser a mais recente
+    cache.evict()
+    assert cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+    monkeypatch.setattr(cache, 'ttl', 0)
+    assert cache.get('a') is None
+
+
+def test_fast_model_escalates_to_the_default_on_bad_output(monkeypatch):
+    calls = _fake_openai(monkeypatch, {main.OPENAI_FAST_MODEL: '{"cargo": ""}', main.OPENAI_DEFAULT_MODEL: '{"cargo": "Analista"}'})
+    result = main.get_openai_response([{'role': 'user', 'content': 'x'}], is_json=True, task='extract:cargo', validate=lambda data: bool(data.get('cargo')))
+    assert result == '{"cargo": "Analista"}'
+    assert calls == [main.OPENAI_FAST_MODEL, main.OPENAI_DEFAULT_MODEL]
+
+
+def test_truncated_output_escalates_and_routes_fall_back_by_prefix(monkeypatch):
+    calls = _fake_openai(monkeypatch, {main.OPENAI_FAST_MODEL: ('{"cursos": ["A', 'length'), main.OPENAI_DEFAULT_MODEL: '{"cursos": ["Excel"]}'})
+    assert main.get_openai_response([{'role': 'user', 'content': 'x'}], is_json=True, task='extract:cursos') == '{"cursos": ["Excel"]}'
+    assert calls == [main.OPENAI_FAST_MODEL, main.OPENAI_DEFAULT_MODEL]
+    assert main.get_openai_route('extract:campo_novo') == main.OPENAI_ROUTES['extract']
+    assert main.get_openai_route('tarefa_nova') == main.OPENAI_ROUTES['default']
+
+
+def test_default_model_failure_does_not_escalate(monkeypatch):
+    calls = _fake_openai(monkeypatch, {main.OPENAI_DEFAULT_MODEL: ''})
+    assert main.get_openai_response([{'role': 'user', 'content': 'x'}], task='interview_questions') is None
+    assert calls == [main.OPENAI_DEFAULT_MODEL]
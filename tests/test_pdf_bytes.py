@@ -0,0 +1,24 @@
+import base64
+import json
+
+import main
+
+RESUME = {'nome_completo': 'Ana Lima', 'cargo': 'Vendedora', 'resumo': 'Atendo clientes há cinco anos.', 'habilidades': ['Excel']}
+
+
+def test_templates_render_straight_to_bytes(tmp_path):
+    for template in ('moderno', 'classico'):
+        pdf_bytes = main.render_template(template, RESUME)
+        assert bytes(pdf_bytes[:5]) == b'%PDF-'
+    path = tmp_path / 'curriculo.pdf'
+    pdf_bytes = main.generate_resume_pdf(RESUME, 'moderno', str(path))
+    assert path.read_bytes() == bytes(pdf_bytes)
+
+
+def test_document_body_is_the_json_the_api_expects():
+    pdf_bytes = bytes(range(256)) * (main.BASE64_CHUNK_SIZE // 128 + 1)  # vários blocos, tamanho não múltiplo de 3
+    body = json.loads(main.build_document_body('5511900000801', pdf_bytes, 'Curriculo "Ana".pdf', 'Seu currículo!').getvalue())
+    assert body['phone'] == '5511900000801' and body['fileName'] == 'Curriculo "Ana".pdf' and body['caption'] == 'Seu currículo!'
+    prefix = 'data:application/pdf;base64,'
+    assert body['document'].startswith(prefix)
+    assert base64.b64decode(body['document'][len(prefix):]) == pdf_bytes
@@ -0,0 +1,33 @@
+import os
+import time
+
+import main
+
+
+def test_key_depends_on_content_template_and_lang():
+    data = {'nome_completo': 'Ana Lima', 'habilidades': ['Excel']}
+    key = main.PdfRenderCache.make_key(data, 'moderno', 'pt')
+    assert key == main.PdfRenderCache.make_key({'habilidades': ['Excel'], 'nome_completo': 'Ana Lima'}, 'moderno', 'pt')
+    assert len({key, main.PdfRenderCache.make_key(data, 'classico', 'pt'), main.PdfRenderCache.make_key(data, 'moderno', 'en'),
+                main.PdfRenderCache.make_key(dict(data, habilidades=['Word']), 'moderno', 'pt')}) == 4
+
+
+def test_repeated_render_is_served_from_disk(monkeypatch, tmp_path):
+    renders = []
+    monkeypatch.setattr(main, 'render_pdf_bytes', lambda template, data, lang='pt': renders.append(template) or b'%PDF-1')
+    monkeypatch.setattr(main, 'pdf_render_cache', main.PdfRenderCache(str(tmp_path), 1024 * 1024))
+    data = {'nome_completo': 'Ana Lima'}
+    assert main.generate_resume_pdf(data, 'moderno') == main.generate_resume_pdf(dict(data), 'moderno') == b'%PDF-1'
+    assert renders == ['moderno'] and main.pdf_render_cache.hits == 1
+    assert [name for name in os.listdir(tmp_path) if not name.endswith('.pdf')] == []
+
+
+def test_eviction_drops_least_recently_used_files(tmp_path):
+    cache = main.PdfRenderCache(str(tmp_path), 2500)
+    for i, key in enumerate(('a', 'b')):
+        cache.put(key, b'x' * 1000)
+        os.utime(cache._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    assert cache.get('a') is not None  # leitura renova o mtime: 'b' vira a menos usada
+    cache.put('c', b'x' * 1000)
+    assert cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+    assert cache.evictions == 1
@@ -0,0 +1,30 @@
+import main
+
+# Tradução parcial: sem nome, só resumo e habilidades.
+PARTIAL_ENGLISH = {'professional_summary': 'Sales assistant with five years of experience.', 'skills': ['Excel', 'Negotiation']}
+
+
+def _headings(monkeypatch, render, data, lang):
+    texts = []
+    original = main.PDF.cell
+    monkeypatch.setattr(main.PDF, 'cell', lambda self, w=None, h=None, text='', *args, **kwargs: texts.append(text) or original(self, w, h, text, *args, **kwargs))
+    render(data, lang)
+    return texts
+
+
+def test_explicit_lang_picks_english_headings_without_full_name(monkeypatch):
+    for render in (main.generate_template_moderno, main.generate_template_classico):
+        english = _headings(monkeypatch, render, PARTIAL_ENGLISH, 'en')
+        assert 'SKILLS' in english and not any('HABILIDADES' in text for text in english)
+        portuguese = _headings(monkeypatch, render, {'resumo': 'Vendedora.', 'habilidades': ['Excel']}, 'pt')
+        assert 'HABILIDADES' in portuguese
+
+
+def test_lang_is_part_of_the_render_cache_key(monkeypatch):
+    rendered = []
+    monkeypatch.setattr(main, 'render_pdf_bytes', lambda template, data, lang='pt': rendered.append(lang) or f'{lang}-pdf'.encode())
+    monkeypatch.setattr(main, 'pdf_render_cache', main.PdfRenderCache(main.PDF_CACHE_DIR, 10 * 1024 * 1024))
+    assert main.generate_resume_pdf(PARTIAL_ENGLISH, 'moderno', lang='en') == b'en-pdf'
+    assert main.generate_resume_pdf(PARTIAL_ENGLISH, 'moderno') == b'pt-pdf'
+    assert main.generate_resume_pdf(PARTIAL_ENGLISH, 'moderno', lang='en') == b'en-pdf'
+    assert rendered == ['en', 'pt']
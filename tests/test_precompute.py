@@ -0,0 +1,65 @@
+import json
+
+import main
+
+RESUME = {'nome_completo': 'Ana Lima', 'resumo': 'Vendedora.'}
+
+
+def _precompute(monkeypatch, phone, plan='basico'):
+    main.update_user(phone, {'state': 'awaiting_payment_proof', 'plan': plan, 'template': 'moderno', 'resume_data': dict(RESUME)})
+    monkeypatch.setattr(main, 'generate_resume_pdf', lambda data, template, path=None, lang='pt': f'%PDF-{lang}'.encode())
+    monkeypatch.setattr(main, 'translate_resume_data_to_english', lambda data: {'full_name': data['nome_completo']})
+    main.run_precompute_job({'phone': phone})
+    return main.PrecomputedDeliverables.make_hash(RESUME, 'moderno', plan)
+
+
+def _stored(phone):
+    return main.get_db_connection().execute("SELECT COUNT(*) FROM precomputed_deliverables WHERE phone = ?", (phone,)).fetchone()[0]
+
+
+def test_precompute_stores_both_languages_under_the_resume_hash(monkeypatch):
+    phone = '5511900000301'
+    resume_hash = _precompute(monkeypatch, phone, plan='premium')
+    stored = main.precomputed_deliverables.get(phone, resume_hash)
+    assert stored == {'pt_pdf': b'%PDF-pt', 'en_pdf': b'%PDF-en', 'english_data': {'full_name': 'Ana Lima'}}
+    assert main.precomputed_deliverables.get(phone, main.PrecomputedDeliverables.make_hash(RESUME, 'classico', 'premium')) is None
+
+
+def test_local_edit_invalidates(monkeypatch):
+    phone = '5511900000302'
+    _precompute(monkeypatch, phone)
+    main.update_user(phone, {}, resume_fields={'resumo': 'Gerente.'})
+    assert _stored(phone) == 0
+
+
+def test_edit_from_another_process_invalidates_through_sync(monkeypatch):
+    phone = '5511900000303'
+    conn = main.get_db_connection()
+    main.user_cache.sync(conn, force=True)
+    _precompute(monkeypatch, phone)
+
+    def remote_update(sql, *params):
+        with conn:
+            conn.execute(sql, params)
+            conn.execute("INSERT INTO user_invalidations (phone, origin) VALUES (?, 'outro-worker')", (phone,))
+
+    # Mensagem que não mexe no currículo: o pré-cálculo continua valendo.
+    remote_update("UPDATE users SET last_interaction = ? WHERE phone = ?", '2026-01-01T00:00:00', phone)
+    main.user_cache.sync(conn, force=True)
+    assert _stored(phone) == 1
+    remote_update("UPDATE users SET resume_data = ? WHERE phone = ?", json.dumps(dict(RESUME, resumo='Gerente.')), phone)
+    main.user_cache.sync(conn, force=True)
+    assert _stored(phone) == 0
+
+
+def test_edit_during_precompute_discards_the_result(monkeypatch):
+    phone = '5511900000304'
+    main.update_user(phone, {'state': 'awaiting_payment_proof', 'plan': 'basico', 'template': 'moderno', 'resume_data': dict(RESUME)})
+
+    def render_and_edit(data, template, path=None, lang='pt'):
+        main.update_user(phone, {}, resume_fields={'resumo': 'Gerente.'})
+        return b'%PDF-pt'
+
+    monkeypatch.setattr(main, 'generate_resume_pdf', render_and_edit)
+    main.run_precompute_job({'phone': phone})
+    assert _stored(phone) == 0
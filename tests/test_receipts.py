@@ -0,0 +1,48 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+import main
+
+
+def _receipt(text):
+    image = Image.new('RGB', (600, 1000), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 600, 120), fill=(30, 90, 200))
+    for i, line in enumerate(text.split()):
+        draw.rectangle((40, 180 + i * 90, 40 + 60 * len(line), 230 + i * 90), fill='black')
+    return image
+
+
+def _distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def test_dhash_survives_recompression_and_resize():
+    image = _receipt('Pix enviado R$ 29,90 Cadu')
+    buffer = io.BytesIO()
+    image.resize((300, 500)).save(buffer, format='JPEG', quality=40)
+    recompressed = Image.open(io.BytesIO(buffer.getvalue()))
+    assert _distance(main.dhash(image), main.dhash(recompressed)) <= main.PIX_PHASH_MAX_DISTANCE
+    assert _distance(main.dhash(image), main.dhash(_receipt('Boleto pago R$ 1.250,00 Loja XYZ comprovante'))) > main.PIX_PHASH_MAX_DISTANCE
+
+
+def test_bands_pigeonhole():
+    # Hashes a distância < PIX_PHASH_BANDS sempre têm ao menos uma faixa idêntica.
+    rng = random.Random(0)
+    for _ in range(500):
+        phash = rng.getrandbits(64)
+        other = phash
+        for bit in rng.sample(range(64), main.PIX_PHASH_BANDS - 1): other ^= 1 << bit
+        assert any(a == b for a, b in zip(main.ReceiptRegistry.bands(phash), main.ReceiptRegistry.bands(other)))
+
+
+def test_lookup_similar_only_matches_verified_receipts_from_other_phones():
+    registry = main.ReceiptRegistry()
+    phash = 0x0123456789ABCDEF
+    registry.record('sha-a', phash, '5511900000301', True)
+    registry.record('sha-b', phash ^ 0b101, '5511900000302', False)
+    assert registry.lookup_similar(phash ^ 0b1, '5511900000399')['sha256'] == 'sha-a'
+    assert registry.lookup_similar(phash ^ 0b1, '5511900000301') is None
+    assert registry.lookup_similar(phash ^ 0xFFFF0000FFFF, '5511900000399') is None
@@ -0,0 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import main
+
+
+def test_bounded_executor_applies_backpressure():
+    executor = main.BoundedExecutor('teste', lambda workers: ThreadPoolExecutor(max_workers=workers), 1, 1)
+    release = threading.Event()
+    running = executor.submit(release.wait)
+    queued = executor.submit(lambda: 'ok')
+    assert executor.submit(lambda: 'cheio', timeout=0.05) is None
+    release.set()
+    assert running.result(timeout=5) and queued.result(timeout=5) == 'ok'
+    assert executor.submit(lambda: 'de novo', timeout=1).result(timeout=5) == 'de novo'
+    stats = executor.stats()
+    assert (stats['submitted'], stats['rejected']) == (3, 1)
+
+
+def test_process_pool_renders_the_same_document():
+    executor = main.BoundedExecutor('render-teste', main._render_process_pool, 1, 1)
+    data = {'nome_completo': 'Ana Lima', 'professional_summary': 'Sales assistant.'}
+    pdf_bytes = executor.submit(main.render_template, 'classico', data, 'en').result(timeout=120)
+    assert bytes(pdf_bytes[:5]) == b'%PDF-' and len(pdf_bytes) > 1000
+    executor._executor.shutdown()
+
+
+def test_broken_pool_falls_back_to_rendering_in_process(monkeypatch):
+    def broken(*args, **kwargs):
+        raise BrokenProcessPool("processo filho morreu")
+
+    monkeypatch.setattr(main, 'RENDER_PROCESSES', 1)
+    monkeypatch.setattr(main.render_executor, 'submit', broken)
+    assert bytes(main.render_pdf_bytes('moderno', {'nome_completo': 'Ana Lima'})[:5]) == b'%PDF-'
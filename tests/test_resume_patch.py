@@ -0,0 +1,39 @@
+import copy
+import json
+import sqlite3
+
+import pytest
+
+import main
+
+BASE = {'nome': 'Ana', 'habilidades': ['Excel'], 'experiencias': [{'cargo': 'Analista', 'empresa': 'A'}], 'cursos': 'texto'}
+
+PATCHES = [
+    ({'email': 'ana@x.com'}, None, None),
+    ({'nome': 'Ana Maria', 'endereco': {'cidade': 'Recife - PE'}}, None, None),
+    (None, {'habilidades': ['Word', 'SQL']}, None),
+    (None, {'habilidades': ['Word'], 'idiomas': ['Inglês'], 'cursos': ['Python']}, None),
+    (None, None, {'experiencias': [{'cargo': 'Gerente', 'empresa': 'B'}]}),
+    (None, None, {'experiencias': [{'cargo': 'Gerente'}], 'certificacoes': ['PMP', 'ITIL']}),
+    ({'cargo': 'Gerente'}, {'habilidades': ['Liderança']}, {'experiencias': [{'cargo': 'Gerente', 'empresa': "D'Ávila"}]}),
+]
+
+
+@pytest.mark.parametrize('base', [BASE, {}, None])
+@pytest.mark.parametrize('resume_fields, resume_append, resume_prepend', PATCHES)
+def test_sql_patch_matches_apply_resume_patch(base, resume_fields, resume_append, resume_prepend):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE users (resume_data TEXT)")
+    conn.execute("INSERT INTO users VALUES (?)", (json.dumps(base) if base is not None else None,))
+    expr, params = main._resume_patch_sql(resume_fields, resume_append, resume_prepend)
+    conn.execute(f"UPDATE users SET resume_data = {expr}", params)
+    from_sql = json.loads(conn.execute("SELECT resume_data FROM users").fetchone()[0])
+    expected = main.apply_resume_patch(copy.deepcopy(base or {}), resume_fields, resume_append, resume_prepend)
+    assert from_sql == expected
+
+
+def test_update_user_prepends_experience():
+    main.update_user('5511900000101', {'state': 'flow_email', 'resume_data': BASE})
+    main.update_user('5511900000101', {}, resume_prepend={'experiencias': [{'cargo': 'Gerente'}]})
+    main.user_cache.invalidate('5511900000101')
+    assert main.get_user('5511900000101')['resume_data']['experiencias'] == [{'cargo': 'Gerente'}, {'cargo': 'Analista', 'empresa': 'A'}]
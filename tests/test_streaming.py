@@ -0,0 +1,62 @@
+import json
+
+import main
+
+QUESTIONS = "1. Fale sobre você.\n2. Por que quer a vaga?\n3. Conte um conflito que resolveu."
+EXPERIENCES = [{'cargo': 'Analista', 'descricao': 'Fazia relatórios'}, {'cargo': 'Assistente', 'descricao': 'Atendia clientes'}]
+
+
+def _stream(monkeypatch, text, succeed, cut=None):
+    # Substitui a OpenAI por um streaming que repassa o texto em pedaços e falha depois de `cut` caracteres.
+    def fake(messages, on_text=None, **kwargs):
+        chunks = [text[i:i + 7] for i in range(0, len(text) if succeed else cut, 7)]
+        for chunk in chunks: on_text(chunk)
+        return text if succeed else None
+    monkeypatch.setattr(main, 'get_openai_response', fake)
+
+
+def _capture(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: sent.append(message))
+    monkeypatch.setattr(main, 'show_review_menu', lambda phone, resume_data: None)
+    return sent
+
+
+def test_interview_questions_stream_in_full(monkeypatch):
+    _stream(monkeypatch, QUESTIONS, succeed=True)
+    received = []
+    assert main.generate_interview_questions({'cargo': 'Analista'}, on_question=received.append) == QUESTIONS
+    assert received == QUESTIONS.split('\n')
+
+
+def test_interview_stream_failing_midway_keeps_what_was_sent(monkeypatch):
+    _stream(monkeypatch, QUESTIONS, succeed=False, cut=QUESTIONS.index('3.') + 5)
+    sent = _capture(monkeypatch)
+    main.update_user('5511900000601', {'state': 'awaiting_interview_prep_choice'})
+    main.handle_interview_prep(main.get_user('5511900000601'), {'text': 'sim'})
+    # A pergunta 3 estava incompleta quando a resposta falhou: não é enviada.
+    assert '1. Fale sobre você.' in sent and '2. Por que quer a vaga?' in sent
+    assert not any(message.startswith('3.') for message in sent)
+    assert sent[-1].startswith('Tive um problema para terminar a lista')
+
+
+def test_improve_stream_failing_midway_saves_nothing(monkeypatch):
+    improved = json.dumps([{'cargo': 'Analista', 'descricao': 'Automatizou relatórios'}, {'cargo': 'Assistente', 'descricao': 'Atendeu 50 clientes/dia'}])
+    _stream(monkeypatch, improved, succeed=False, cut=improved.index('}') + 3)
+    sent = _capture(monkeypatch)
+    main.update_user('5511900000602', {'state': 'awaiting_improve_choice', 'resume_data': {'experiencias': EXPERIENCES}})
+    main.handle_improve_choice(main.get_user('5511900000602'), {'text': 'sim'})
+    assert any(message.startswith('✅ Experiência 1 de 2') for message in sent)
+    assert 'Prontinho! Textos melhorados.' not in sent
+    assert sent[-1].startswith('Tive um problema para terminar a otimização')
+    assert main.get_user('5511900000602')['resume_data']['experiencias'] == EXPERIENCES
+
+
+def test_improve_stream_success_saves_the_new_texts(monkeypatch):
+    improved = [{'cargo': 'Analista', 'descricao': 'Automatizou relatórios'}, {'cargo': 'Assistente', 'descricao': 'Atendeu 50 clientes/dia'}]
+    _stream(monkeypatch, json.dumps(improved), succeed=True)
+    sent = _capture(monkeypatch)
+    main.update_user('5511900000603', {'state': 'awaiting_improve_choice', 'resume_data': {'experiencias': EXPERIENCES}})
+    main.handle_improve_choice(main.get_user('5511900000603'), {'text': 'sim'})
+    assert sent[-1] == 'Prontinho! Textos melhorados.'
+    assert main.get_user('5511900000603')['resume_data']['experiencias'] == improved
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import main
+
+PHONES = [f'55119000012{i:02d}' for i in range(7)]
+
+
+def _user(phone, state, hours_ago):
+    with main.get_db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO users (phone, state, last_interaction) VALUES (?, ?, ?)",
+                     (phone, state, datetime.now() - timedelta(hours=hours_ago)))
+
+
+def test_sweeper_pages_through_the_index_and_marks_only_sent_reminders(monkeypatch):
+    for phone in PHONES[:5]: _user(phone, 'flow_email', 48)
+    _user(PHONES[5], 'flow_email', 1)   # ativo há pouco
+    _user(PHONES[6], 'completed', 48)   # estado que não recebe lembrete
+    sent = []
+    # O lembrete do terceiro telefone falha: ele continua no estado e entra na próxima varredura.
+    monkeypatch.setattr(main, 'send_whatsapp_message', lambda phone, message, **kwargs: sent.append(phone) or phone != PHONES[2])
+    monkeypatch.setattr(main, 'recover_stuck_deliveries', lambda: 0)
+    monkeypatch.setattr(main, 'REMINDER_BATCH_SIZE', 2)
+    main.check_abandoned_sessions()
+    assert sorted(phone for phone in sent if phone in PHONES) == PHONES[:5]
+    states = {phone: main.get_user(phone)['state'] for phone in PHONES}
+    assert [phone for phone, state in states.items() if state == 'reminded'] == [PHONES[i] for i in (0, 1, 3, 4)]
+    sent.clear()
+    main.check_abandoned_sessions()
+    assert [phone for phone in sent if phone in PHONES] == [PHONES[2]]
+
+
+def test_sweeper_query_uses_the_state_index():
+    plan = main.get_db_connection().execute('''
+        EXPLAIN QUERY PLAN SELECT phone, last_interaction FROM users
+        WHERE state = ? AND last_interaction < ? AND (last_interaction, phone) > (?, ?)
+        ORDER BY last_interaction, phone LIMIT ?
+    ''', ('flow_email', datetime.now(), '', '', 10)).fetchall()
+    details = ' '.join(row['detail'] for row in plan)
+    assert 'idx_users_state_last_interaction' in details and 'TEMP B-TREE' not in details
@@ -0,0 +1,50 @@
+import json
+
+import main
+
+RESUME = {
+    'nome_completo': 'Ana Lima', 'email': 'ana@x.com', 'cargo': 'Vendedora', 'resumo': 'Atendo clientes.',
+    'habilidades': ['Negociação', 'Excel'],
+    'experiencias': [{'cargo': 'Vendedora', 'empresa': 'Loja A', 'periodo': '2020 - 2023', 'descricao': 'Atendia clientes.'}],
+}
+
+
+def _fake_model(monkeypatch, tmp_path):
+    # Tradutor falso: prefixa "EN " em cada valor e guarda os textos que recebeu em cada pedido.
+    requests = []
+
+    def fake(messages, **kwargs):
+        batch = json.loads(messages[-1]['content'])
+        requests.append(sorted(batch.values()))
+        return json.dumps({key: f"EN {text}" for key, text in batch.items()})
+
+    monkeypatch.setattr(main, 'get_openai_response', fake)
+    monkeypatch.setattr(main, 'translation_memory', main.TranslationMemory(str(tmp_path / 'memory.db')))
+    return requests
+
+
+def test_each_text_is_translated_once_and_keys_are_mapped(monkeypatch, tmp_path):
+    requests = _fake_model(monkeypatch, tmp_path)
+    english = main.translate_resume_data_to_english(RESUME)
+    # 'Vendedora' aparece no cargo desejado e no da experiência, mas vai uma vez só ao modelo.
+    assert requests == [sorted(['Vendedora', 'Atendo clientes.', 'Negociação', 'Excel', '2020 - 2023', 'Atendia clientes.'])]
+    assert english['full_name'] == 'Ana Lima' and english['email'] == 'ana@x.com'
+    assert english['desired_role'] == 'EN Vendedora' and english['skills'] == ['EN Negociação', 'EN Excel']
+    assert english['work_experience'] == [{'title': 'EN Vendedora', 'company': 'Loja A', 'period': 'EN 2020 - 2023', 'description': 'EN Atendia clientes.'}]
+
+
+def test_edits_only_send_the_new_text(monkeypatch, tmp_path):
+    requests = _fake_model(monkeypatch, tmp_path)
+    main.translate_resume_data_to_english(RESUME)
+    edited = dict(RESUME, resumo='Gerencio a equipe.')
+    assert main.translate_resume_data_to_english(edited)['professional_summary'] == 'EN Gerencio a equipe.'
+    assert requests[1:] == [['Gerencio a equipe.']]
+    assert main.translate_resume_data_to_english(RESUME)['professional_summary'] == 'EN Atendo clientes.'
+    assert len(requests) == 2
+
+
+def test_incomplete_answer_fails_and_stores_nothing(monkeypatch, tmp_path):
+    _fake_model(monkeypatch, tmp_path)
+    monkeypatch.setattr(main, 'get_openai_response', lambda messages, **kwargs: json.dumps({'0': 'EN only one'}))
+    assert main.translate_texts_to_english(['Um texto', 'Outro texto']) is None
+    assert main.translation_memory.lookup(['Um texto', 'Outro texto']) == {}
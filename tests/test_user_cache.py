@@ -0,0 +1,42 @@
+import main
+
+
+def test_get_user_returns_independent_copies():
+    main.update_user('5511900000001', {'state': 'flow_email', 'resume_data': {'nome': 'Ana', 'experiencias': []}})
+    first = main.get_user('5511900000001')
+    first['resume_data']['nome'] = 'Outra'
+    first['resume_data']['experiencias'].append({'cargo': 'X'})
+    second = main.get_user('5511900000001')
+    assert second['resume_data'] == {'nome': 'Ana', 'experiencias': []}
+
+
+def test_update_user_does_not_keep_callers_dict():
+    resume_data = {'nome': 'Ana'}
+    main.update_user('5511900000002', {'state': 'flow_email', 'resume_data': resume_data})
+    resume_data['nome'] = 'Outra'
+    assert main.get_user('5511900000002')['resume_data'] == {'nome': 'Ana'}
+
+
+def test_patch_does_not_leak_into_earlier_reads():
+    main.update_user('5511900000003', {'state': 'flow_email', 'resume_data': {'nome': 'Ana'}})
+    before = main.get_user('5511900000003')
+    main.update_user('5511900000003', {'state': 'flow_telefone'}, resume_fields={'email': 'ana@x.com'})
+    assert before['resume_data'] == {'nome': 'Ana'}
+    assert main.get_user('5511900000003')['resume_data'] == {'nome': 'Ana', 'email': 'ana@x.com'}
+
+
+def test_purge_keeps_only_recent_invalidations():
+    with main.get_db_connection() as conn:
+        conn.execute("INSERT INTO user_invalidations (phone, origin, created_at) VALUES ('5511900000004', 'x', datetime('now', '-1 day'))")
+        conn.execute("INSERT INTO user_invalidations (phone, origin) VALUES ('5511900000005', 'x')")
+    main.purge_user_invalidations()
+    phones = [row['phone'] for row in main.get_db_connection().execute("SELECT phone FROM user_invalidations WHERE phone IN ('5511900000004', '5511900000005')")]
+    assert phones == ['5511900000005']
+
+
+def test_every_writer_records_its_origin():
+    main.update_user('5511900000006', {'state': 'flow_email'})
+    row = main.get_db_connection().execute("SELECT state, last_interaction FROM users WHERE phone = '5511900000006'").fetchone()
+    main.mark_sessions_reminded(main.get_db_connection(), 'flow_email', [{'phone': '5511900000006', 'last_interaction': row['last_interaction']}])
+    origins = main.get_db_connection().execute("SELECT origin FROM user_invalidations WHERE phone = '5511900000006'").fetchall()
+    assert len(origins) == 2 and all(row['origin'] == main.process_identity() for row in origins)
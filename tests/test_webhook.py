@@ -0,0 +1,52 @@
+import threading
+import time
+
+import main
+
+
+def test_executor_keeps_order_per_phone_and_runs_phones_in_parallel():
+    executor = main.PhoneOrderedExecutor(4, 100, name='teste')
+    done, lock = [], threading.Lock()
+    slow_started, release = threading.Event(), threading.Event()
+
+    def work(phone, i):
+        if (phone, i) == ('A', 0):
+            slow_started.set()
+            release.wait(5)
+        with lock: done.append((phone, i))
+
+    for i in range(5): executor.submit('A', work, 'A', i)
+    for i in range(5): executor.submit('B', work, 'B', i)
+    assert slow_started.wait(5)
+    # 'B' anda enquanto a primeira mensagem de 'A' está parada.
+    deadline = time.monotonic() + 5
+    while len(done) < 5 and time.monotonic() < deadline: time.sleep(0.01)
+    assert done == [('B', i) for i in range(5)]
+    release.set()
+    assert executor.wait_idle(5)
+    assert [i for phone, i in done if phone == 'A'] == list(range(5))
+
+
+def test_executor_rejects_when_full():
+    executor = main.PhoneOrderedExecutor(1, 2, name='teste')
+    release = threading.Event()
+    assert executor.submit('A', release.wait, 5)
+    time.sleep(0.05)  # a primeira já saiu da fila e está rodando
+    assert executor.submit('A', lambda: None) and executor.submit('B', lambda: None)
+    assert not executor.submit('C', lambda: None)
+    release.set()
+    assert executor.wait_idle(5) and executor.stats()['rejected'] == 1
+
+
+def test_webhook_answers_before_processing_and_503_when_full(monkeypatch):
+    with main.get_db_connection() as conn: conn.execute("DELETE FROM inbox")
+    monkeypatch.setattr(main, 'start_background_services', lambda: None)
+    monkeypatch.setattr(main, 'WEBHOOK_ASYNC', True)
+    submitted = []
+    monkeypatch.setattr(main.message_executor, 'submit', lambda phone, func, *args: submitted.append(phone) or len(submitted) == 1)
+    client = main.app.test_client()
+    assert client.post('/webhook', json={'phone': '5511900001001', 'text': {'message': 'oi'}}).status_code == 200
+    response = client.post('/webhook', json={'phone': '5511900001002', 'text': {'message': 'oi'}})
+    assert response.status_code == 503 and response.get_json() == {'status': 'busy'}
+    # A mensagem recusada sai da caixa de entrada (o Z-API vai reenviar); a aceita fica para o worker.
+    assert [row['phone'] for row in main.get_db_connection().execute("SELECT phone FROM inbox")] == ['5511900001001']
@@ -0,0 +1,48 @@
+import time
+import types
+
+import main
+
+
+def _posts(monkeypatch, window_ms=50, max_chars=4000):
+    # Substitui a sessão HTTP: cada POST fica registrado como (endpoint, texto ou nome do arquivo).
+    posts = []
+
+    def post(url, json=None, data=None, timeout=None):
+        endpoint = url.rsplit('/', 2)[-2:] if 'send-document' in url else [url.rsplit('/', 1)[-1]]
+        posts.append(('/'.join(endpoint), json['message'] if json else data.getvalue()))
+        return types.SimpleNamespace(ok=True)
+
+    monkeypatch.setattr(main.zapi_session, 'post', post)
+    monkeypatch.setattr(main, 'ZAPI_COALESCE_WINDOW_MS', window_ms)
+    monkeypatch.setattr(main, 'ZAPI_COALESCE_MAX_CHARS', max_chars)
+    return posts
+
+
+def test_texts_within_the_window_go_out_as_one_send(monkeypatch):
+    posts = _posts(monkeypatch)
+    for message in ('Ótimo!', 'Agora me diga seu e-mail.'):
+        assert main.send_whatsapp_message('5511900000901', message)
+    assert posts == []
+    time.sleep(0.2)
+    assert posts == [('send-text', 'Ótimo!\n\nAgora me diga seu e-mail.')]
+
+
+def test_document_waits_for_the_pending_texts(monkeypatch):
+    posts = _posts(monkeypatch, window_ms=5000)
+    main.send_whatsapp_message('5511900000902', 'Preparando seu currículo...')
+    main.send_whatsapp_document('5511900000902', b'%PDF-1', 'Curriculo.pdf')
+    assert [endpoint for endpoint, _ in posts] == ['send-text', 'send-document/pdf']
+    assert posts[0][1] == 'Preparando seu currículo...' and b'Curriculo.pdf' in posts[1][1]
+
+
+def test_batches_are_capped_and_coalescing_can_be_turned_off(monkeypatch):
+    posts = _posts(monkeypatch, window_ms=5000, max_chars=20)
+    main.send_whatsapp_message('5511900000903', 'a' * 10)
+    main.send_whatsapp_message('5511900000903', 'b' * 15)  # não cabe no lote: o anterior sai antes
+    assert posts == [('send-text', 'a' * 10)]
+    main.send_whatsapp_message('5511900000903', 'agora', coalesce=False)
+    assert posts[1:] == [('send-text', 'b' * 15), ('send-text', 'agora')]
+    monkeypatch.setattr(main, 'ZAPI_COALESCE_WINDOW_MS', 0)
+    main.send_whatsapp_message('5511900000903', 'sem janela')
+    assert posts[-1] == ('send-text', 'sem janela')